@@ -0,0 +1,13 @@
+"""
+Benchmarks for basic-app.
+
+Each module is a runnable script, e.g.:
+
+    python -m benchmarks.password_hasher
+
+benchmarks.suite runs the HTTP scenarios end to end and records results
+per commit, to compare them across commits:
+
+    python -m benchmarks.suite run
+    python -m benchmarks.suite compare <base.json> <head.json>
+"""
@@ -0,0 +1,85 @@
+"""Shared helpers for benchmark scripts."""
+import datetime as dt
+import math
+import os
+import platform
+import subprocess
+from typing import (
+    Any,
+    Dict,
+    List,
+)
+
+from basic_app.lib import config
+from tests import helper
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Return the nearest-rank percentile of samples.
+
+    Args:
+      samples: Measured values, in any order.
+      pct: Percentile in range (0, 100].
+    Returns:
+      The sample at the given percentile.
+    """
+    ordered = sorted(samples)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Summarize latency samples in seconds into milliseconds."""
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples) * 1000,
+    }
+
+def print_summary(name: str, summary: Dict[str, float]):
+    """Print one line of benchmark result."""
+    fields = " ".join(
+        "{}={:.3f}".format(k, v) if isinstance(v, float) else "{}={}".format(k, v)
+        for k, v in summary.items())
+    print("{:<32} {}".format(name, fields))
+
+def get_config(**overrides) -> config.Config:
+    """Return a Config of the environment, like the app reads it.
+
+    Variables Config requires default to those of .env, so benchmarks run
+    without Postgres and the app configured.
+    """
+    return helper.get_config(dict(helper.REQUIRED_ENV, **os.environ),
+        **overrides)
+
+def _git(*cmd: str) -> str:
+    try:
+        return subprocess.run(("git",) + cmd, capture_output=True, text=True,
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def run_metadata() -> Dict[str, Any]:
+    """Return the commit and machine results were measured on."""
+    return {
+        "commit": _git("rev-parse", "--short", "HEAD") or "unknown",
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "time": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def results_path(meta: Dict[str, Any], prefix: str = "") -> str:
+    """Return the default result file of the commit in meta.
+
+    Files are named benchmarks/results/<prefix><commit>[-dirty].json.
+    """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    return os.path.join(RESULTS_DIR, "{}{}{}.json".format(
+        prefix, meta["commit"], "-dirty" if meta["dirty"] else ""))
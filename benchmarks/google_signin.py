@@ -0,0 +1,69 @@
+"""
+Compare Google ID token verification latency.
+
+  fetch   google.oauth2.id_token.verify_token, which fetches the signing
+          certs over HTTP on every call, like the original sign-in route.
+  cached  GoogleIdTokenVerifier, which verifies against cached certs.
+
+Certs are served from a local stand-in endpoint, so the fetch numbers are
+a lower bound of the real round trip to Google.
+
+Run:
+
+    python -m benchmarks.google_signin --tokens 500
+"""
+import argparse
+import asyncio
+import time
+
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token
+
+from basic_app.lib import google_id_token
+from benchmarks import common
+from tests import helper
+
+CLIENT_ID = "benchmark-client-id"
+
+def bench_fetch(server: helper.GoogleCertsServer, tokens: int):
+    request = google_requests.Request()
+    samples = []
+    for _ in range(tokens):
+        token = server.sign(CLIENT_ID)
+        start = time.perf_counter()
+        id_token.verify_token(token, request, CLIENT_ID, certs_url=server.url)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+async def bench_cached(server: helper.GoogleCertsServer, tokens: int):
+    verifier = google_id_token.GoogleIdTokenVerifier(
+        CLIENT_ID, certs_url=server.url)
+    # Warm the cache like the first sign-in after start would.
+    await verifier.verify(server.sign(CLIENT_ID))
+
+    samples = []
+    for _ in range(tokens):
+        token = server.sign(CLIENT_ID)
+        start = time.perf_counter()
+        await verifier.verify(token)
+        samples.append(time.perf_counter() - start)
+    await verifier.close()
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=500)
+    args = parser.parse_args()
+
+    with helper.GoogleCertsServer() as server:
+        common.print_summary("fetch", common.summarize(
+            bench_fetch(server, args.tokens)))
+        before = server.requests
+        common.print_summary("cached", common.summarize(
+            asyncio.run(bench_cached(server, args.tokens))))
+        print("cached verifier fetched certs {} time(s)".format(
+            server.requests - before))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Measure signups/sec of daos.User.create_user against the group commit
+batch size.
+
+A batch size of 1 creates each signup in its own transaction. Larger
+sizes gather signups arriving within the window into one multi-row
+statement and one commit, as SIGNUP_BATCH_WINDOW_MS and SIGNUP_BATCH_SIZE
+do. Concurrency must exceed the batch size for batches to fill up.
+
+Needs the Postgres from docker-compose and the user table migrated:
+
+    make compose-up && alembic upgrade head
+    python -m benchmarks.group_commit --signups 5000 --concurrency 128 \\
+        --batch-sizes 1,8,32,128 --window-ms 2
+
+Commits per signup show how many signups shared a WAL flush. Rows created
+by the benchmark are deleted afterwards.
+"""
+import argparse
+import asyncio
+import time
+
+import sqlalchemy as sa
+
+from basic_app import (
+    daos,
+    models,
+)
+from basic_app.lib import (
+    config,
+    postgres,
+)
+from benchmarks import common
+from benchmarks.signup import (
+    EMAIL_DOMAIN,
+    make_command,
+)
+
+async def run(dao: daos.User, signups: int, concurrency: int,
+    duplicate_ratio: float):
+    """Returns latency samples and seconds taken by signups."""
+    queue = asyncio.Queue()
+    for i in range(signups):
+        queue.put_nowait(make_command(
+            duplicate=duplicate_ratio and i % round(1 / duplicate_ratio) == 0))
+
+    samples = []
+    async def worker():
+        while not queue.empty():
+            cmd = queue.get_nowait()
+            start = time.perf_counter()
+            await dao.create_user(cmd)
+            samples.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - start
+
+async def main_async(args):
+    conf = config.setup(args.envfile)
+    sessionmaker = postgres.create_sessionmaker(conf)
+    engine = sessionmaker.engine
+
+    commits = 0
+    def count_commit(*_):
+        nonlocal commits
+        commits += 1
+    sa.event.listen(engine.sync_engine, "commit", count_commit)
+
+    async def cleanup():
+        async with engine.begin() as conn:
+            await conn.execute(sa.delete(models.User).where(
+                models.User.email.like("%@" + EMAIL_DOMAIN)))
+
+    try:
+        for batch_size in (int(s) for s in args.batch_sizes.split(",")):
+            dao = daos.User(sessionmaker,
+                batch_window=args.window_ms / 1000 if batch_size > 1 else 0,
+                batch_size=batch_size)
+            await cleanup()
+            before = commits
+            samples, elapsed = await run(dao, args.signups, args.concurrency,
+                args.duplicate_ratio)
+
+            summary = common.summarize(samples)
+            summary["signups_per_sec"] = args.signups / elapsed
+            summary["commits_per_signup"] = (commits - before) / args.signups
+            common.print_summary("batch_size={}".format(batch_size), summary)
+    finally:
+        await cleanup()
+        await sessionmaker.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--envfile", type=str, default=".env")
+    parser.add_argument("--signups", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--batch-sizes", type=str, default="1,8,32,128",
+                        help="comma separated, 1 disables group commit")
+    parser.add_argument("--window-ms", type=float, default=2.0)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0,
+                        help="fraction of signups reusing one email")
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
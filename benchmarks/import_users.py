@@ -0,0 +1,109 @@
+"""
+Compare users/sec of importing users in bulk against looping signup.
+
+  signup  services.User.signup per user with bounded concurrency, each one
+          hashed through the scheduler and inserted in its own transaction.
+  import  services.User.import_users, passwords hashed in a process pool
+          and batches loaded with COPY.
+
+Needs the Postgres from docker-compose and the user table migrated:
+
+    make compose-up && alembic upgrade head
+    python -m benchmarks.import_users --users 2000 --processes 4
+
+Hashing dominates both modes, so the gap grows with the cores available
+to the process pool. ARGON2_* variables lower the cost to isolate the
+database side. Rows created by the benchmark are deleted afterwards.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from concurrent import futures
+
+import sqlalchemy as sa
+
+from basic_app import (
+    daos,
+    models,
+    services,
+)
+from basic_app.lib import (
+    config,
+    password,
+    postgres,
+)
+from benchmarks import common
+
+EMAIL_DOMAIN = "import-bench.example.com"
+
+def make_commands(users: int):
+    return [services.ImportUserCommand(
+        id=uuid.uuid4(),
+        email="{}@{}".format(uuid.uuid4().hex, EMAIL_DOMAIN),
+        username="bench",
+        password="password1",
+    ) for _ in range(users)]
+
+async def run_signup(service: services.User, cmds, concurrency: int):
+    queue = asyncio.Queue()
+    for cmd in cmds:
+        queue.put_nowait(cmd)
+
+    async def worker():
+        while not queue.empty():
+            cmd = queue.get_nowait()
+            await service.signup(services.SignupCommand(
+                id=cmd.id,
+                email=cmd.email,
+                username=cmd.username,
+                password=cmd.password,
+            ))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+async def main_async(args):
+    conf = common.get_config()
+    hasher = password.Argon2PasswordHasher(conf, password.HashScheduler(conf))
+    sessionmaker = postgres.create_sessionmaker(config.setup(args.envfile))
+    engine = sessionmaker.engine
+    service = services.User(dao=daos.User(sessionmaker), hasher=hasher)
+
+    async def cleanup():
+        async with engine.begin() as conn:
+            await conn.execute(sa.delete(models.User).where(
+                models.User.email.like("%@" + EMAIL_DOMAIN)))
+
+    try:
+        await cleanup()
+        start = time.perf_counter()
+        await run_signup(service, make_commands(args.users), args.concurrency)
+        elapsed = time.perf_counter() - start
+        print("{:<8} users/sec={:.1f}".format("signup", args.users / elapsed))
+
+        await cleanup()
+        with futures.ProcessPoolExecutor(args.processes) as executor:
+            start = time.perf_counter()
+            result = await service.import_users(make_commands(args.users),
+                executor, batch_size=args.batch_size)
+            elapsed = time.perf_counter() - start
+        print("{:<8} users/sec={:.1f} imported={} conflicts={}".format(
+            "import", args.users / elapsed, result.imported, len(result.conflicts)))
+    finally:
+        await cleanup()
+        await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--envfile", type=str, default=".env")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="concurrent signups in signup mode")
+    parser.add_argument("--processes", type=int, default=4,
+                        help="hashing processes in import mode")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
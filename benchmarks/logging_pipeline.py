@@ -0,0 +1,72 @@
+"""
+Measure the time a log call takes on the calling thread when the log
+destination is slow.
+
+  sync   StreamHandler writing in the calling thread, as before.
+  queue  DroppingQueueHandler with a writer thread, APP_LOGGING_QUEUE_SIZE.
+
+The stream sleeps --write-delay-ms per write to stand in for a slow stdout.
+
+    python -m benchmarks.logging_pipeline --records 2000 --write-delay-ms 1
+"""
+import argparse
+import io
+import logging
+import time
+
+from basic_app.lib import logging as app_logging
+from benchmarks import common
+
+class SlowStream(io.StringIO):
+    """A stream whose writes take delay seconds."""
+    def __init__(self, delay: float):
+        super().__init__()
+        self._delay = delay
+
+    def write(self, s):
+        time.sleep(self._delay)
+        return len(s)
+
+def run(mode: str, args):
+    conf = common.get_config(
+        logging_format="json",
+        logging_fmt="",
+        logging_level="INFO",
+        logging_levels="",
+        logging_queue_size=args.queue_size if mode == "queue" else 0,
+    )
+    app_logging.setup(conf)
+    stream = SlowStream(args.write_delay_ms / 1000)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(stream)
+    # pylint: disable=protected-access
+    if app_logging._listener:
+        for handler in app_logging._listener.handlers:
+            handler.setStream(stream)
+        dropped = app_logging._DROPPED.labels().value
+
+    logger = logging.getLogger("bench")
+    samples = []
+    for i in range(args.records):
+        start = time.perf_counter()
+        logger.info("signup %s done", i, extra={"user_id": i})
+        samples.append(time.perf_counter() - start)
+
+    common.print_summary(mode, common.summarize(samples))
+    if mode == "queue":
+        print("{:<32} dropped={}".format(
+            mode, app_logging._DROPPED.labels().value - dropped))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--write-delay-ms", type=float, default=1.0)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    args = parser.parse_args()
+    for mode in ("sync", "queue"):
+        run(mode, args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Load test POST /login through the ASGI app.
+
+Users are created up front, then concurrent clients log in with a mix of
+correct and wrong passwords. Argon2 runs with the configured parameters,
+and the user DAO is either in memory or the Postgres from docker-compose.
+
+Run:
+
+    python -m benchmarks.login --users 100 --requests 2000 --concurrency 32
+    python -m benchmarks.login --dao postgres
+    python -m benchmarks.login --dao postgres --cache
+
+With --cache the DAO reads through daos.CachedUser, and the statements
+sent to Postgres per login and the cache hit ratio are reported.
+Credentials are never cached, so logins of registered emails stay at one
+statement each. Logins of emails not registered, --unknown-ratio of them,
+are answered from the cache after the first one of each email.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+import sqlalchemy as sa
+
+import basic_app
+from basic_app import (
+    daos,
+    models,
+    routers,
+    services,
+)
+from basic_app.lib import (
+    cache,
+    config,
+    password,
+    postgres,
+)
+from benchmarks import (
+    common,
+    signup,
+    stubs,
+)
+
+EMAIL_DOMAIN = "login-bench.example.com"
+
+async def run(args):
+    # Users are created all at once, don't reject them for the queue depth.
+    conf = common.get_config(password_hasher_queue_depth=args.users)
+    hasher = password.Argon2PasswordHasher(conf, password.HashScheduler(conf))
+
+    engine = None
+    counter = None
+    if args.dao == "postgres":
+        sessionmaker = postgres.create_sessionmaker(config.setup(args.envfile))
+        engine = sessionmaker.engine
+        counter = signup.RoundTripCounter(engine)
+        dao = daos.User(sessionmaker)
+    else:
+        dao = stubs.InMemoryUserDao()
+
+    user_cache = None
+    if args.cache:
+        user_cache = cache.Cache(cache.LRUCache(args.users * 2, 60), negative_ttl=5)
+        dao = daos.CachedUser(dao, user_cache)
+
+    service = services.User(dao=dao, hasher=hasher)
+    routers.User(service, *stubs.sessions())
+    app = basic_app.API()
+
+    emails = ["{}@{}".format(i, EMAIL_DOMAIN) for i in range(args.users)]
+    await asyncio.gather(*(service.signup(services.SignupCommand(
+        id=uuid.uuid4(), email=email, username="bench", password="password1",
+    )) for email in emails))
+
+    samples = []
+    statuses = {}
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        wrong = args.wrong_ratio and i % round(1 / args.wrong_ratio) == 0
+        unknown = args.unknown_ratio and\
+            (i + 1) % round(1 / args.unknown_ratio) == 0
+        queue.put_nowait({
+            "email": "unknown-{}@{}".format(i % len(emails), EMAIL_DOMAIN)
+                if unknown else emails[i % len(emails)],
+            "password": "wrong-password" if wrong else "password1",
+        })
+
+    async with httpx.AsyncClient(app=app, base_url="http://localhost") as ac:
+        async def worker():
+            while not queue.empty():
+                body = queue.get_nowait()
+                start = time.perf_counter()
+                resp = await ac.post("/login", json=body)
+                samples.append(time.perf_counter() - start)
+                statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+        before = counter.count if counter else 0
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    common.print_summary("login", common.summarize(samples))
+    print("{:<32} logins/sec={:.1f} statuses={}".format(
+        "login", args.requests / elapsed, statuses))
+    if counter:
+        print("{:<32} round_trips/login={:.2f}".format(
+            "login", (counter.count - before) / args.requests))
+    if user_cache:
+        print("{:<32} hit_ratio={:.3f}".format(
+            "login", user_cache.stats().hit_ratio))
+
+    if engine is not None:
+        async with engine.begin() as conn:
+            await conn.execute(sa.delete(models.User).where(
+                models.User.email.like("%@" + EMAIL_DOMAIN)))
+        await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--envfile", type=str, default=".env")
+    parser.add_argument("--dao", choices=("memory", "postgres"), default="memory")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--wrong-ratio", type=float, default=0.1,
+                        help="fraction of logins with a wrong password")
+    parser.add_argument("--unknown-ratio", type=float, default=0.0,
+                        help="fraction of logins of emails not registered")
+    parser.add_argument("--cache", action="store_true",
+                        help="read users through daos.CachedUser")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Measure latency of unrelated requests while signups are hashing passwords.
+
+Two modes are compared on the same ASGI app:
+
+  inline  Argon2 runs on the event loop, like the original signup path.
+  pool    Argon2 runs through Argon2PasswordHasher's thread pool.
+
+Run:
+
+    python -m benchmarks.password_hasher --duration 5 --signups 8
+"""
+import argparse
+import asyncio
+import time
+
+import argon2
+import fastapi
+import httpx
+
+from basic_app.lib import password
+from benchmarks import common
+
+def create_app(mode: str, conf) -> fastapi.FastAPI:
+    """Create an app with one hashing route and one unrelated route."""
+    app = fastapi.FastAPI()
+    pooled = password.Argon2PasswordHasher(conf, password.HashScheduler(conf))
+    inline = argon2.PasswordHasher(
+        memory_cost=conf.argon2_memory_cost,
+        time_cost=conf.argon2_time_cost,
+        parallelism=conf.argon2_parallelism,
+        hash_len=conf.argon2_hash_len,
+        type=argon2.Type.ID,
+    )
+
+    @app.post("/signup")
+    async def signup():
+        if mode == "inline":
+            inline.hash("password1")
+        else:
+            await pooled.hash("password1")
+        return {}
+
+    @app.get("/ping")
+    async def ping():
+        return {}
+
+    return app
+
+async def run(mode: str, duration: float, signups: int, conf):
+    """Drive signups in the background and probe /ping latency."""
+    app = create_app(mode, conf)
+    deadline = time.perf_counter() + duration
+    hashed = 0
+    samples = []
+
+    async with httpx.AsyncClient(app=app, base_url="http://localhost") as ac:
+        async def signup_worker():
+            nonlocal hashed
+            while time.perf_counter() < deadline:
+                await ac.post("/signup")
+                hashed += 1
+
+        async def probe():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await ac.get("/ping")
+                samples.append(time.perf_counter() - start)
+                await asyncio.sleep(0.005)
+
+        await asyncio.gather(probe(), *(signup_worker() for _ in range(signups)))
+
+    common.print_summary("{} ping".format(mode), common.summarize(samples))
+    print("{:<32} hashes/sec={:.1f}".format(mode + " signup", hashed / duration))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=5,
+                        help="seconds to run each mode")
+    parser.add_argument("--signups", type=int, default=8,
+                        help="number of concurrent signup clients")
+    args = parser.parse_args()
+
+    conf = common.get_config()
+    for mode in ("inline", "pool"):
+        asyncio.run(run(mode, args.duration, args.signups, conf))
+
+if __name__ == "__main__":
+    main()
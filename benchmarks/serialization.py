@@ -0,0 +1,88 @@
+"""
+Measure the serialization cost of one /signup response.
+
+  before  The service result copied into the pydantic SignupResult, then
+          validated again against response_model, run through
+          jsonable_encoder and rendered by the standard json module, as
+          FastAPI does for a returned model.
+  json    The service result rendered directly by lib/response.JSONResponse.
+  orjson  The service result rendered directly by lib/response.ORJSONResponse.
+
+Run:
+
+    python -m benchmarks.serialization --iterations 20000
+"""
+import argparse
+import asyncio
+import datetime as dt
+import time
+import uuid
+
+from fastapi import (
+    responses,
+    routing,
+)
+
+from basic_app import services
+from basic_app.lib import response
+from basic_app.routers import user
+
+def get_signup_result() -> services.SignupResult:
+    now = dt.datetime.now(dt.timezone.utc)
+    return services.SignupResult(
+        id=uuid.uuid4(),
+        email="user1@example.com",
+        username="user1",
+        create_time=now,
+        update_time=now,
+    )
+
+async def before(result: services.SignupResult, field):
+    model = user.SignupResult(
+        id=result.id,
+        email=result.email,
+        username=result.username,
+        create_time=result.create_time,
+        update_time=result.update_time,
+    )
+    content = await routing.serialize_response(field=field, response_content=model)
+    return responses.JSONResponse(content).body
+
+def direct(response_class):
+    async def render(result: services.SignupResult, _):
+        return response_class({
+            "id": result.id,
+            "email": result.email,
+            "username": result.username,
+            "create_time": result.create_time,
+            "update_time": result.update_time,
+        }).body
+    return render
+
+async def run(args):
+    route = next(r for r in user.router.routes if r.path == "/signup")
+    field = route.secure_cloned_response_field
+    result = get_signup_result()
+
+    modes = [("before", before), ("json", direct(response.JSONResponse))]
+    if response.orjson:
+        modes.append(("orjson", direct(response.ORJSONResponse)))
+
+    for name, render in modes:
+        for _ in range(1000):
+            await render(result, field)
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            await render(result, field)
+        elapsed = time.perf_counter() - start
+        print("{:<8} us/response={:.2f} body={}".format(
+            name, elapsed / args.iterations * 1e6, len(await render(result, field))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Compare database round trips and signups/sec of the signup write path.
+
+  legacy   SET TRANSACTION, INSERT ... ON CONFLICT DO NOTHING and a SELECT
+           for the conflicting row, as the original service did.
+  current  daos.User.create_user, one INSERT ... RETURNING statement with
+           the isolation level, if any, sent with BEGIN.
+
+Needs the Postgres from docker-compose and the user table migrated:
+
+    make compose-up && alembic upgrade head
+    python -m benchmarks.signup --signups 2000 --concurrency 16
+
+Round trips count BEGIN, COMMIT and every statement sent to Postgres.
+Rows created by the benchmark are deleted afterwards.
+"""
+import argparse
+import asyncio
+import datetime as dt
+import time
+import uuid
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+from sqlalchemy.ext import asyncio as sa_asyncio
+from sqlalchemy.dialects import postgresql
+
+from basic_app import (
+    daos,
+    models,
+)
+from basic_app.lib import (
+    config,
+    postgres,
+)
+
+EMAIL_DOMAIN = "signup-bench.example.com"
+
+class RoundTripCounter:
+    """Count round trips issued through an engine."""
+    def __init__(self, engine: sa_asyncio.AsyncEngine):
+        self.count = 0
+        for name in ("begin", "commit", "rollback", "before_cursor_execute"):
+            sa.event.listen(engine.sync_engine, name, self._inc)
+
+    def _inc(self, *_, **__):
+        self.count += 1
+
+def make_command(duplicate: bool) -> daos.CreateUserCommand:
+    now = dt.datetime.now()
+    email = "dup@{}".format(EMAIL_DOMAIN) if duplicate else\
+        "{}@{}".format(uuid.uuid4().hex, EMAIL_DOMAIN)
+    return daos.CreateUserCommand(
+        id=uuid.uuid4(),
+        email=email,
+        username="bench",
+        password="not-a-real-hash",
+        create_time=now,
+        update_time=now,
+    )
+
+async def legacy_create_user(sessionmaker: orm.sessionmaker,
+    cmd: daos.CreateUserCommand):
+    """The signup write path before the single statement rewrite."""
+    session = sessionmaker()
+    async with session.begin():
+        await session.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        await session.execute(postgresql.insert(models.User).values(
+            id=cmd.id,
+            email=cmd.email,
+            username=cmd.username,
+            password=cmd.password,
+            create_time=cmd.create_time,
+            update_time=cmd.update_time,
+        ).on_conflict_do_nothing())
+        await session.execute(sa.select(models.User).where(sa.or_(
+            models.User.id == cmd.id,
+            models.User.email == cmd.email,
+        )))
+
+async def run(name, create_user, signups, concurrency, duplicate_ratio, counter):
+    """Run signups with bounded concurrency and print the result."""
+    queue = asyncio.Queue()
+    for i in range(signups):
+        queue.put_nowait(make_command(
+            duplicate=duplicate_ratio and i % round(1 / duplicate_ratio) == 0))
+
+    async def worker():
+        while not queue.empty():
+            await create_user(queue.get_nowait())
+
+    before = counter.count
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    print("{:<8} signups/sec={:.1f} round_trips/signup={:.2f}".format(
+        name, signups / elapsed, (counter.count - before) / signups))
+
+async def main_async(args):
+    conf = config.setup(args.envfile)
+    sessionmaker = postgres.create_sessionmaker(conf)
+    engine = sessionmaker.engine
+    counter = RoundTripCounter(engine)
+
+    dao = daos.User(sessionmaker)
+    legacy_sessionmaker = orm.sessionmaker(
+        bind=engine, expire_on_commit=False, class_=sa_asyncio.AsyncSession)
+
+    async def legacy(cmd):
+        await legacy_create_user(legacy_sessionmaker, cmd)
+
+    async def cleanup():
+        async with engine.begin() as conn:
+            await conn.execute(sa.delete(models.User).where(
+                models.User.email.like("%@" + EMAIL_DOMAIN)))
+
+    try:
+        for name, create_user in (("legacy", legacy), ("current", dao.create_user)):
+            await cleanup()
+            await run(name, create_user, args.signups, args.concurrency,
+                args.duplicate_ratio, counter)
+    finally:
+        await cleanup()
+        await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--envfile", type=str, default=".env")
+    parser.add_argument("--signups", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0,
+                        help="fraction of signups reusing one email")
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
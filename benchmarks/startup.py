@@ -0,0 +1,120 @@
+"""
+Measure how long a fresh process takes to import the app.
+
+Each run is a new interpreter, so nothing is cached in sys.modules:
+
+  import   Cumulative import time of basic_app, from python -X importtime.
+  process  Wall time of a process importing basic_app and building the
+           ASGI app, interpreter startup included.
+
+Import time is also summed per top-level package, to show where it goes.
+Medians over the runs are written by default to
+benchmarks/results/startup-<commit>.json, which the suite compares like
+any other result file:
+
+    python -m benchmarks.startup --runs 10
+    python -m benchmarks.suite compare benchmarks/results/startup-a1b2c3d.json \\
+        benchmarks/results/startup-e4f5a6b.json
+"""
+import argparse
+import collections
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import (
+    Dict,
+    List,
+    Tuple,
+)
+
+from benchmarks import common
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "src")
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (SRC_DIR, env.get("PYTHONPATH")) if p)
+    return env
+
+def parse_importtime(output: str) -> List[Tuple[str, int, int]]:
+    """Parse -X importtime output into (module, self us, cumulative us)."""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(own), int(cumulative)))
+    return rows
+
+def measure_import() -> Tuple[float, Dict[str, float]]:
+    """Returns import ms of basic_app, and self ms per top-level package."""
+    proc = subprocess.run(
+        (sys.executable, "-X", "importtime", "-c", "import basic_app"),
+        env=_env(), capture_output=True, text=True, check=True)
+    rows = parse_importtime(proc.stderr)
+    packages = collections.Counter()
+    for name, own, _ in rows:
+        packages[name.split(".")[0]] += own / 1000
+    total = next(cumulative for name, _, cumulative in rows
+        if name == "basic_app")
+    return total / 1000, dict(packages)
+
+def measure_process() -> float:
+    """Returns ms taken by a process building the app."""
+    start = time.perf_counter()
+    subprocess.run(
+        (sys.executable, "-c", "import basic_app; basic_app.API()"),
+        env=_env(), check=True)
+    return (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15,
+                        help="packages to print")
+    parser.add_argument("--output", type=str, default="",
+                        help="result file, benchmarks/results/"
+                        "startup-<commit>.json by default")
+    args = parser.parse_args()
+
+    imports = []
+    packages = collections.defaultdict(list)
+    processes = []
+    for _ in range(args.runs):
+        total, by_package = measure_import()
+        imports.append(total)
+        for name, ms in by_package.items():
+            packages[name].append(ms)
+        processes.append(measure_process())
+
+    result = {
+        "runs": args.runs,
+        "import_ms": statistics.median(imports),
+        "process_ms": statistics.median(processes),
+    }
+    common.print_summary("startup", {k: float(v) if k != "runs" else v
+        for k, v in result.items()})
+
+    medians = sorted(((statistics.median(v), k) for k, v in packages.items()),
+        reverse=True)
+    for ms, name in medians[:args.top]:
+        print("{:<32} self_ms={:.1f}".format(name, ms))
+
+    meta = common.run_metadata()
+    output = args.output or common.results_path(meta, prefix="startup-")
+    with open(output, "w") as f:
+        json.dump({
+            "meta": meta,
+            "scenarios": {"startup": result},
+            "packages_ms": {name: ms for ms, name in medians},
+        }, f, indent=2)
+    print("results written to {}".format(output))
+
+if __name__ == "__main__":
+    main()
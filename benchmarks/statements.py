@@ -0,0 +1,126 @@
+"""
+Compare the per-insert Python overhead of Session insert methods.
+
+  legacy   A SQLAlchemy Core statement built from values on every call,
+           with to_dict reading every column through getattr, as the
+           original Session.insert and insert_on_conflict_do_nothing did.
+  cached   Session.insert and insert_on_conflict_do_nothing, binding values
+           to a statement built once per model and operation.
+
+Inserts run one after another in a single transaction, so the client CPU
+time per insert is what Python, SQLAlchemy and asyncpg spend on it. Postgres
+runs in another process and is not counted. Needs the Postgres from
+docker-compose and the user table migrated:
+
+    make compose-up && alembic upgrade head
+    python -m benchmarks.statements --inserts 5000
+
+Rows created by the benchmark are deleted afterwards.
+"""
+import argparse
+import asyncio
+import datetime as dt
+import time
+import uuid
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+from sqlalchemy.ext import asyncio as sa_asyncio
+from sqlalchemy.dialects import postgresql
+
+from basic_app import models
+from basic_app.lib import (
+    config,
+    postgres,
+)
+from benchmarks import common
+
+EMAIL_DOMAIN = "statements-bench.example.com"
+
+def make_user() -> models.User:
+    now = dt.datetime.now()
+    return models.User(
+        id=uuid.uuid4(),
+        email="{}@{}".format(uuid.uuid4().hex, EMAIL_DOMAIN),
+        username="bench",
+        password="not-a-real-hash",
+        create_time=now,
+        update_time=now,
+    )
+
+def legacy_to_dict(value: models.User) -> dict:
+    return {c.name: getattr(value, c.name, None) for c in value.__table__.columns}
+
+async def legacy_insert(session: sa_asyncio.AsyncSession, value: models.User):
+    await session.execute(sa.insert(type(value)).values(**legacy_to_dict(value)))
+
+async def legacy_insert_on_conflict_do_nothing(
+    session: sa_asyncio.AsyncSession, value: models.User):
+    stmt = postgresql.insert(type(value)).values(**legacy_to_dict(value))
+    await session.execute(stmt.on_conflict_do_nothing(index_elements=["id"]))
+
+async def cached_insert(session: sa_asyncio.AsyncSession, value: models.User):
+    await postgres.Session(session).insert(value)
+
+async def cached_insert_on_conflict_do_nothing(
+    session: sa_asyncio.AsyncSession, value: models.User):
+    await postgres.Session(session).insert_on_conflict_do_nothing(value, ["id"])
+
+CASES = (
+    ("legacy insert", legacy_insert),
+    ("cached insert", cached_insert),
+    ("legacy on_conflict", legacy_insert_on_conflict_do_nothing),
+    ("cached on_conflict", cached_insert_on_conflict_do_nothing),
+)
+
+async def bench(sessionmaker: orm.sessionmaker, insert, inserts: int):
+    """Returns wall time samples and CPU seconds of inserts."""
+    users = [make_user() for _ in range(inserts)]
+    session = sessionmaker()
+    async with session.begin():
+        # Warm up the compiled and prepared statement caches.
+        await insert(session, make_user())
+
+        samples = []
+        cpu = time.process_time()
+        for user in users:
+            start = time.perf_counter()
+            await insert(session, user)
+            samples.append(time.perf_counter() - start)
+        cpu = time.process_time() - cpu
+    return samples, cpu
+
+async def main_async(args):
+    conf = config.setup(args.envfile)
+    engine = postgres.create_sessionmaker(conf).engine
+    sessionmaker = orm.sessionmaker(
+        bind=engine, expire_on_commit=False, class_=sa_asyncio.AsyncSession)
+
+    async def cleanup():
+        async with engine.begin() as conn:
+            await conn.execute(sa.delete(models.User).where(
+                models.User.email.like("%@" + EMAIL_DOMAIN)))
+
+    try:
+        for _ in range(args.rounds):
+            for name, insert in CASES:
+                await cleanup()
+                samples, cpu = await bench(sessionmaker, insert, args.inserts)
+                summary = common.summarize(samples)
+                summary["cpu_us_per_insert"] = cpu / args.inserts * 1e6
+                common.print_summary(name, summary)
+    finally:
+        await cleanup()
+        await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--envfile", type=str, default=".env")
+    parser.add_argument("--inserts", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=2,
+                        help="repeat every case, to see the noise")
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""In-memory stand-ins for benchmarks that don't need Postgres."""
+import datetime as dt
+from typing import (
+    Dict,
+    Optional,
+    Tuple,
+)
+
+from basic_app import (
+    daos,
+    models,
+)
+from basic_app.lib import session
+
+def sessions() -> Tuple[session.SessionStore, session.Cookie]:
+    """Returns an in-memory session store and its cookie settings."""
+    return (session.InMemorySessionStore(ttl=3600),
+        session.Cookie(name="session_id", max_age=3600, secure=False))
+
+class InMemoryUserDao:
+    """Implements the daos.User interface with dicts."""
+    def __init__(self):
+        self._by_id: Dict[str, models.User] = {}
+        self._by_email: Dict[str, models.User] = {}
+
+    async def create_user(self, cmd: daos.CreateUserCommand) -> daos.CreateUserResult:
+        existing = self._by_email.get(cmd.email) or self._by_id.get(cmd.id)
+        if existing:
+            return daos.CreateUserResult(conflict=True, user=existing)
+
+        user = models.User(
+            id=cmd.id,
+            email=cmd.email,
+            username=cmd.username,
+            password=cmd.password,
+            create_time=cmd.create_time,
+            update_time=cmd.update_time,
+        )
+        self._by_id[cmd.id] = user
+        self._by_email[cmd.email] = user
+        return daos.CreateUserResult(conflict=False, user=user)
+
+    async def get_user_by_email(self, email: str) -> Optional[models.User]:
+        return self._by_email.get(email)
+
+    async def get_credential(self, email: str) -> Optional[daos.Credential]:
+        user = self._by_email.get(email)
+        if user is None:
+            return None
+        return daos.Credential(
+            id=user.id,
+            password=user.password,
+            username=user.username,
+            create_time=user.create_time,
+            update_time=user.update_time,
+        )
+
+    async def update_password(self, id: str, old_password: str,
+        new_password: str, update_time: dt.datetime) -> bool:
+        user = self._by_id.get(id)
+        if user is None or user.password != old_password:
+            return False
+        user.password = new_password
+        user.update_time = update_time
+        return True
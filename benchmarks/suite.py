@@ -0,0 +1,371 @@
+"""
+Run repeatable HTTP scenarios through the ASGI app and record the results.
+
+Scenarios:
+
+  signup_storm        POST /signup, every request with a new email.
+  login_mix           POST /login of existing users, a fraction of them
+                      with a wrong password.
+  duplicate_conflict  POST /signup where a fraction of the emails is
+                      already registered and answered with 409.
+  google_signin       POST /google-signin with ID tokens signed by a local
+                      stand-in of Google's certs endpoint.
+
+The user DAO is in memory, or the Postgres from docker-compose with the
+user table migrated. For each scenario throughput, p50/p95/p99 latency and
+CPU time per request are reported, and all of them are written as JSON,
+by default to benchmarks/results/<commit>.json. Two result files can be
+compared to spot regressions between commits:
+
+    python -m benchmarks.suite run --requests 1000 --concurrency 32
+    python -m benchmarks.suite run --dao postgres --scenarios signup_storm
+    python -m benchmarks.suite compare benchmarks/results/a1b2c3d.json \\
+        benchmarks/results/e4f5a6b.json
+
+CPU time is the process time of the whole process, password hashing
+threads included, divided by the number of requests. Request bodies and ID
+tokens are built before the clock starts. Rows created against Postgres
+are deleted after each scenario.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+)
+
+import httpx
+import sqlalchemy as sa
+
+import basic_app
+from basic_app import (
+    daos,
+    models,
+    routers,
+    services,
+)
+from basic_app.lib import (
+    config,
+    google_id_token,
+    password,
+    postgres,
+)
+from benchmarks import (
+    common,
+    stubs,
+)
+from tests import helper
+
+EMAIL_DOMAIN = "suite-bench.example.com"
+CLIENT_ID = "benchmark-client-id"
+PASSWORD = "password1"
+
+# Sends one request, returns the status code.
+Request = Callable[[httpx.AsyncClient], Awaitable[int]]
+
+class Environment:
+    """App and dependencies shared by the scenarios of one run."""
+    def __init__(self, args):
+        self.args = args
+        # Scenarios create users all at once, don't reject them for the
+        # queue depth.
+        conf = common.get_config(password_hasher_queue_depth=max(
+            args.users, args.concurrency, 64))
+        self.hasher = password.Argon2PasswordHasher(
+            conf, password.HashScheduler(conf))
+        self.engine = None
+        self._sessionmaker = None
+        if args.dao == "postgres":
+            self._sessionmaker = postgres.create_sessionmaker(
+                config.setup(args.envfile))
+            self.engine = self._sessionmaker.engine
+        self.certs = helper.GoogleCertsServer()
+        self.verifier = google_id_token.GoogleIdTokenVerifier(
+            CLIENT_ID, certs_url=self.certs.url)
+        self.service = None
+
+    def reset(self) -> httpx.AsyncClient:
+        """Rebuild the app on an empty DAO, returns a client of it."""
+        if self._sessionmaker:
+            dao = daos.User(self._sessionmaker)
+        else:
+            dao = stubs.InMemoryUserDao()
+        self.service = services.User(dao=dao, hasher=self.hasher)
+        sessions = stubs.sessions()
+        routers.User(self.service, *sessions)
+        routers.GoogleSignin("localhost", CLIENT_ID, self.verifier,
+            self.service, *sessions)
+        return httpx.AsyncClient(app=basic_app.API(),
+            base_url="http://localhost")
+
+    async def create_users(self, emails: List[str]):
+        """Sign up emails directly through the service."""
+        await asyncio.gather(*(self.service.signup(services.SignupCommand(
+            id=uuid.uuid4(), email=email, username="bench", password=PASSWORD,
+        )) for email in emails))
+
+    async def cleanup(self):
+        """Delete users created by the scenario."""
+        if self.engine is None:
+            return
+        async with self.engine.begin() as conn:
+            await conn.execute(sa.delete(models.User).where(
+                models.User.email.like("%@" + EMAIL_DOMAIN)))
+
+    async def close(self):
+        await self.verifier.close()
+        if self.engine is not None:
+            await self.engine.dispose()
+
+def _email(prefix: str, i: int) -> str:
+    return "{}-{}@{}".format(prefix, i, EMAIL_DOMAIN)
+
+def _signup(email: str) -> Request:
+    body = {
+        "id": str(uuid.uuid4()),
+        "email": email,
+        "username": "bench",
+        "password": PASSWORD,
+    }
+    async def send(ac: httpx.AsyncClient) -> int:
+        return (await ac.post("/signup", json=body)).status_code
+    return send
+
+async def signup_storm(env: Environment, count: int) -> List[Request]:
+    return [_signup(_email("storm", i)) for i in range(count)]
+
+async def login_mix(env: Environment, count: int) -> List[Request]:
+    emails = [_email("login", i) for i in range(env.args.users)]
+    await env.create_users(emails)
+    rand = random.Random(env.args.seed)
+
+    def login(email: str, wrong: bool) -> Request:
+        body = {"email": email,
+            "password": "wrong-password" if wrong else PASSWORD}
+        async def send(ac: httpx.AsyncClient) -> int:
+            return (await ac.post("/login", json=body)).status_code
+        return send
+
+    return [login(rand.choice(emails), rand.random() < env.args.wrong_ratio)
+        for _ in range(count)]
+
+async def duplicate_conflict(env: Environment, count: int) -> List[Request]:
+    existing = [_email("existing", i) for i in range(env.args.users)]
+    await env.create_users(existing)
+    rand = random.Random(env.args.seed)
+    return [_signup(rand.choice(existing)
+        if rand.random() < env.args.conflict_ratio else _email("new", i))
+        for i in range(count)]
+
+async def google_signin(env: Environment, count: int) -> List[Request]:
+    # Warm the certs cache like the first sign-in after start would.
+    await env.verifier.verify(env.certs.sign(CLIENT_ID))
+
+    def signin(i: int) -> Request:
+        csrf = uuid.uuid4().hex
+        data = {
+            "credential": env.certs.sign(CLIENT_ID,
+                sub=str(i), email=_email("google", i)),
+            "csrf_token": csrf,
+        }
+        cookies = {"csrf_cookie": csrf}
+        async def send(ac: httpx.AsyncClient) -> int:
+            return (await ac.post("/google-signin",
+                data=data, cookies=cookies)).status_code
+        return send
+
+    return [signin(i) for i in range(count)]
+
+SCENARIOS: Dict[str, Callable[[Environment, int], Awaitable[List[Request]]]] = {
+    "signup_storm": signup_storm,
+    "login_mix": login_mix,
+    "duplicate_conflict": duplicate_conflict,
+    "google_signin": google_signin,
+}
+
+async def _drive(ac: httpx.AsyncClient, reqs: List[Request],
+    concurrency: int) -> Dict[str, Any]:
+    """Send reqs from concurrency clients, returns what was measured."""
+    samples = []
+    statuses: Dict[str, int] = {}
+    queue = asyncio.Queue()
+    for req in reqs:
+        queue.put_nowait(req)
+
+    async def worker():
+        while not queue.empty():
+            req = queue.get_nowait()
+            start = time.perf_counter()
+            status = str(await req(ac))
+            samples.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    cpu = time.process_time()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    result = {
+        "requests": len(reqs),
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(reqs) / elapsed,
+        "cpu_ms_per_request": cpu / len(reqs) * 1000,
+    }
+    summary = common.summarize(samples)
+    del summary["count"]
+    result.update(summary)
+    result["statuses"] = dict(sorted(statuses.items()))
+    return result
+
+async def run_scenario(env: Environment, name: str) -> Dict[str, Any]:
+    args = env.args
+    async with env.reset() as ac:
+        try:
+            reqs = await SCENARIOS[name](env, args.warmup + args.requests)
+            await _drive(ac, reqs[:args.warmup], args.concurrency)
+            return await _drive(ac, reqs[args.warmup:], args.concurrency)
+        finally:
+            await env.cleanup()
+
+def metadata(args) -> Dict[str, Any]:
+    """Returns what the numbers depend on besides the code."""
+    conf = common.get_config()
+    meta = common.run_metadata()
+    meta.update({
+        "dao": args.dao,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "argon2": {
+            "memory_cost": int(conf.argon2_memory_cost),
+            "time_cost": int(conf.argon2_time_cost),
+            "parallelism": int(conf.argon2_parallelism),
+        },
+        "password_hasher_pool_size": conf.password_hasher_pool_size,
+    })
+    return meta
+
+async def run(args):
+    names = args.scenarios.split(",")
+    for name in names:
+        if name not in SCENARIOS:
+            raise SystemExit("Unknown scenario {}, choose from {}.".format(
+                name, ", ".join(SCENARIOS)))
+
+    env = Environment(args)
+    results = {}
+    with env.certs:
+        try:
+            for name in names:
+                results[name] = await run_scenario(env, name)
+                print_result(name, results[name])
+        finally:
+            await env.close()
+
+    meta = metadata(args)
+    output = args.output or common.results_path(meta)
+    with open(output, "w") as f:
+        json.dump({"meta": meta, "scenarios": results}, f, indent=2)
+    print("results written to {}".format(output))
+
+def print_result(name: str, result: Dict[str, Any]):
+    common.print_summary(name, {k: result[k] for k in (
+        "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "cpu_ms_per_request")})
+    print("{:<32} statuses={}".format(name, result["statuses"]))
+
+# Metric, and whether a higher value is better. Metrics missing in a
+# result file, like those of benchmarks.startup, are skipped.
+COMPARED = (
+    ("throughput_rps", True),
+    ("p50_ms", False),
+    ("p95_ms", False),
+    ("p99_ms", False),
+    ("cpu_ms_per_request", False),
+    ("import_ms", False),
+    ("process_ms", False),
+)
+
+def compare(args) -> int:
+    """Print relative changes from base to head, returns the exit code."""
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    print("base {} vs head {}".format(base["meta"]["commit"],
+        head["meta"]["commit"]))
+    for key in ("dao", "concurrency", "argon2", "cpu_count", "python"):
+        if base["meta"].get(key) != head["meta"].get(key):
+            print("warning: {} differs, {} vs {}".format(
+                key, base["meta"].get(key), head["meta"].get(key)))
+
+    regressions = 0
+    for name, after in head["scenarios"].items():
+        before = base["scenarios"].get(name)
+        if before is None:
+            print("{:<20} missing in base".format(name))
+            continue
+        for metric, higher_is_better in COMPARED:
+            if metric not in before or metric not in after:
+                continue
+            old, new = before[metric], after[metric]
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > args.tolerance:
+                flag = "REGRESSION"
+                regressions += 1
+            print("{:<20} {:<20} {:>10.3f} -> {:>10.3f} {:>+8.1%} {}".format(
+                name, metric, old, new, change, flag))
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run scenarios")
+    run_parser.add_argument("--envfile", type=str, default=".env")
+    run_parser.add_argument("--dao", choices=("memory", "postgres"),
+                            default="memory")
+    run_parser.add_argument("--scenarios", type=str, default=",".join(SCENARIOS),
+                            help="comma separated scenarios to run")
+    run_parser.add_argument("--requests", type=int, default=1000,
+                            help="measured requests per scenario")
+    run_parser.add_argument("--warmup", type=int, default=50,
+                            help="unmeasured requests before each scenario")
+    run_parser.add_argument("--concurrency", type=int, default=32)
+    run_parser.add_argument("--users", type=int, default=100,
+                            help="users created before login and conflict runs")
+    run_parser.add_argument("--wrong-ratio", type=float, default=0.1,
+                            help="fraction of logins with a wrong password")
+    run_parser.add_argument("--conflict-ratio", type=float, default=0.3,
+                            help="fraction of signups with a registered email")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", type=str, default="",
+                            help="result file, benchmarks/results/<commit>.json "
+                            "by default")
+
+    compare_parser = subparsers.add_parser("compare",
+        help="compare two result files")
+    compare_parser.add_argument("base", type=str)
+    compare_parser.add_argument("head", type=str)
+    compare_parser.add_argument("--tolerance", type=float, default=0.1,
+                                help="relative change counted as regression")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(run(args))
+    else:
+        sys.exit(compare(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Measure the latency of the first login of a new process, with and without
+warm-up on startup.
+
+Each run is a new process building the app like uvicorn workers do, then
+sending POST /login with the right password, first once and then
+--requests times:
+
+  cold  The first request connects to Postgres, compiles and prepares the
+        query, and starts the hashing pool.
+  warm  The startup hooks run first, on the ASGI lifespan startup event
+        uvicorn sends, so the first request should take as long as the
+        next ones.
+
+Needs the Postgres from docker-compose and the user table migrated:
+
+    make compose-up && alembic upgrade head
+    python -m benchmarks.warmup --runs 5 --requests 20
+
+Google sign-in isn't warmed up, as it fetches certs from Google. The user
+logging in is deleted afterwards.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+import sqlalchemy as sa
+
+import basic_app
+from basic_app import (
+    daos,
+    models,
+    services,
+)
+from basic_app.lib import (
+    config,
+    lifecycle,
+    password,
+    postgres,
+)
+from benchmarks import common
+
+EMAIL = "user@warmup-bench.example.com"
+PASSWORD = "password1"
+
+def _env():
+    env = dict(os.environ)
+    env.update({
+        "SESSION_BACKEND": "memory",
+        "RATE_LIMIT_IP_REQUESTS": "0",
+        "RATE_LIMIT_EMAIL_REQUESTS": "0",
+        "APP_WARMUP_GOOGLE_SIGNIN": "false",
+    })
+    return env
+
+class Lifespan:
+    """Send the ASGI lifespan events of app, as uvicorn does."""
+    def __init__(self, app):
+        self._app = app
+        self._received = asyncio.Queue()
+        self._sent = asyncio.Queue()
+        self._task = None
+
+    async def _event(self, event: str):
+        await self._received.put({"type": "lifespan." + event})
+        message = await self._sent.get()
+        assert message["type"] == "lifespan.{}.complete".format(event), message
+
+    async def __aenter__(self):
+        self._task = asyncio.ensure_future(self._app({"type": "lifespan"},
+            self._received.get, self._sent.put))
+        await self._event("startup")
+
+    async def __aexit__(self, *_):
+        await self._event("shutdown")
+        await self._task
+
+async def child(args):
+    """Runs in the measured process, prints its results as JSON."""
+    basic_app.setup(config.setup(args.envfile))
+    if args.child == "cold":
+        lifecycle.setup(None)
+    app = basic_app.API()
+
+    body = {"email": EMAIL, "password": PASSWORD}
+    samples = []
+    start = time.perf_counter()
+    async with Lifespan(app):
+        startup = time.perf_counter() - start
+        async with httpx.AsyncClient(app=app, base_url="http://localhost") as ac:
+            for _ in range(args.requests + 1):
+                start = time.perf_counter()
+                resp = await ac.post("/login", json=body)
+                samples.append(time.perf_counter() - start)
+                resp.raise_for_status()
+
+    print(json.dumps({
+        "startup_ms": startup * 1000,
+        "first_ms": samples[0] * 1000,
+        "steady_p50_ms": common.percentile(samples[1:], 50) * 1000,
+    }))
+
+def run_child(mode: str, args) -> dict:
+    proc = subprocess.run((sys.executable, "-m", "benchmarks.warmup",
+        "--child", mode, "--requests", str(args.requests),
+        "--envfile", args.envfile),
+        env=_env(), capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.splitlines()[-1])
+
+async def with_user(args, func):
+    """Signs up the user, calls func, and deletes the user."""
+    conf = config.setup(args.envfile)
+    sessionmaker = postgres.create_sessionmaker(conf)
+    hasher = password.create_hasher(conf, password.HashScheduler(conf))
+    service = services.User(dao=daos.User(sessionmaker), hasher=hasher)
+    async def cleanup():
+        async with sessionmaker.engine.begin() as conn:
+            await conn.execute(sa.delete(models.User).where(
+                models.User.email == EMAIL))
+
+    try:
+        await cleanup()
+        await service.signup(services.SignupCommand(
+            id=uuid.uuid4(), email=EMAIL, username="bench", password=PASSWORD))
+        # Children are processes of their own, don't block the loop's
+        # connections meanwhile.
+        await asyncio.get_running_loop().run_in_executor(None, func)
+    finally:
+        await cleanup()
+        await sessionmaker.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--envfile", type=str, default=".env")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=20,
+                        help="logins after the first one, per run")
+    parser.add_argument("--child", choices=("cold", "warm"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args))
+        return
+
+    def measure():
+        for mode in ("cold", "warm"):
+            results = [run_child(mode, args) for _ in range(args.runs)]
+            common.print_summary(mode, {name: statistics.median(
+                r[name] for r in results) for name in results[0]})
+    asyncio.run(with_user(args, measure))
+
+if __name__ == "__main__":
+    main()
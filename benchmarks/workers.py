@@ -0,0 +1,122 @@
+"""
+Measure POST /signup throughput of the server with 1..N workers.
+
+Each worker process runs the real app with Argon2 hashing and an
+in-memory user DAO, so throughput is bound by hashing and request
+handling rather than Postgres. Every signup uses a fresh email.
+
+Run:
+
+    python -m benchmarks.workers --max-workers 4 --duration 10
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+import basic_app
+from basic_app import (
+    routers,
+    services,
+)
+from basic_app.lib import (
+    password,
+    uvicorn,
+)
+from benchmarks import (
+    common,
+    stubs,
+)
+
+def create_app() -> basic_app.API:
+    """App factory called by uvicorn in every worker."""
+    conf = common.get_config()
+    hasher = password.Argon2PasswordHasher(conf, password.HashScheduler(conf))
+    routers.User(services.User(dao=stubs.InMemoryUserDao(), hasher=hasher),
+        *stubs.sessions())
+    return basic_app.API()
+
+def serve(args):
+    """Run the server, in a child process of the benchmark."""
+    uvicorn.run("benchmarks.workers:create_app", common.get_config(
+        host="127.0.0.1",
+        port=args.port,
+        workers=args.workers,
+    ))
+
+async def wait_ready(ac: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            await ac.get("/docs")
+            return
+        except httpx.TransportError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+async def load(args, workers: int):
+    """Drive signups against a running server and print the result."""
+    samples = []
+    errors = 0
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url="http://127.0.0.1:{}".format(args.port),
+        limits=limits, timeout=30) as ac:
+        await wait_ready(ac)
+        deadline = time.perf_counter() + args.duration
+
+        async def client():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                resp = await ac.post("/signup", json={
+                    "id": str(uuid.uuid4()),
+                    "email": "{}@workers-bench.example.com".format(uuid.uuid4().hex),
+                    "username": "bench",
+                    "password": "password1",
+                })
+                samples.append(time.perf_counter() - start)
+                errors += resp.status_code != 200
+
+        await asyncio.gather(*(client() for _ in range(args.concurrency)))
+
+    summary = common.summarize(samples)
+    summary["signups_per_sec"] = len(samples) / args.duration
+    summary["errors"] = errors
+    common.print_summary("workers={}".format(workers), summary)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--serve", action="store_true",
+                        help="run the server instead of the benchmark")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    for workers in range(1, args.max_workers + 1):
+        env = dict(os.environ, PASSWORD_HASHER_POOL_SIZE=str(
+            max((os.cpu_count() or 1) // workers, 1)))
+        server = subprocess.Popen([sys.executable, "-m", "benchmarks.workers",
+            "--serve", "--workers", str(workers), "--port", str(args.port)],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            asyncio.run(load(args, workers))
+        finally:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    main()
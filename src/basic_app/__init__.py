@@ -1,16 +1,31 @@
 """App configuration."""
+import asyncio
+from typing import Optional
 import fastapi
 
 from basic_app.lib import (
+    cache,
     config,
     exception,
+    google_id_token,
+    idempotency,
+    lifecycle,
+    metrics,
     password,
     postgres,
+    profiling,
+    ratelimit,
+    redis,
+    response,
+    session,
 )
 
 from basic_app.routers import (
     user,
     google_signin,
+    health,
+    status,
+    session as session_router,
 )
 
 from basic_app import (
@@ -22,30 +37,137 @@ from basic_app import (
 class API(fastapi.FastAPI):
     """Wrap original FastAPI class for customization."""
     def __init__(self):
-        super().__init__()
+        super().__init__(default_response_class=response.response_class())
 
         exception.setup(self)
+        self.add_event_handler("startup", lifecycle.startup)
+        self.add_event_handler("shutdown", lifecycle.shutdown)
+        # Innermost, so rejections are still measured and profiled.
+        self.add_middleware(ratelimit.Middleware)
+        self.add_middleware(metrics.Middleware)
+        self.add_middleware(profiling.Middleware)
 
         self.include_router(google_signin.router)
         self.include_router(user.router)
+        self.include_router(status.router)
+        self.include_router(health.router)
+        self.include_router(session_router.router)
 
 def setup(conf: config.Config):
     """Initialize all dependencies here."""
 
-    sessionmaker = postgres.create_sessionmaker(conf)
+    profiling.setup(conf)
+    response.setup(conf)
+
+    redis_client = None
+    if conf.session_backend == "redis" or conf.user_cache_redis or\
+        conf.idempotency_backend == "redis" or\
+        conf.rate_limit_backend == "redis" or\
+        conf.postgres_read_your_writes_redis:
+        redis_client = redis.create_client(conf)
+
+    sessionmaker = postgres.create_sessionmaker(conf, redis_client)
     #engine = postgres.create_engine(conf)
 
-    password_hasher = password.Argon2PasswordHasher(conf)
+    limiter = ratelimit.create_limiter(conf, redis_client)
+    def rate_limit(scope: str, requests: int) -> Optional[ratelimit.Rule]:
+        if requests <= 0:
+            return None
+        return ratelimit.Rule(limiter, scope,
+            ratelimit.Limit(requests, conf.rate_limit_window))
+    ratelimit.setup(rate_limit("ip", conf.rate_limit_ip_requests),
+        paths=("/login", "/signup", "/google-signin"))
+
+    session_store = session.create_store(conf, redis_client)
+    session_cookie = session.create_cookie(conf)
+
+    base_dao = daos.User(sessionmaker,
+        batch_window=conf.signup_batch_window_ms / 1000,
+        batch_size=conf.signup_batch_size)
+    user_dao = base_dao
+    user_cache = None
+    if conf.user_cache_size > 0:
+        user_cache = cache.Cache(
+            cache.LRUCache(conf.user_cache_size, conf.user_cache_ttl),
+            cache.RedisCache(redis_client, conf.user_cache_redis_ttl)
+                if conf.user_cache_redis else None,
+            negative_ttl=conf.user_cache_negative_ttl,
+        )
+        user_dao = daos.CachedUser(base_dao, user_cache)
+
+    hash_scheduler = password.HashScheduler(conf)
+    password_hasher = password.create_hasher(conf, hash_scheduler)
+    user_service = services.User(
+        dao=user_dao,
+        hasher=password_hasher,
+    )
 
-    routers.GoogleSignin(
+    routers.GoogleSignin.lazy(lambda: routers.GoogleSignin(
         conf.host,
         conf.google_client_id,
-    )
+        google_id_token.GoogleIdTokenVerifier(
+            conf.google_client_id,
+            certs_url=conf.google_certs_url,
+        ),
+        user_service,
+        session_store,
+        session_cookie,
+    ))
 
     routers.User(
-        services.User(
-            sessionmaker=sessionmaker,
-            hasher=password_hasher,
-        )
+        user_service,
+        session_store,
+        session_cookie,
+        idempotency.Idempotency(
+            idempotency.create_store(conf, redis_client),
+            wait_timeout=conf.idempotency_wait_timeout,
+        ),
+        rate_limit("email", conf.rate_limit_email_requests),
     )
 
+    routers.Session(session_store, session_cookie)
+
+    routers.Status(hash_scheduler, sessionmaker, user_cache,
+        token=conf.status_token or None)
+
+    # Shutdown hooks run in reverse, Postgres is closed last.
+    app_lifecycle = lifecycle.Lifecycle(conf.warmup_timeout, conf.readiness_timeout)
+
+    async def warm_up_postgres():
+        await sessionmaker.prewarm(conf.postgres_pool_prewarm)
+        await base_dao.warm_up(conf.postgres_pool_prewarm)
+    app_lifecycle.on_startup("postgres", warm_up_postgres)
+    app_lifecycle.add_check("postgres", sessionmaker.ping)
+    app_lifecycle.on_shutdown("postgres", sessionmaker.close)
+
+    if redis_client:
+        # Opens the first connection of the client's pool.
+        app_lifecycle.on_startup("redis", redis_client.ping)
+        app_lifecycle.add_check("redis", redis_client.ping)
+        app_lifecycle.on_shutdown("redis", redis_client.close)
+
+    # Signups gathered at shutdown are written while Postgres and Redis are
+    # still open.
+    app_lifecycle.on_shutdown("signup_batch", base_dao.close)
+
+    async def warm_up_hasher():
+        # A hash and verify per slot starts every thread of the pool, each
+        # running both paths of the hashing library once.
+        async def hash_and_verify():
+            await password_hasher.verify("warm-up",
+                await password_hasher.hash("warm-up"))
+        await asyncio.gather(*(hash_and_verify()
+            for _ in range(hash_scheduler.stats().limit)))
+    app_lifecycle.on_startup("password_hasher", warm_up_hasher)
+    app_lifecycle.on_shutdown("password_hasher", lambda: asyncio.\
+        get_running_loop().run_in_executor(None, hash_scheduler.close))
+
+    app_lifecycle.on_startup("request_validation", user.warm_up)
+
+    if conf.warmup_google_signin:
+        app_lifecycle.on_startup("google_signin", google_signin.warm_up)
+    app_lifecycle.on_shutdown("google_signin", google_signin.close)
+
+    lifecycle.setup(app_lifecycle)
+    routers.Health(app_lifecycle, sessionmaker)
+
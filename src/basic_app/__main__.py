@@ -1,36 +1,57 @@
 """Define entrypoint here."""
+import asyncio
+import os
 
 import basic_app
 from basic_app import (
     argument,
+    importer,
 )
 
 from basic_app.lib import (
     config,
     logging,
+    password,
     uvicorn,
 )
 
-app = None
+# Worker processes don't see our arguments, pass the envfile on with env.
+_ENVFILE = "BASIC_APP_ENVFILE"
+
+def create_app() -> basic_app.API:
+    """Build the app, called by uvicorn in every worker process."""
+    conf = config.setup(os.getenv(_ENVFILE, ".env"))
+
+    logging.setup(conf)
+
+    basic_app.setup(conf)
+
+    return basic_app.API()
 
 def main():
     """Our entrypoint."""
     args = argument.parse_args()
 
+    os.environ[_ENVFILE] = args.envfile
     conf = config.setup(args.envfile)
 
     logging.setup(conf)
 
-    basic_app.setup(conf)
+    if args.command == "import-users":
+        asyncio.run(importer.run(conf, args))
+        return
+
+    if args.command == "calibrate-hasher":
+        params = password.calibrate(conf, args.target_ms)
+        for name, value in params.items():
+            print("{}={}".format(name.upper(), value))
+        return
 
-    global app
-    app = basic_app.API()
+    if conf.password_hasher_calibrate:
+        # Calibrated once here, so every worker hashes the same way.
+        password.apply_calibration(conf, password.calibrate(conf))
 
-    uvicorn.run(
-        "basic_app.__main__:app",
-        host=conf.host,
-        port=int(conf.port),
-    )
+    uvicorn.run("basic_app.__main__:create_app", conf)
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,6 @@
 """Provide CLI input."""
 import argparse
+import os
 
 def parse_args() -> argparse.Namespace:
     """Parse arguments and return."""
@@ -11,4 +12,38 @@ def parse_args() -> argparse.Namespace:
                         default=".env",
                         help="path to a envioronment variable file")
 
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("serve",
+                          help="serve the HTTP API, the default command")
+
+    import_users = subparsers.add_parser("import-users",
+                                         help="create users in bulk from a file")
+    import_users.add_argument("path",
+                              type=str,
+                              help="JSONL or CSV file with id, email, username "
+                                   "and password of each user")
+    import_users.add_argument("--format",
+                              choices=["jsonl", "csv"],
+                              default=None,
+                              help="file format, guessed from the extension "
+                                   "by default")
+    import_users.add_argument("--batch-size",
+                              type=int,
+                              default=1000,
+                              help="number of users per transaction")
+    import_users.add_argument("--processes",
+                              type=int,
+                              default=os.cpu_count() or 1,
+                              help="number of processes hashing passwords")
+
+    calibrate = subparsers.add_parser("calibrate-hasher",
+                                      help="pick password hasher parameters "
+                                           "for this host, printed as "
+                                           "environment variables")
+    calibrate.add_argument("--target-ms",
+                           type=float,
+                           default=None,
+                           help="verify latency to aim for, "
+                                "PASSWORD_HASHER_TARGET_MS by default")
+
     return parser.parse_args()
@@ -1,6 +1,8 @@
 """To ease import."""
 from basic_app.daos.user import (
     User,
+    CachedUser,
     CreateUserCommand,
     CreateUserResult,
+    Credential,
 )
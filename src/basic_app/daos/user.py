@@ -1,11 +1,22 @@
 """Define user dao."""
+import asyncio
 import datetime as dt
 import dataclasses
-from sqlalchemy import orm, engine, select, or_
-from sqlalchemy.ext import asyncio
-from sqlalchemy.dialects import postgresql
-from sqlalchemy.engine import cursor
+import uuid
+from typing import (
+    List,
+    Optional,
+    Set,
+    Union,
+)
+from sqlalchemy import exc, select, update, or_
 from basic_app import models
+from basic_app.lib import (
+    batch,
+    cache,
+    exception,
+    postgres,
+)
 
 @dataclasses.dataclass
 class CreateUserCommand:
@@ -21,51 +32,392 @@ class CreateUserResult:
     conflict: bool
     user: models.User
 
+@dataclasses.dataclass
+class Credential:
+    id: str
+    password: str
+    username: str
+    create_time: dt.datetime
+    update_time: dt.datetime
+
+def _create_user_result(cmd: CreateUserCommand, conflict: bool,
+    users: List[models.User]) -> CreateUserResult:
+    """Returns the result of cmd given the created or conflicting users."""
+    # Report email conflict first, it is what the client can act on.
+    user = next((u for u in users if u.email == cmd.email), users[0])
+
+    return CreateUserResult(
+        conflict=conflict,
+        user=models.User(
+            id=user.id,
+            email=user.email,
+            username=user.username,
+            create_time=user.create_time,
+            update_time=user.update_time,
+        ),
+    )
+
+def _unresolved_conflict() -> exception.AppException:
+    """Returns the error of a signup which neither inserted nor found the
+    row it conflicts with, as when that row is deleted meanwhile."""
+    return exception.AppException(
+        code=exception.ErrorCode.SERVER_BUSY,
+        message="Signup raced a concurrent change, please retry.",
+        headers={"Retry-After": "1"},
+    )
+
+def _invalid_record(e: exc.DBAPIError) -> bool:
+    """Whether e is a data exception or an integrity constraint violation."""
+    sqlstate = getattr(e.orig, "sqlstate", None) or ""
+    return sqlstate[:2] in ("22", "23")
+
 class User:
     """Data access object for user model."""
-    def __init__(self, sessionmaker: orm.sessionmaker):
+    def __init__(self, sessionmaker: postgres.SessionMaker,
+        batch_window: float = 0, batch_size: int = 64):
+        """
+        Args:
+          sessionmaker: Sessions of the user table.
+          batch_window: Seconds concurrent signups are gathered to be
+            created in one statement and commit, 0 creates each alone.
+          batch_size: Maximum number of signups created together.
+        """
         self._sessionmaker = sessionmaker
+        self._signups = None
+        if batch_window > 0:
+            self._signups = batch.Batcher("signup", self._create_users,
+                batch_window, batch_size)
+
+    async def close(self):
+        """Create the signups being gathered, call before closing the
+        sessionmaker."""
+        if self._signups:
+            await self._signups.close()
+
+    async def create_user(self, cmd: CreateUserCommand) -> CreateUserResult:
+        """Create a user, or return the existing user it conflicts with."""
+        if self._signups:
+            return await self._signups.submit(cmd)
+        return await self._create_user(cmd)
+
+    async def _create_user(self, cmd: CreateUserCommand,
+        attempts: int = 2) -> CreateUserResult:
+        """Create a user in its own transaction.
+
+        The insert and the conflict lookup share one statement, so a signup
+        costs BEGIN, the statement and COMMIT.
+
+        Raises:
+          AppException: If the conflicting user can't be found, after
+            attempts statements.
+        """
+        for _ in range(attempts):
+            async with self._sessionmaker() as session:
+                result = await session.insert_or_select_conflict(models.User(
+                    id=cmd.id,
+                    email=cmd.email,
+                    username=cmd.username,
+                    password=cmd.password,
+                    create_time=cmd.create_time,
+                    update_time=cmd.update_time,
+                ), conflict_columns=["id", "email"])
+
+                users = result.rows
+                if not result.inserted and not users:
+                    # The conflicting user was committed after our snapshot.
+                    users = await self._select_conflicts(session, cmd)
+
+            if result.inserted:
+                await self._sessionmaker.mark_written(str(cmd.id), cmd.email)
+            if users:
+                return _create_user_result(cmd, not result.inserted, users)
+            # The conflicting user was deleted meanwhile, try again.
+        raise _unresolved_conflict()
+
+    async def _create_users(self, cmds: List[CreateUserCommand],
+        ) -> List[Union[CreateUserResult, Exception]]:
+        """Create the users of a batch of signups.
+
+        They share one statement and one commit, so Postgres flushes its
+        WAL once for the whole batch.
+        """
+        results = []
+        # Signups whose conflict was not found, retried on their own.
+        unresolved = []
+        try:
+            async with self._sessionmaker() as session:
+                result = await session.insert_many_or_select_conflict(
+                    models.User, [dataclasses.asdict(cmd) for cmd in cmds],
+                    conflict_columns=["id", "email"])
+                inserted = {str(u.id): u for u in result.inserted}
+                users = result.conflicts + result.inserted
+
+                for cmd in cmds:
+                    user = inserted.get(str(cmd.id))
+                    if user is not None and user.email == cmd.email:
+                        results.append(_create_user_result(cmd, False, [user]))
+                        continue
+                    conflicts = [u for u in users
+                        if str(u.id) == str(cmd.id) or u.email == cmd.email]
+                    if not conflicts:
+                        conflicts = await self._select_conflicts(session, cmd)
+                    if not conflicts:
+                        unresolved.append(len(results))
+                        results.append(None)
+                        continue
+                    results.append(_create_user_result(cmd, True, conflicts))
+        except exc.DBAPIError as e:
+            if len(cmds) == 1 or not _invalid_record(e):
+                raise
+            # A single invalid record fails the whole statement, so the
+            # others are not failed with it.
+            return await asyncio.gather(
+                *(self._create_user(cmd) for cmd in cmds),
+                return_exceptions=True)
+
+        await self._sessionmaker.mark_written(*(key
+            for cmd, outcome in zip(cmds, results)
+            if outcome is not None and not outcome.conflict
+            for key in (str(cmd.id), cmd.email)))
+        # After the batch commits, so they don't wait on its rows.
+        retried = await asyncio.gather(
+            *(self._create_user(cmds[i], attempts=1) for i in unresolved),
+            return_exceptions=True)
+        for i, outcome in zip(unresolved, retried):
+            results[i] = outcome
+        return results
+
+    @staticmethod
+    async def _select_conflicts(session: postgres.Session,
+        cmd: CreateUserCommand) -> List[models.User]:
+        return await session.select(
+            select(models.User).
+                where(or_(
+                    models.User.id == cmd.id,
+                    models.User.email == cmd.email,
+                    )),
+        )
 
-    async def create(self, cmd: CreateUserCommand) -> CreateUserResult:
-        session: orm.Session = self._sessionmaker()
+    async def import_users(self, cmds: List[CreateUserCommand]) -> Set[str]:
+        """Create users in bulk, skipping those conflicting with others.
 
-        # We can do the same thing below by using one bigger raw query.
-        async with session.begin():
-            await session.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        The batch is loaded with COPY in one transaction, so it costs a
+        few round trips however large it is.
 
-            insert_stmt = postgresql.insert(models.User).values(
-                id=cmd.id,
-                email=cmd.email,
-                username=cmd.username,
-                password=cmd.password,
-                create_time=cmd.create_time,
-                update_time=cmd.update_time,
+        Returns:
+          Ids of the created users.
+        """
+        async with self._sessionmaker() as session:
+            rows = await session.copy_insert_on_conflict_do_nothing(
+                models.User, [dataclasses.asdict(cmd) for cmd in cmds])
+        created = {row.id for row in rows}
+        ids = {str(id) for id in created}
+        await self._sessionmaker.mark_written(*(key for cmd in cmds
+            if str(cmd.id) in ids for key in (str(cmd.id), cmd.email)))
+        return created
+
+    async def get_user(self, id: str) -> Optional[models.User]:
+        """Returns the user with id, or None."""
+        async with self._sessionmaker(postgres.IsolationLevel.AUTOCOMMIT,
+            read_only=True, keys=(str(id),)) as session:
+            users = await session.select(
+                select(models.User).where(models.User.id == id),
+            )
+        return users[0] if users else None
+
+    async def get_user_by_email(self, email: str) -> Optional[models.User]:
+        """Returns the user with email, or None."""
+        async with self._sessionmaker(postgres.IsolationLevel.AUTOCOMMIT,
+            read_only=True, keys=(email,)) as session:
+            users = await session.select(
+                select(models.User).where(models.User.email == email),
             )
-            do_nothing_stmt = insert_stmt.on_conflict_do_nothing()
+        return users[0] if users else None
 
-            insert_result: cursor.CursorResult = await session.execute(do_nothing_stmt)
+    async def get_credential(self, email: str) -> Optional[Credential]:
+        """Returns the password hash and profile of the user with email.
 
-            select_result = await session.execute(
-                select(models.User).
-                    where(or_(
-                        models.User.id == cmd.id,
-                        models.User.email == cmd.email,
-                        )),
+        It runs as a single autocommit statement on the email unique index,
+        without building the ORM object. It reads a replica, unless the
+        email signed up recently.
+        """
+        async with self._sessionmaker(postgres.IsolationLevel.AUTOCOMMIT,
+            read_only=True, keys=(email,)) as session:
+            row = await session.select_row(
+                select(models.User.id, models.User.password,
+                    models.User.username, models.User.create_time,
+                    models.User.update_time).
+                    where(models.User.email == email),
             )
 
-            user = select_result.fetchone()['User']
-
-        return CreateUserResult(
-            conflict=insert_result.rowcount == 0,
-            user=models.User(
-                id=user.id,
-                email=user.email,
-                username=user.username,
-                create_time=user.create_time,
-                update_time=user.update_time,
-            ),
+        if row is None:
+            return None
+        return Credential(
+            id=row.id,
+            password=row.password,
+            username=row.username,
+            create_time=row.create_time,
+            update_time=row.update_time,
         )
 
+    async def warm_up(self, connections: int = 1):
+        """Compile the statements of signup and login, and prepare the
+        login queries on connections.
+
+        Args:
+          connections: Number of connections to prepare the queries on,
+            they are checked out concurrently to get different ones.
+        """
+        postgres.build_statements(models.User, ["id", "email"])
+        # Logins read the credential, or the whole user through the cache.
+        # No email is without "@", so nothing is found.
+        for get in (self.get_credential, self.get_user_by_email):
+            await asyncio.gather(*(get("warm-up")
+                for _ in range(max(connections, 1))))
+
+    async def update_password(self, id: str, old_password: str,
+        new_password: str, update_time: dt.datetime) -> bool:
+        """Replace the password hash of a user if it is still old_password.
+
+        The condition keeps a rehash from overwriting a password changed
+        in the meantime.
+
+        Returns:
+          Whether the user was updated.
+        """
+        async with self._sessionmaker(postgres.IsolationLevel.AUTOCOMMIT) as session:
+            count = await session.update(
+                update(models.User).
+                    where(models.User.id == id).
+                    where(models.User.password == old_password).
+                    values(password=new_password, update_time=update_time),
+            )
+        if count:
+            await self._sessionmaker.mark_written(str(id))
+        return count == 1
+
+def _encode_user(user: models.User) -> dict:
+    """Encode user into a JSON serializable dict, without the password
+    hash."""
+    return {
+        "id": str(user.id),
+        "email": user.email,
+        "username": user.username,
+        "create_time": user.create_time.isoformat(),
+        "update_time": user.update_time.isoformat(),
+    }
+
+def _decode_user(value: dict) -> models.User:
+    return models.User(
+        id=uuid.UUID(value["id"]),
+        email=value["email"],
+        username=value["username"],
+        create_time=dt.datetime.fromisoformat(value["create_time"]),
+        update_time=dt.datetime.fromisoformat(value["update_time"]),
+    )
+
+class CachedUser:
+    """User dao reading through a cache, keyed by both id and email.
+
+    A user is cached under both keys whichever it was loaded by, without
+    the password hash. Absent users are cached too. Writes invalidate the
+    keys they touch.
+
+    Credentials are never cached. A cached hash would keep an old password
+    working in other processes after it was changed. Logins of emails
+    cached as not registered skip the database though.
+    """
+    def __init__(self, dao: User, user_cache: cache.Cache):
+        """
+        Args:
+          dao: The dao to read and write through.
+          user_cache: Where users are cached, as dicts.
+        """
+        self._dao = dao
+        self._cache = user_cache
+
+    @staticmethod
+    def _id_key(id: str) -> str:
+        return "user:id:{}".format(id)
+
+    @staticmethod
+    def _email_key(email: str) -> str:
+        return "user:email:{}".format(email)
+
+    async def _get(self, key: str, load, other_key) -> Optional[models.User]:
+        """Returns the user cached in key, loading it on a miss.
+
+        Args:
+          key: The key to look up.
+          load: Load the user from the dao.
+          other_key: Returns the other key of a loaded user.
+        """
+        async def load_and_fill():
+            generation = self._cache.generation
+            user = await load()
+            if user is None:
+                return None
+            value = _encode_user(user)
+            # The cache sets key with the returned value, both are fenced
+            # against deletes running meanwhile.
+            await self._cache.set(other_key(user), value, generation)
+            return value
+
+        value = await self._cache.get_or_load(key, load_and_fill)
+        return None if value is None else _decode_user(value)
+
+    async def get_user(self, id: str) -> Optional[models.User]:
+        return await self._get(self._id_key(id),
+            lambda: self._dao.get_user(id),
+            lambda user: self._email_key(user.email))
+
+    async def get_user_by_email(self, email: str) -> Optional[models.User]:
+        return await self._get(self._email_key(email),
+            lambda: self._dao.get_user_by_email(email),
+            lambda user: self._id_key(user.id))
+
+    async def get_credential(self, email: str) -> Optional[Credential]:
+        """Returns the credential read from the dao, or None without
+        reading it if the email is cached as not registered."""
+        key = self._email_key(email)
+        value = await self._cache.get(key)
+        if value is None:
+            return None
+
+        generation = self._cache.generation
+        credential = await self._dao.get_credential(email)
+        if credential is None and value is cache.MISSING:
+            await self._cache.set(key, None, generation)
+        return credential
+
+    async def create_user(self, cmd: CreateUserCommand) -> CreateUserResult:
+        """Create a user, answering known email conflicts from the cache."""
+        value = await self._cache.get(self._email_key(cmd.email))
+        if value is not cache.MISSING and value is not None:
+            return CreateUserResult(conflict=True, user=_decode_user(value))
 
+        result = await self._dao.create_user(cmd)
+        if not result.conflict:
+            # Drop "not registered" entries of the new user.
+            await self._cache.delete(self._id_key(cmd.id),
+                self._email_key(cmd.email))
+        return result
 
+    async def import_users(self, cmds: List[CreateUserCommand]) -> Set[str]:
+        created = await self._dao.import_users(cmds)
+        await self._cache.delete(
+            *(self._id_key(cmd.id) for cmd in cmds),
+            *(self._email_key(cmd.email) for cmd in cmds))
+        return created
 
+    async def update_password(self, id: str, old_password: str,
+        new_password: str, update_time: dt.datetime) -> bool:
+        # Look up the email first, it is usually cached alongside the id.
+        user = await self.get_user(id)
+        updated = await self._dao.update_password(
+            id, old_password, new_password, update_time)
+        keys = [self._id_key(id)]
+        if user:
+            keys.append(self._email_key(user.email))
+        await self._cache.delete(*keys)
+        return updated
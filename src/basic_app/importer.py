@@ -0,0 +1,76 @@
+"""Import users in bulk from files."""
+import argparse
+import csv
+import json
+import logging
+import sys
+import uuid
+from concurrent import futures
+from typing import Iterator
+
+from basic_app import (
+    daos,
+    services,
+)
+from basic_app.lib import (
+    config,
+    password,
+    postgres,
+)
+
+def read_users(path: str, fmt: str = None) -> Iterator[services.ImportUserCommand]:
+    """Stream users from a JSONL or CSV file.
+
+    Every record has email, username and password, and optionally an id.
+    A new id is generated when it is missing. Records are not validated
+    here, missing fields are None and User.import_users reports them.
+
+    Args:
+      path: Path of the file.
+      fmt: "jsonl" or "csv", guessed from the extension when None.
+    """
+    if fmt is None:
+        fmt = "csv" if path.endswith(".csv") else "jsonl"
+
+    with open(path, newline="") as f:
+        if fmt == "csv":
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+
+        for record in records:
+            yield services.ImportUserCommand(
+                id=record.get("id") or str(uuid.uuid4()),
+                email=record.get("email"),
+                username=record.get("username"),
+                password=record.get("password"),
+            )
+
+async def run(conf: config.Config, args: argparse.Namespace):
+    """Import users of args.path, then print the conflicting and the invalid
+    ones as JSONL."""
+    sessionmaker = postgres.create_sessionmaker(conf)
+    service = services.User(
+        dao=daos.User(sessionmaker),
+        hasher=password.create_hasher(conf, password.HashScheduler(conf)),
+    )
+
+    try:
+        with futures.ProcessPoolExecutor(args.processes) as executor:
+            result = await service.import_users(
+                read_users(args.path, args.format),
+                executor,
+                batch_size=args.batch_size,
+            )
+    finally:
+        await sessionmaker.close()
+
+    for cmd in result.conflicts:
+        json.dump({"id": str(cmd.id), "email": cmd.email}, sys.stdout)
+        sys.stdout.write("\n")
+    for cmd in result.invalid:
+        json.dump({"id": str(cmd.id), "email": cmd.email, "invalid": True},
+            sys.stdout)
+        sys.stdout.write("\n")
+    logging.info("Imported %d users, skipped %d conflicting and %d invalid "
+        "users.", result.imported, len(result.conflicts), len(result.invalid))
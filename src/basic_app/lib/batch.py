@@ -0,0 +1,97 @@
+"""Gather concurrent calls into batches handled by one call."""
+import asyncio
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    List,
+    Set,
+    Tuple,
+)
+
+from basic_app.lib import metrics
+
+_BATCH_SIZE = metrics.REGISTRY.histogram("batch_size",
+    "Items per batch handled by a Batcher.", ("batcher",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+class Batcher:
+    """Handle items submitted within a short window together.
+
+    The first item submitted to an empty batch opens it for window
+    seconds. The batch is handled when the window closes, or as soon as it
+    holds max_size items. Batches are handled concurrently with the next
+    ones being gathered.
+
+    An item whose caller is cancelled is still handled with its batch.
+    Callers of a batch cancelled midway are cancelled too.
+    """
+    def __init__(self, name: str,
+        handle: Callable[[List[Any]], Awaitable[List[Any]]],
+        window: float, max_size: int):
+        """
+        Args:
+          name: Label of the batch size metric.
+          handle: Returns the result of each item of a batch, in order. An
+            exception in place of a result is raised to the item's caller
+            only, one raised by handle to the callers of the whole batch.
+          window: Seconds a batch gathers items at most.
+          max_size: Maximum number of items in a batch.
+        """
+        self._handle = handle
+        self._window = window
+        self._max_size = max_size
+        self._sizes = _BATCH_SIZE.labels(name)
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle = None
+        # Referenced until done, the loop only keeps weak references.
+        self._running: Set[asyncio.Task] = set()
+
+    async def submit(self, item: Any) -> Any:
+        """Returns the result of item, once its batch is handled."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self._max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window, self._flush)
+        return await future
+
+    async def close(self):
+        """Handle the batch being gathered now, and wait for the batches
+        running, e.g. before closing what the handler uses."""
+        if self._pending:
+            self._flush()
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        self._sizes.observe(len(batch))
+        try:
+            results = await self._handle([item for item, _ in batch])
+        except Exception as e: # pylint: disable=broad-except
+            results = [e] * len(batch)
+        except BaseException:
+            # Don't leave callers waiting for ever.
+            for _, future in batch:
+                future.cancel()
+            raise
+
+        for (_, future), result in zip(batch, results):
+            # Skip callers cancelled meanwhile.
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,243 @@
+"""Provide an in-process LRU cache with an optional Redis tier."""
+import collections
+import dataclasses
+import json
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Optional,
+    TYPE_CHECKING,
+)
+
+if TYPE_CHECKING:
+    # Imported by lib/redis when a client is created, it is slow to import.
+    from redis import asyncio as aioredis
+
+# Returned by get when the key is not cached. None is a cacheable value,
+# used for negative caching.
+MISSING = object()
+
+@dataclasses.dataclass
+class CacheStats:
+    """Snapshot of cache counters.
+
+    Attributes:
+      size: Entries in the local tier.
+      hits: Lookups answered by either tier.
+      local_hits: Lookups answered by the local tier.
+      remote_hits: Lookups answered by the Redis tier.
+      negative_hits: Hits on cached absence, included in hits.
+      misses: Lookups missing in every tier.
+      evictions: Local entries dropped for the size bound.
+      invalidations: Keys deleted explicitly.
+      hit_ratio: hits / (hits + misses).
+    """
+    size: int
+    hits: int
+    local_hits: int
+    remote_hits: int
+    negative_hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    hit_ratio: float
+
+class LRUCache:
+    """Size bounded in-process cache whose entries expire after a TTL."""
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Args:
+          max_size: Maximum number of entries.
+          ttl: Default seconds an entry lives.
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Any:
+        """Returns the value of key, or MISSING."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        expire_at, value = entry
+        if time.monotonic() >= expire_at:
+            del self._entries[key]
+            return MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        """Cache value, evicting the least recently used entries if full."""
+        ttl = self._ttl if ttl is None else ttl
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+class RedisCache:
+    """Cache shared by processes on Redis, values are stored in JSON."""
+    def __init__(self, client: "aioredis.Redis", ttl: int,
+        prefix: str = "cache:",
+        dumps: Callable[[Any], str] = json.dumps,
+        loads: Callable[[str], Any] = json.loads):
+        """
+        Args:
+          client: Redis client.
+          ttl: Default seconds an entry lives.
+          prefix: Prefix of Redis keys.
+          dumps: Encode a value into JSON.
+          loads: Decode a value from JSON.
+        """
+        self._client = client
+        self._ttl = ttl
+        self._prefix = prefix
+        self._dumps = dumps
+        self._loads = loads
+
+    async def get(self, key: str) -> Any:
+        """Returns the value of key, or MISSING."""
+        value = await self._client.get(self._prefix + key)
+        if value is None:
+            return MISSING
+        return self._loads(value)
+
+    async def set(self, key: str, value: Any, ttl: int = None):
+        await self._client.set(self._prefix + key, self._dumps(value),
+            ex=self._ttl if ttl is None else ttl)
+
+    async def delete(self, *keys: str):
+        await self._client.delete(*(self._prefix + key for key in keys))
+
+class Cache:
+    """Read-through cache with a local tier and an optional Redis tier.
+
+    Lookups try the local LRU, then Redis, then the loader. A loader
+    result of None is cached too, in the local tier only and for
+    negative_ttl seconds, so repeated lookups of absent keys don't reach
+    the database either.
+
+    Invalidation deletes keys from the local tier of this process and
+    from Redis. Other processes keep their local copies until they expire,
+    which bounds staleness by the local TTL. A value loaded while this
+    process invalidated keys is not cached, it may predate the write that
+    invalidated them.
+    """
+    def __init__(self, local: LRUCache, remote: RedisCache = None,
+        negative_ttl: float = None):
+        """
+        Args:
+          local: The in-process tier.
+          remote: The shared tier, if any.
+          negative_ttl: Seconds a None lives, the default TTL if None.
+        """
+        self._local = local
+        self._remote = remote
+        self._negative_ttl = negative_ttl
+
+        # Counters
+        self._local_hits = 0
+        self._remote_hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+        self._invalidations = 0
+        # Incremented by every delete, to fence loads running meanwhile.
+        self._generation = 0
+
+    async def get_or_load(self, key: str,
+        load: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        """Returns the cached value of key, loading it on a miss.
+
+        Args:
+          key: Cache key.
+          load: Load the value from the source of truth, None if absent.
+        """
+        value = await self.get(key)
+        if value is not MISSING:
+            return value
+
+        generation = self._generation
+        value = await load()
+        await self.set(key, value, generation)
+        return value
+
+    @property
+    def generation(self) -> int:
+        """Taken before loading a value, fences its set against deletes
+        running meanwhile."""
+        return self._generation
+
+    async def get(self, key: str) -> Any:
+        """Returns the cached value of key, or MISSING."""
+        value = self._local.get(key)
+        if value is not MISSING:
+            self._local_hits += 1
+            self._negative_hits += value is None
+            return value
+
+        if self._remote:
+            value = await self._remote.get(key)
+            if value is not MISSING:
+                self._remote_hits += 1
+                self._negative_hits += value is None
+                self._local.set(key, value, self._ttl_of(value))
+                return value
+
+        self._misses += 1
+        return MISSING
+
+    async def set(self, key: str, value: Optional[Any],
+        generation: int = None):
+        """Cache value in every tier, None in the local one only.
+
+        A None written to Redis could outlive the delete of a process that
+        just created the value, and hide it from every process.
+
+        Args:
+          key: Cache key.
+          value: The value, None if absent.
+          generation: The generation before value was loaded, value is
+            skipped if keys were deleted since.
+        """
+        if generation is not None and generation != self._generation:
+            return
+        self._local.set(key, value, self._ttl_of(value))
+        if self._remote and value is not None:
+            await self._remote.set(key, value)
+
+    async def delete(self, *keys: str):
+        """Invalidate keys in every tier."""
+        self._generation += 1
+        for key in keys:
+            self._local.delete(key)
+        if self._remote:
+            await self._remote.delete(*keys)
+        self._invalidations += len(keys)
+
+    def _ttl_of(self, value: Optional[Any]) -> Optional[float]:
+        return self._negative_ttl if value is None else None
+
+    def stats(self) -> CacheStats:
+        """Returns a snapshot of the counters."""
+        hits = self._local_hits + self._remote_hits
+        lookups = hits + self._misses
+        return CacheStats(
+            size=len(self._local),
+            hits=hits,
+            local_hits=self._local_hits,
+            remote_hits=self._remote_hits,
+            negative_hits=self._negative_hits,
+            misses=self._misses,
+            evictions=self._local.evictions,
+            invalidations=self._invalidations,
+            hit_ratio=hits / lookups if lookups else 0.0,
+        )
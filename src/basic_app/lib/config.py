@@ -29,6 +29,20 @@ def _must_read_env(name: str, default: str = None) -> str:
         raise EnvironmentVariableNotFoundError("No")
     return value
 
+def _read_bool_env(name: str, default: bool) -> bool:
+    """Read a boolean environment variable.
+
+    Args:
+      name: The name of the environment variable.
+      default: Default value when no such variable.
+    Returns:
+      True if the value is one of "1", "true" or "yes", case insensitive.
+    """
+    value = os.getenv(name)
+    if not value:
+        return default
+    return value.lower() in ("1", "true", "yes")
+
 class Config:
     """Stores configuration for properly initialize other module."""
 
@@ -49,6 +63,121 @@ class Config:
         self.postgres_host = _must_read_env("POSTGRES_HOST")
         self.postgres_port = _must_read_env("POSTGRES_PORT")
         self.postgres_db = _must_read_env("POSTGRES_DB")
+        self.postgres_pool_size = int(_must_read_env("POSTGRES_POOL_SIZE", 5))
+        self.postgres_max_overflow = int(_must_read_env("POSTGRES_MAX_OVERFLOW", 10))
+        # In seconds, how long to wait for a connection from a full pool.
+        self.postgres_pool_timeout = float(_must_read_env("POSTGRES_POOL_TIMEOUT", 30))
+        # In seconds, -1 never recycles connections.
+        self.postgres_pool_recycle = int(_must_read_env("POSTGRES_POOL_RECYCLE", -1))
+        self.postgres_pool_pre_ping = _read_bool_env("POSTGRES_POOL_PRE_PING", False)
+        # Connections opened on startup, up to the pool size. 0 opens them
+        # on demand.
+        self.postgres_pool_prewarm = int(_must_read_env(
+            "POSTGRES_POOL_PREWARM", str(self.postgres_pool_size)))
+        # In milliseconds, 0 disables the timeout.
+        self.postgres_statement_timeout = int(_must_read_env(
+            "POSTGRES_STATEMENT_TIMEOUT", "0"))
+        self.postgres_statement_cache_size = int(_must_read_env(
+            "POSTGRES_STATEMENT_CACHE_SIZE", 100))
+        # Read replicas as comma separated host or host:port, sharing user,
+        # password and database with the primary.
+        self.postgres_replica_hosts = [host.strip() for host in
+            os.getenv("POSTGRES_REPLICA_HOSTS", "").split(",") if host.strip()]
+        # In seconds.
+        self.postgres_replica_check_interval = float(_must_read_env(
+            "POSTGRES_REPLICA_CHECK_INTERVAL", 5))
+        # In seconds, replicas lagging more are skipped.
+        self.postgres_replica_max_lag = float(_must_read_env(
+            "POSTGRES_REPLICA_MAX_LAG", 5))
+        # In seconds, how long reads of what a process wrote go to the primary.
+        self.postgres_read_your_writes_window = float(_must_read_env(
+            "POSTGRES_READ_YOUR_WRITES_WINDOW", 10))
+        # Share written keys on Redis, so reads of them from any process go
+        # to the primary. Otherwise only the process that wrote a key knows,
+        # and with several workers or hosts a client may read a replica
+        # lagging behind its own write.
+        self.postgres_read_your_writes_redis = _read_bool_env(
+            "POSTGRES_READ_YOUR_WRITES_REDIS", False)
+
+        # Group commit of signups, a window of 0 creates each signup alone.
+        self.signup_batch_window_ms = float(_must_read_env(
+            "SIGNUP_BATCH_WINDOW_MS", "0"))
+        self.signup_batch_size = int(_must_read_env("SIGNUP_BATCH_SIZE", 64))
+
+        # Redis
+        self.redis_host = _must_read_env("REDIS_HOST", "localhost")
+        self.redis_port = _must_read_env("REDIS_PORT", 6379)
+        self.redis_passwd = os.getenv("REDIS_PASSWD") or None
+        self.redis_db = _must_read_env("REDIS_DB", "0")
+        self.redis_max_connections = int(_must_read_env("REDIS_MAX_CONNECTIONS", 50))
+
+        # Session, backend is "redis" or "memory".
+        self.session_backend = _must_read_env("SESSION_BACKEND", "redis")
+        # In seconds.
+        self.session_ttl = int(_must_read_env("SESSION_TTL", 86400))
+        self.session_cookie_name = _must_read_env("SESSION_COOKIE_NAME", "session_id")
+        self.session_cookie_secure = _read_bool_env("SESSION_COOKIE_SECURE", False)
+        # Sessions per process of the memory backend.
+        self.session_memory_size = int(_must_read_env("SESSION_MEMORY_SIZE", 10000))
+
+        # User cache, a size of 0 disables it.
+        self.user_cache_size = int(_must_read_env("USER_CACHE_SIZE", 10000))
+        # In seconds, also the bound of staleness across processes.
+        self.user_cache_ttl = int(_must_read_env("USER_CACHE_TTL", 30))
+        self.user_cache_negative_ttl = int(_must_read_env(
+            "USER_CACHE_NEGATIVE_TTL", 5))
+        # Share cached users among processes on Redis.
+        self.user_cache_redis = _read_bool_env("USER_CACHE_REDIS", False)
+        self.user_cache_redis_ttl = int(_must_read_env("USER_CACHE_REDIS_TTL", 300))
+
+        # Idempotency-Key, backend is "redis" or "memory".
+        self.idempotency_backend = _must_read_env("IDEMPOTENCY_BACKEND",
+            self.session_backend)
+        # In seconds, how long retries get the stored response.
+        self.idempotency_ttl = int(_must_read_env("IDEMPOTENCY_TTL", 3600))
+        # Stored responses per process of the memory backend.
+        self.idempotency_cache_size = int(_must_read_env(
+            "IDEMPOTENCY_CACHE_SIZE", 10000))
+        # In seconds, how long a retry waits for the request in flight in
+        # another process.
+        self.idempotency_wait_timeout = float(_must_read_env(
+            "IDEMPOTENCY_WAIT_TIMEOUT", 10))
+        # In seconds, how long a request in flight holds its key on Redis.
+        # A duplicate in another process runs the handler again once it
+        # expires, so it must outlive the slowest request: the wait for the
+        # password hasher, hashing and the database write. It is at least
+        # IDEMPOTENCY_WAIT_TIMEOUT + PASSWORD_HASHER_QUEUE_TIMEOUT +
+        # PASSWORD_HASHER_TARGET_MS + POSTGRES_STATEMENT_TIMEOUT, and must be
+        # set when statements have no timeout, 0 uses that minimum.
+        self.idempotency_claim_ttl = int(_must_read_env(
+            "IDEMPOTENCY_CLAIM_TTL", "0"))
+
+        # Rate limits of auth endpoints, backend is "redis" or "memory".
+        self.rate_limit_backend = _must_read_env("RATE_LIMIT_BACKEND",
+            self.session_backend)
+        # Requests per window, by client IP to POST /login, /signup and
+        # /google-signin, and by email to POST /login and /signup. 0 disables.
+        self.rate_limit_ip_requests = int(_must_read_env(
+            "RATE_LIMIT_IP_REQUESTS", "120"))
+        self.rate_limit_email_requests = int(_must_read_env(
+            "RATE_LIMIT_EMAIL_REQUESTS", "10"))
+        # In seconds.
+        self.rate_limit_window = float(_must_read_env("RATE_LIMIT_WINDOW", 60))
+        # Keys counted per process by the memory backend.
+        self.rate_limit_cache_size = int(_must_read_env(
+            "RATE_LIMIT_CACHE_SIZE", 100000))
+
+        # Password hashing, backend is "argon2", "scrypt" or "bcrypt". Hashes
+        # of the others are still verified, and rehashed at login.
+        self.password_hasher_backend = _must_read_env(
+            "PASSWORD_HASHER_BACKEND", "argon2")
+        # Replace the parameters of the backend with ones calibrated on this
+        # host at startup.
+        self.password_hasher_calibrate = _read_bool_env(
+            "PASSWORD_HASHER_CALIBRATE", False)
+        # In milliseconds, the verify latency calibration aims for.
+        self.password_hasher_target_ms = float(_must_read_env(
+            "PASSWORD_HASHER_TARGET_MS", 50))
 
         # Argon2
         self.argon2_memory_cost = _must_read_env("ARGON2_MEMORY_COST", 16384)
@@ -56,12 +185,77 @@ class Config:
         self.argon2_parallelism = _must_read_env("ARGON2_PARALLELISM", 1)
         self.argon2_hash_len = _must_read_env("ARGON2_HASH_LEN", 32)
 
+        # scrypt, N is 2 ** SCRYPT_LN.
+        self.scrypt_ln = _must_read_env("SCRYPT_LN", 15)
+        self.scrypt_r = _must_read_env("SCRYPT_R", 8)
+        self.scrypt_p = _must_read_env("SCRYPT_P", 1)
+
+        # bcrypt, cost as log2 of rounds.
+        self.bcrypt_rounds = _must_read_env("BCRYPT_ROUNDS", 12)
+
+        # App server
+        self.workers = int(_must_read_env("APP_WORKERS", 1))
+        # "auto" picks uvloop and httptools when installed.
+        self.uvicorn_loop = _must_read_env("APP_LOOP", "auto")
+        self.uvicorn_http = _must_read_env("APP_HTTP", "auto")
+        self.backlog = int(_must_read_env("APP_BACKLOG", 2048))
+        self.timeout_keep_alive = int(_must_read_env("APP_TIMEOUT_KEEP_ALIVE", 5))
+        # In seconds, 0 waits for in-flight requests without a limit.
+        self.timeout_graceful_shutdown = int(_must_read_env(
+            "APP_TIMEOUT_GRACEFUL_SHUTDOWN", "0"))
+
+        # Password hasher, by default workers share the cores.
+        self.password_hasher_pool_size = int(_must_read_env(
+            "PASSWORD_HASHER_POOL_SIZE",
+            max((os.cpu_count() or 1) // self.workers, 1)))
+        self.password_hasher_queue_depth = int(_must_read_env(
+            "PASSWORD_HASHER_QUEUE_DEPTH", 64))
+        self.password_hasher_queue_timeout = float(_must_read_env(
+            "PASSWORD_HASHER_QUEUE_TIMEOUT", 2.0))
+        # In KiB, the same unit as ARGON2_MEMORY_COST.
+        self.password_hasher_memory_budget = int(_must_read_env(
+            "PASSWORD_HASHER_MEMORY_BUDGET", 262144))
+
+        # Warm-up on startup, in seconds per step. A step taking longer is
+        # left to the first requests.
+        self.warmup_timeout = float(_must_read_env("APP_WARMUP_TIMEOUT", 10))
+        # Construct Google sign-in and fetch its certs on startup rather than
+        # on its first request.
+        self.warmup_google_signin = _read_bool_env("APP_WARMUP_GOOGLE_SIGNIN", True)
+        # In seconds, how long /readyz waits for each dependency.
+        self.readiness_timeout = float(_must_read_env("APP_READINESS_TIMEOUT", 2))
+
+        # Profiling, off unless sampling or the header trigger is set.
+        self.profiling_sample_rate = float(_must_read_env(
+            "PROFILING_SAMPLE_RATE", "0"))
+        self.profiling_header = _must_read_env("PROFILING_HEADER", "X-Profile")
+        # The header triggers profiling only with this value.
+        self.profiling_token = os.getenv("PROFILING_TOKEN") or None
+        self.profiling_threshold_ms = float(_must_read_env(
+            "PROFILING_THRESHOLD_MS", 500))
+        self.profiling_dir = _must_read_env("PROFILING_DIR", "profiles")
+        self.profiling_max_dumps = int(_must_read_env("PROFILING_MAX_DUMPS", 1000))
+
         # App
         self.host = _must_read_env("APP_HOST")
         self.port = _must_read_env("APP_PORT")
         self.logging_level = _must_read_env("APP_LOGGING_LEVEL", "INFO")
         self.logging_fmt = _must_read_env("APP_LOGGING_FMT", "%(asctime)s %(levelname)s %(module)s %(lineno)d %(message)s")
+        # JSON renderer, "auto" uses orjson when installed, or "orjson", "json".
+        self.json_response = _must_read_env("APP_JSON_RESPONSE", "auto")
+        # "text" in logging_fmt, or "json".
+        self.logging_format = _must_read_env("APP_LOGGING_FORMAT", "text")
+        # Records queued for the writer thread, 0 writes synchronously.
+        self.logging_queue_size = int(_must_read_env("APP_LOGGING_QUEUE_SIZE", "0"))
+        # Per-logger levels, e.g. "sqlalchemy.engine=WARNING,uvicorn.access=ERROR".
+        self.logging_levels = os.getenv("APP_LOGGING_LEVELS", "")
+        # Bearer token GET /status and /metrics require, shared with the
+        # scraper. Empty leaves them open, they must then be unreachable from
+        # outside, e.g. blocked at the load balancer.
+        self.status_token = os.getenv("APP_STATUS_TOKEN", "")
         self.google_client_id = _must_read_env("APP_GOOGLE_CLIENT_ID")
+        self.google_certs_url = _must_read_env("APP_GOOGLE_CERTS_URL",
+            "https://www.googleapis.com/oauth2/v1/certs")
 
 def setup(envfile: str = ".env") -> Config:
     """Returns a singleton Config object
@@ -2,18 +2,28 @@
 from typing import (
     List,
     Any,
+    Dict,
 )
 from enum import Enum
 import fastapi
-from fastapi import responses
 from fastapi.exceptions import RequestValidationError
 
+from basic_app.lib import (
+    metrics,
+    response,
+)
+
 class ErrorCode(Enum):
     """Define generic error code for this app."""
     INVALID_INPUT = (400, "Request validation error.")
     AUTHENTICATION_FAIL = (401, "Failed to authentiacate user.")
     EMAIL_ALEADY_EXISTS = (409, "This email is already registered.")
     RESOURCE_ID_ALREADY_EXISTS = (409, "Resource ID is already used.")
+    IDEMPOTENCY_KEY_IN_USE = (409, "A request with this Idempotency-Key is in progress.")
+    IDEMPOTENCY_KEY_REUSED = (422, "Idempotency-Key was used by another request.")
+    TOO_MANY_REQUESTS = (429, "Too many requests, please retry later.")
+    SERVER_BUSY = (503, "Server is busy, please retry later.")
+    UPSTREAM_UNAVAILABLE = (503, "A service we depend on is unavailable, please retry later.")
 
     @property
     def status(self) -> str:
@@ -28,11 +38,30 @@ class ErrorCode(Enum):
         return self.value[1]
 
 
+ERRORS = metrics.REGISTRY.counter("app_errors_total",
+    "Errors returned to clients.", ("code",))
+
 class AppException(Exception):
-    def __init__(self, code: ErrorCode, message: str = None, details: List[Any] = []):
+    def __init__(self, code: ErrorCode, message: str = None, details: List[Any] = [],
+        headers: Dict[str, str] = None):
         self.code = code
         self.message = message
         self.details = details
+        # Extra response headers, like Retry-After.
+        self.headers = headers
+
+def error_response(e: AppException) -> fastapi.Response:
+    """Returns the error response of e, also for middlewares, which run
+    outside of the exception handlers."""
+    ERRORS.labels(e.code.status).inc()
+    return response.json_response({
+        'error': {
+            'code': e.code.http_code,
+            'message': e.message if e.message else e.code.message,
+            'status': e.code.status,
+            'details': e.details,
+        }
+    }, status_code=e.code.http_code, headers=e.headers)
 
 
 def setup(app: fastapi.FastAPI):
@@ -53,7 +82,8 @@ def setup(app: fastapi.FastAPI):
             })
 
         error = ErrorCode.INVALID_INPUT
-        return responses.JSONResponse({
+        ERRORS.labels(error.status).inc()
+        return response.json_response({
             'error': {
                 'code': error.http_code,
                 'message': error.message,
@@ -64,12 +94,4 @@ def setup(app: fastapi.FastAPI):
 
     @app.exception_handler(AppException)
     async def http_exception_handler(_, exc):
-        e: AppException = exc
-        return responses.JSONResponse({
-            'error': {
-                'code': e.code.http_code,
-                'message': e.message if e.message else e.code.message,
-                'status': e.code.status,
-                'details': e.details,
-            }
-        }, status_code=e.code.http_code)
+        return error_response(exc)
@@ -0,0 +1,210 @@
+"""Verify Google ID tokens with locally cached signing certs.
+
+google.auth and requests take a large share of the app's import time,
+so they are imported on the first verification rather than at startup.
+"""
+import asyncio
+import contextlib
+import logging
+import re
+import time
+from typing import (
+    Any,
+    Dict,
+    Optional,
+)
+
+from basic_app.lib import exception
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+
+_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+def _parse_max_age(headers) -> Optional[int]:
+    """Returns seconds the response may be cached for.
+
+    Args:
+      headers: HTTP response headers.
+    Returns:
+      max-age of Cache-Control minus Age, or None if not cacheable.
+    """
+    match = _MAX_AGE.search(headers.get("Cache-Control", ""))
+    if not match:
+        return None
+    age = int(headers.get("Age", 0) or 0)
+    return max(int(match.group(1)) - age, 0)
+
+@contextlib.contextmanager
+def _malformed_as_value_error():
+    """Raise errors of parsing a token as ValueError, like google.auth
+    does for most of them."""
+    try:
+        yield
+    except ValueError:
+        raise
+    except Exception as e: # pylint: disable=broad-except
+        raise ValueError("Malformed ID token.") from e
+
+class GoogleIdTokenVerifier:
+    """Verify Google ID tokens without an HTTP request per sign-in.
+
+    Google's signing certs are fetched once and cached for as long as their
+    Cache-Control max-age allows. A background task refreshes them before
+    they expire, and tokens signed by an unknown key trigger an early
+    refresh, at most once per min_refresh_interval. Signature checks run in
+    the default executor so they don't block the event loop.
+    """
+    def __init__(self, client_id: str,
+        certs_url: str = GOOGLE_CERTS_URL,
+        default_max_age: int = 300,
+        min_refresh_interval: int = 30,
+        fetch_timeout: float = 5.0):
+        """
+        Args:
+          client_id: The expected audience of tokens.
+          certs_url: Where to fetch signing certs in JSON.
+          default_max_age: Cache seconds when the response has no max-age.
+          min_refresh_interval: Minimum seconds between two fetches.
+          fetch_timeout: Timeout in seconds for fetching certs.
+        """
+        self._client_id = client_id
+        self._certs_url = certs_url
+        self._default_max_age = default_max_age
+        self._min_refresh_interval = min_refresh_interval
+        self._fetch_timeout = fetch_timeout
+
+        self._certs: Optional[Dict[str, str]] = None
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._attempted_at = float("-inf")
+        self._fetching: Optional[asyncio.Future] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        """Verify an ID token and return its claims.
+
+        Args:
+          token: The ID token posted by Google Identity Services.
+        Returns:
+          Claims of the token.
+        Raises:
+          ValueError: If the token is invalid.
+          AppException: If there are no certs, and they can't be fetched.
+        """
+        if not token:
+            raise ValueError("No ID token.")
+        from google.auth import jwt # pylint: disable=import-outside-toplevel
+
+        certs = await self._get_certs()
+        with _malformed_as_value_error():
+            kid = jwt.decode_header(token).get("kid")
+        if kid not in certs:
+            certs = await self._refresh()
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._decode, token, certs)
+
+    async def prefetch(self):
+        """Import google.auth and fetch certs ahead of the first
+        verification, which starts the background refresh too."""
+        # pylint: disable=import-outside-toplevel,unused-import
+        from google.auth import jwt
+        await self._get_certs()
+
+    def _decode(self, token: str, certs: Dict[str, str]) -> Dict[str, Any]:
+        """Check signature, expiry, audience and issuer of token."""
+        from google.auth import jwt # pylint: disable=import-outside-toplevel
+        with _malformed_as_value_error():
+            claims = jwt.decode(token, certs=certs, audience=self._client_id)
+        if claims.get("iss") not in _ISSUERS:
+            raise ValueError("Wrong issuer \"{}\".".format(claims.get("iss")))
+        return claims
+
+    async def _get_certs(self) -> Dict[str, str]:
+        """Returns cached certs, fetching them when missing or expired."""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+        if self._certs is None or time.monotonic() >= self._expires_at:
+            return await self._refresh()
+        return self._certs
+
+    async def _refresh(self) -> Dict[str, str]:
+        """Fetch certs, sharing one in-flight fetch among callers.
+
+        Fetches are skipped while the last attempt is more recent than
+        min_refresh_interval, unless there are no certs at all.
+
+        Returns:
+          The latest certs, stale ones if the fetch failed.
+        Raises:
+          AppException: If the fetch failed and there are no certs.
+        """
+        elapsed = time.monotonic() - self._attempted_at
+        if self._certs is not None and elapsed < self._min_refresh_interval:
+            return self._certs
+
+        if self._fetching is None:
+            self._fetching = asyncio.ensure_future(self._fetch())
+        fetching = self._fetching
+        try:
+            await asyncio.shield(fetching)
+        except Exception as e: # pylint: disable=broad-except
+            if self._certs is None:
+                logging.exception("Failed to fetch Google certs.")
+                raise exception.AppException(
+                    code=exception.ErrorCode.UPSTREAM_UNAVAILABLE,
+                    message="Failed to fetch Google certs.",
+                ) from e
+            logging.exception("Failed to refresh Google certs, using stale ones.")
+        finally:
+            if self._fetching is fetching and fetching.done():
+                self._fetching = None
+        return self._certs
+
+    async def _fetch(self):
+        """Fetch certs from certs_url and update the cache."""
+        import requests # pylint: disable=import-outside-toplevel
+        self._attempted_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+        resp = await loop.run_in_executor(None, lambda: requests.get(
+            self._certs_url, timeout=self._fetch_timeout))
+        resp.raise_for_status()
+
+        max_age = _parse_max_age(resp.headers)
+        if max_age is None:
+            max_age = self._default_max_age
+
+        now = time.monotonic()
+        self._certs = resp.json()
+        self._fetched_at = now
+        self._expires_at = now + max_age
+        logging.info("Fetched %d Google certs, valid for %d seconds.",
+            len(self._certs), max_age)
+
+    async def _refresh_loop(self):
+        """Refresh certs shortly before they expire."""
+        while True:
+            # Refresh at 90% of the lifetime, retry failures after the
+            # minimum refresh interval.
+            lifetime = self._expires_at - self._fetched_at
+            delay = self._fetched_at + lifetime * 0.9 - time.monotonic()
+            await asyncio.sleep(max(delay, self._min_refresh_interval))
+            try:
+                await self._refresh()
+            except exception.AppException:
+                pass # Logged by _refresh.
+            except Exception: # pylint: disable=broad-except
+                logging.exception("Failed to fetch Google certs.")
+
+    async def close(self):
+        """Stop the background refresh."""
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
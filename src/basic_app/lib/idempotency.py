@@ -0,0 +1,344 @@
+"""Replay the outcome of retried requests carrying an Idempotency-Key.
+
+The first request with a key runs, and its outcome is stored for a short
+TTL. Retries with the same key get the stored outcome back without running
+the handler again. Duplicates arriving while the first one is in flight
+wait for it: in the same process on a future, across processes by polling
+the store while the first one holds a claim on the key. A duplicate runs
+the handler itself when the first one releases the claim without an
+outcome.
+
+Successful responses and client errors are stored. Server errors, like a
+full hashing queue, are not, so a retry runs again.
+"""
+import asyncio
+import dataclasses
+import hashlib
+import json
+import math
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Optional,
+    TYPE_CHECKING,
+    Tuple,
+)
+from fastapi import responses
+
+from basic_app.lib import (
+    cache,
+    config,
+    exception,
+    metrics,
+)
+
+if TYPE_CHECKING:
+    from redis import asyncio as aioredis
+
+HEADER = "Idempotency-Key"
+# Set on responses replayed from the store.
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+_REQUESTS = metrics.REGISTRY.counter("idempotency_requests_total",
+    "Requests with an Idempotency-Key, by outcome: executed, replayed "
+    "from the store or coalesced onto an in-flight duplicate.", ("outcome",))
+
+@dataclasses.dataclass
+class StoredResponse:
+    """Outcome of a request, replayed to its retries.
+
+    Attributes:
+      fingerprint: Digest of the request, a key is only replayed to the
+        same request.
+      status_code: HTTP status code.
+      body: JSON body of a successful response.
+      error: ErrorCode name of a failed request.
+      message: Message of the failed request, if any.
+    """
+    fingerprint: str
+    status_code: int
+    body: Optional[str] = None
+    error: Optional[str] = None
+    message: Optional[str] = None
+
+def fingerprint(*fields: Any) -> str:
+    """Returns a digest of request fields."""
+    return hashlib.sha256(
+        json.dumps(fields, default=str).encode()).hexdigest()
+
+class IdempotencyStore:
+    """Define base idempotency store."""
+
+    async def get(self, key: str) -> Optional[StoredResponse]:
+        """Returns the stored outcome of key, or None."""
+        raise NotImplementedError
+
+    async def claim(self, key: str) -> bool:
+        """Mark key in flight, False if another process already did."""
+        raise NotImplementedError
+
+    async def save(self, key: str, stored: StoredResponse):
+        """Store the outcome of key and drop its claim."""
+        raise NotImplementedError
+
+    async def release(self, key: str):
+        """Drop the claim of key without an outcome, so a retry runs again."""
+        raise NotImplementedError
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    """Idempotency store in process memory, bounded in size.
+
+    Claims always succeed, in-flight duplicates within a process are
+    coalesced by Idempotency already.
+    """
+    def __init__(self, ttl: int, max_size: int):
+        """
+        Args:
+          ttl: Seconds an outcome is stored.
+          max_size: Maximum number of stored outcomes.
+        """
+        self._outcomes = cache.LRUCache(max_size, ttl)
+
+    async def get(self, key: str) -> Optional[StoredResponse]:
+        stored = self._outcomes.get(key)
+        return None if stored is cache.MISSING else stored
+
+    async def claim(self, key: str) -> bool:
+        return True
+
+    async def save(self, key: str, stored: StoredResponse):
+        self._outcomes.set(key, stored)
+
+    async def release(self, key: str):
+        pass
+
+class RedisIdempotencyStore(IdempotencyStore):
+    """Idempotency store on Redis, shared by processes.
+
+    A claim is a SET NX key expiring after claim_ttl, so a crashed process
+    doesn't block its key for longer. claim_ttl must outlive the handler,
+    or a duplicate in another process claims the key and runs it again.
+    """
+    def __init__(self, client: "aioredis.Redis", ttl: int, claim_ttl: int,
+        prefix: str = "idempotency:"):
+        """
+        Args:
+          client: Redis client.
+          ttl: Seconds an outcome is stored.
+          claim_ttl: Seconds a claim lives at most.
+          prefix: Prefix of Redis keys.
+        """
+        self._client = client
+        self._ttl = ttl
+        self._claim_ttl = claim_ttl
+        self._prefix = prefix
+
+    def _claim_key(self, key: str) -> str:
+        return "{}claim:{}".format(self._prefix, key)
+
+    async def get(self, key: str) -> Optional[StoredResponse]:
+        value = await self._client.get(self._prefix + key)
+        if value is None:
+            return None
+        return StoredResponse(**json.loads(value))
+
+    async def claim(self, key: str) -> bool:
+        return bool(await self._client.set(self._claim_key(key), "1",
+            nx=True, ex=self._claim_ttl))
+
+    async def save(self, key: str, stored: StoredResponse):
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.set(self._prefix + key, json.dumps(dataclasses.asdict(stored)),
+                ex=self._ttl)
+            pipe.delete(self._claim_key(key))
+            await pipe.execute()
+
+    async def release(self, key: str):
+        await self._client.delete(self._claim_key(key))
+
+def _replay(stored: StoredResponse, fingerprint: str) -> responses.Response:
+    """Returns the stored response, or raises the stored error."""
+    if stored.fingerprint != fingerprint:
+        raise exception.AppException(
+            code=exception.ErrorCode.IDEMPOTENCY_KEY_REUSED,
+        )
+    if stored.error:
+        raise exception.AppException(
+            code=exception.ErrorCode[stored.error],
+            message=stored.message,
+        )
+    return responses.Response(
+        stored.body,
+        status_code=stored.status_code,
+        media_type="application/json",
+        headers={REPLAYED_HEADER: "true"},
+    )
+
+class Idempotency:
+    """Run a request once per Idempotency-Key."""
+    def __init__(self, store: IdempotencyStore, wait_timeout: float,
+        poll_interval: float = 0.05):
+        """
+        Args:
+          store: Where outcomes are stored.
+          wait_timeout: Seconds to wait for a duplicate in flight in
+            another process.
+          poll_interval: Seconds between polls of the store while waiting.
+        """
+        self._store = store
+        self._wait_timeout = wait_timeout
+        self._poll_interval = poll_interval
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    async def run(self, scope: str, key: str, fingerprint: str,
+        execute: Callable[[], Awaitable[responses.Response]],
+        ) -> responses.Response:
+        """Returns the response of execute, or the stored one for key.
+
+        Args:
+          scope: Namespace of key, like the route.
+          key: Value of the Idempotency-Key header.
+          fingerprint: Digest of the request, see fingerprint.
+          execute: Handle the request, returning a JSON response.
+        Raises:
+          AppException: Raised by execute now or when it ran for key
+            before, or for an invalid or reused key.
+        """
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise exception.AppException(
+                code=exception.ErrorCode.INVALID_INPUT,
+                message="{} must have 1 to {} characters.".format(
+                    HEADER, MAX_KEY_LENGTH),
+            )
+        key = "{}:{}".format(scope, key)
+
+        while True:
+            stored = await self._store.get(key)
+            if stored is not None:
+                _REQUESTS.labels("replayed").inc()
+                return _replay(stored, fingerprint)
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            if inflight[0] != fingerprint:
+                raise exception.AppException(
+                    code=exception.ErrorCode.IDEMPOTENCY_KEY_REUSED,
+                )
+            _REQUESTS.labels("coalesced").inc()
+            try:
+                stored = await asyncio.shield(inflight[1])
+            except asyncio.CancelledError:
+                # The first request was cancelled, not this one, try again.
+                if inflight[1].cancelled():
+                    continue
+                raise
+            return _replay(stored, fingerprint)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (fingerprint, future)
+        try:
+            resp, stored = await self._lead(key, fingerprint, execute)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved, there may be no duplicate waiting.
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+        future.set_result(stored)
+        return resp
+
+    async def _lead(self, key: str, fingerprint: str,
+        execute: Callable[[], Awaitable[responses.Response]],
+        ) -> Tuple[responses.Response, StoredResponse]:
+        if not await self._store.claim(key):
+            stored = await self._wait(key)
+            if stored is not None:
+                _REQUESTS.labels("coalesced").inc()
+                return _replay(stored, fingerprint), stored
+
+        _REQUESTS.labels("executed").inc()
+        try:
+            resp = await execute()
+        except exception.AppException as e:
+            if e.code.http_code >= 500:
+                await self._store.release(key)
+                raise
+            await self._store.save(key, StoredResponse(
+                fingerprint=fingerprint,
+                status_code=e.code.http_code,
+                error=e.code.name,
+                message=e.message,
+            ))
+            raise
+        except BaseException:
+            await asyncio.shield(self._store.release(key))
+            raise
+
+        stored = StoredResponse(
+            fingerprint=fingerprint,
+            status_code=resp.status_code,
+            body=resp.body.decode(),
+        )
+        await self._store.save(key, stored)
+        return resp, stored
+
+    async def _wait(self, key: str) -> Optional[StoredResponse]:
+        """Returns the outcome of key stored by another process, or None
+        once this process claimed key, after the other one released it
+        without an outcome."""
+        deadline = time.monotonic() + self._wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self._poll_interval)
+            stored = await self._store.get(key)
+            if stored is not None:
+                return stored
+            if await self._store.claim(key):
+                # The outcome may have been saved since the get.
+                stored = await self._store.get(key)
+                if stored is not None:
+                    await self._store.release(key)
+                return stored
+        raise exception.AppException(
+            code=exception.ErrorCode.IDEMPOTENCY_KEY_IN_USE,
+        )
+
+def create_store(conf: config.Config,
+    client: "aioredis.Redis" = None) -> IdempotencyStore:
+    """Create the idempotency store selected by IDEMPOTENCY_BACKEND.
+
+    Args:
+      conf: Config object.
+      client: Redis client, required by the redis backend.
+    """
+    if conf.idempotency_backend == "memory":
+        return InMemoryIdempotencyStore(conf.idempotency_ttl,
+            conf.idempotency_cache_size)
+    return RedisIdempotencyStore(client, conf.idempotency_ttl,
+        claim_ttl=claim_ttl(conf))
+
+def claim_ttl(conf: config.Config) -> int:
+    """Returns seconds a claim lives, IDEMPOTENCY_CLAIM_TTL but no less than
+    IDEMPOTENCY_WAIT_TIMEOUT plus the longest a request queues for the
+    password hasher, hashes and runs a statement.
+
+    Raises:
+      ValueError: Statements have no timeout and IDEMPOTENCY_CLAIM_TTL is
+        not set, so no claim is known to outlive a request.
+    """
+    if not conf.postgres_statement_timeout and not conf.idempotency_claim_ttl:
+        raise ValueError("IDEMPOTENCY_CLAIM_TTL must be set when "
+            "POSTGRES_STATEMENT_TIMEOUT is 0.")
+    slowest = conf.idempotency_wait_timeout +\
+        conf.password_hasher_queue_timeout +\
+        conf.password_hasher_target_ms / 1000 +\
+        conf.postgres_statement_timeout / 1000
+    return max(conf.idempotency_claim_ttl, math.ceil(slowest), 1)
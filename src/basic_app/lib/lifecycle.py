@@ -0,0 +1,128 @@
+"""Warm up dependencies on startup, and release them on shutdown.
+
+A new process pays for connecting to Postgres, loading the hashing
+library and fetching signing keys on its first requests. Warm-up steps do
+it before serving, and the process reports ready once they are done, so
+its first requests are as fast as the next ones.
+"""
+import asyncio
+import logging
+import time
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from basic_app.lib import metrics
+
+# Runs a step, or checks a dependency by raising when it is down.
+Hook = Callable[[], Awaitable[None]]
+
+class Lifecycle:
+    """Startup and shutdown hooks, and readiness of the process.
+
+    Warm-up steps run concurrently on startup, each for at most
+    warmup_timeout seconds. A failed step is logged and doesn't stop the
+    startup, the dependency is then set up by the first request instead,
+    and its check keeps the process not ready while it is down.
+    """
+    def __init__(self, warmup_timeout: float, check_timeout: float):
+        """
+        Args:
+          warmup_timeout: Seconds a warm-up step may take.
+          check_timeout: Seconds a readiness check may take.
+        """
+        self._warmup_timeout = warmup_timeout
+        self._check_timeout = check_timeout
+        self._warmups: List[Tuple[str, Hook]] = []
+        self._shutdowns: List[Tuple[str, Hook]] = []
+        self._checks: List[Tuple[str, Hook]] = []
+        self._warm = False
+        self._stopping = False
+        self.warmup_seconds: Dict[str, float] = {}
+
+        metrics.REGISTRY.gauge("app_warmup_seconds",
+            "Seconds taken by each warm-up step on startup.",
+            lambda: {(name,): seconds
+                for name, seconds in self.warmup_seconds.items()}, ("step",))
+
+    def on_startup(self, name: str, hook: Hook):
+        """Run hook as warm-up step name on startup."""
+        self._warmups.append((name, hook))
+
+    def on_shutdown(self, name: str, hook: Hook):
+        """Run hook on shutdown, after those added later."""
+        self._shutdowns.append((name, hook))
+
+    def add_check(self, name: str, check: Hook):
+        """Keep the process not ready while check raises."""
+        self._checks.append((name, check))
+
+    @property
+    def warm(self) -> bool:
+        """Whether warm-up is done, and shutdown hasn't started."""
+        return self._warm and not self._stopping
+
+    async def _warm_up(self, name: str, hook: Hook):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(hook(), self._warmup_timeout)
+        except Exception: # pylint: disable=broad-except
+            logging.exception("Warm-up step %s failed.", name)
+        self.warmup_seconds[name] = time.perf_counter() - start
+
+    async def startup(self):
+        """Run warm-up steps."""
+        start = time.perf_counter()
+        await asyncio.gather(*(self._warm_up(name, hook)
+            for name, hook in self._warmups))
+        self._warm = True
+        logging.info("Warmed up in %.3f seconds: %s.",
+            time.perf_counter() - start, ", ".join("{} {:.3f}s".format(
+                name, seconds) for name, seconds in self.warmup_seconds.items()))
+
+    async def shutdown(self):
+        """Run shutdown hooks in reverse order."""
+        self._stopping = True
+        for name, hook in reversed(self._shutdowns):
+            try:
+                await hook()
+            except Exception: # pylint: disable=broad-except
+                logging.exception("Shutdown hook %s failed.", name)
+
+    async def _check(self, check: Hook) -> str:
+        try:
+            await asyncio.wait_for(check(), self._check_timeout)
+        except asyncio.TimeoutError:
+            return "timed out"
+        except Exception as e: # pylint: disable=broad-except
+            return "{}: {}".format(type(e).__name__, e)
+        return "ok"
+
+    async def check(self) -> Dict[str, str]:
+        """Returns "ok" or the error of each readiness check."""
+        results = await asyncio.gather(*(self._check(check)
+            for _, check in self._checks))
+        return {name: result
+            for (name, _), result in zip(self._checks, results)}
+
+_lifecycle: Optional[Lifecycle] = None
+
+def setup(lifecycle: Optional[Lifecycle]):
+    """Run hooks of lifecycle on startup and shutdown of API."""
+    global _lifecycle
+    _lifecycle = lifecycle
+
+async def startup():
+    """Startup event handler of API."""
+    if _lifecycle:
+        await _lifecycle.startup()
+
+async def shutdown():
+    """Shutdown event handler of API."""
+    if _lifecycle:
+        await _lifecycle.shutdown()
@@ -1,6 +1,27 @@
 """Provide logging utility"""
+import atexit
+import copy
+import datetime as dt
+import json
 import logging
-from basic_app.lib import config
+import queue
+import sys
+from logging import handlers
+from typing import Dict
+
+from basic_app.lib import (
+    config,
+    metrics,
+)
+
+_DROPPED = metrics.REGISTRY.counter("log_records_dropped_total",
+    "Log records dropped because the logging queue was full.")
+
+# Attributes every LogRecord has, the others come from `extra`.
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord(
+    "", logging.INFO, "", 0, "", (), None)).keys()) | {"message", "asctime"}
+
+_listener = None
 
 def _get_logging_level(level: str) -> int:
     """Returns logging level for Python logging module from str.
@@ -19,16 +40,107 @@ def _get_logging_level(level: str) -> int:
     }
     return mapping.get(level, logging.INFO)
 
+def _parse_levels(levels: str) -> Dict[str, int]:
+    """Returns logging levels of loggers.
+
+    Args:
+      levels: Comma separated "<logger>=<level>", e.g.
+        "sqlalchemy.engine=WARNING,uvicorn.access=ERROR".
+    """
+    out = {}
+    for item in levels.split(","):
+        if not item.strip():
+            continue
+        name, _, level = item.partition("=")
+        out[name.strip()] = _get_logging_level(level.strip().upper())
+    return out
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line.
+
+    Fields passed with `extra` are included as they are, so they should be
+    JSON serializable.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "time": dt.datetime.fromtimestamp(
+                record.created, dt.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out["exception"] = record.exc_text
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in out:
+                out[key] = value
+        return json.dumps(out, default=str)
+
+class DroppingQueueHandler(handlers.QueueHandler):
+    """Queue handler which drops records when the queue is full.
+
+    Only the message is rendered in the logging thread, formatting and
+    I/O happen in the listener thread.
+    """
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DROPPED.inc()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Args may be mutated after the call, render them now.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def _stop_listener():
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
 def setup(conf: config.Config):
     """Setup default logger
 
+    With a queue size, records are handed to a bounded queue and written
+    by a background thread, so slow stdout never blocks the event loop.
+    Records arriving while the queue is full are dropped and counted.
+
     Args:
-      level: Logging level, which may be read from environment variables.
-      fmt: Message format for logging.
+      conf: Config of level, format, queue size and per-logger levels.
     """
+    if conf.logging_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(conf.logging_fmt)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(formatter)
+
+    _stop_listener()
+    if conf.logging_queue_size > 0:
+        records = queue.Queue(conf.logging_queue_size)
+        global _listener
+        _listener = handlers.QueueListener(records, handler,
+            respect_handler_level=True)
+        _listener.start()
+        atexit.unregister(_stop_listener)
+        atexit.register(_stop_listener)
+        handler = DroppingQueueHandler(records)
 
     logging.basicConfig(
-        format=conf.logging_fmt,
+        handlers=[handler],
         level=_get_logging_level(conf.logging_level),
         force=True
     )
+
+    for name, level in _parse_levels(conf.logging_levels).items():
+        logging.getLogger(name).setLevel(level)
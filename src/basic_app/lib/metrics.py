@@ -0,0 +1,285 @@
+"""Provide metrics cheap enough to leave on, in Prometheus text format.
+
+Metrics are plain counters updated from the event loop thread, so no locks
+are taken when recording. Histograms have fixed buckets, an observation
+is one bisect and two additions. Rendering happens only when scraped.
+"""
+import bisect
+import functools
+import time
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Sequence,
+    Tuple,
+)
+
+# In seconds, from a cache hit to a slow Argon2 hash.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: str) -> str:
+    """Escape a label value as the text format requires."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').\
+        replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str],
+    extra: str = "") -> str:
+    pairs = ['{}="{}"'.format(n, _escape(str(v)))
+        for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        # The last count is for the +Inf bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> "_Timer":
+        """Returns a context manager observing the seconds it encloses."""
+        return _Timer(self)
+
+class _Timer:
+    __slots__ = ("_child", "_start")
+
+    def __init__(self, child: _HistogramChild):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self._child.observe(time.perf_counter() - self._start)
+
+class _Metric:
+    """A metric family, with a child per combination of label values."""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str,
+        labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """Returns the child of label values, create it if missing.
+
+        Label values should come from a small set, like route templates
+        or error codes, never from user input.
+        """
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """A value only going up."""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        """Increase the counter without labels."""
+        self._children[()].inc(amount)
+
+    def render(self) -> List[str]:
+        return ["{}{} {}".format(self.name,
+            _format_labels(self.labelnames, values), child.value)
+            for values, child in list(self._children.items())]
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        """Observe a value without labels."""
+        self._children[()].observe(value)
+
+    def time(self) -> _Timer:
+        """Time a block without labels."""
+        return self._children[()].time()
+
+    def render(self) -> List[str]:
+        lines = []
+        bounds = [str(b) for b in self.buckets] + ["+Inf"]
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, child.counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(self.name,
+                    _format_labels(self.labelnames, values,
+                        'le="{}"'.format(bound)), cumulative))
+            labels = _format_labels(self.labelnames, values)
+            lines.append("{}_sum{} {}".format(self.name, labels, child.sum))
+            lines.append("{}_count{} {}".format(self.name, labels, child.count))
+        return lines
+
+class Gauge(_Metric):
+    """A value read from a callback when scraped.
+
+    The callback returns a number, or a dict from label values to numbers.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str,
+        callback: Callable[[], object], labelnames: Sequence[str] = ()):
+        self._callback = callback
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return None
+
+    def render(self) -> List[str]:
+        value = self._callback()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return ["{}{} {}".format(self.name,
+            _format_labels(self.labelnames, values), float(v))
+            for values, v in value.items()]
+
+class Registry:
+    """Collection of metrics to render."""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add metric, replacing the one of the same name."""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str,
+        labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str,
+        callback: Callable[[], object],
+        labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, callback, labelnames))
+
+    def render(self) -> str:
+        """Returns all metrics in Prometheus text format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def timed(histogram: Histogram, *labelvalues: str):
+    """Decorate a coroutine function to observe how long it takes.
+
+    Args:
+      histogram: Where to observe seconds.
+      labelvalues: Label values of the child to observe.
+    """
+    child = histogram.labels(*labelvalues)
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with child.time():
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram("http_request_duration_seconds",
+    "Latency of HTTP requests.", ("method", "route", "status"))
+
+# Other methods are labeled "other", clients may send any token.
+_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "DELETE", "CONNECT",
+    "OPTIONS", "TRACE", "PATCH"))
+
+class Middleware:
+    """ASGI middleware observing the latency of every HTTP request.
+
+    Requests are labeled by route template rather than path, so path
+    parameters don't create new series. Unmatched requests, and methods
+    outside the standard ones, share one label.
+    """
+    def __init__(self, app):
+        self._app = app
+        self._routes = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self._app(scope, receive, send_with_status)
+        finally:
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.labels(
+                method if method in _METHODS else "other",
+                self._route(scope), str(status),
+            ).observe(time.perf_counter() - start)
+
+    def _route(self, scope) -> str:
+        """Returns the route template of the endpoint the router picked."""
+        # The router adds the endpoint to scope after matching.
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            for r in scope["app"].routes:
+                self._routes[getattr(r, "endpoint", None)] = r.path
+            route = self._routes.get(endpoint, "unmatched")
+        return route
@@ -1,41 +1,629 @@
 """Define password hasher."""
-import argon2
+import asyncio
+import base64
+import collections
+import dataclasses
+import functools
+import hashlib
+import hmac
+import logging
+import math
+import os
+import statistics
+import time
+from concurrent import futures
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 
-from basic_app.lib import config
+from basic_app.lib import (
+    config,
+    exception,
+    metrics,
+    profiling,
+)
+
+# Stored for users without a password, no scheme verifies it.
+UNUSABLE_PASSWORD = "!"
+
+@dataclasses.dataclass
+class HashSchedulerStats:
+    """Snapshot of HashScheduler counters."""
+    limit: int
+    running: int
+    memory_kib: int
+    queue_depth: int
+    admitted: int
+    rejected: int
+    timed_out: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+
+_REJECTED = metrics.REGISTRY.counter("password_hasher_rejected_total",
+    "Hashing jobs rejected by a full queue, or after waiting in it too long.",
+    ("reason",))
+_QUEUE_FULL = _REJECTED.labels("queue_full")
+_QUEUE_TIMEOUT = _REJECTED.labels("queue_timeout")
+
+class HashScheduler:
+    """Admit password hashing work into a bounded thread pool.
+
+    Every job allocates the memory of its scheme's parameters, like
+    `argon2_memory_cost` KiB, so concurrent jobs are capped by the pool size
+    and their memory by the memory budget. Jobs are weighed one by one, a
+    bcrypt backend verifying old argon2 hashes still fits the budget. A job
+    larger than the whole budget runs alone.
+    Excess jobs wait in a bounded FIFO queue for at most the queue timeout;
+    when the queue is full, or the wait expires, the job is rejected with
+    SERVER_BUSY instead of letting latency grow without bound.
+    """
+    def __init__(self, conf: config.Config):
+        self._pool_size = max(1, conf.password_hasher_pool_size)
+        self._memory_budget = conf.password_hasher_memory_budget
+        self._memory_kib = _BACKENDS[conf.password_hasher_backend].\
+            memory_kib(conf)
+        # Jobs of the configured backend that run at once.
+        self._limit = max(1, min(self._pool_size,
+            self._memory_budget // max(self._memory_kib, 1)))
+        self._queue_size = conf.password_hasher_queue_depth
+        self._queue_timeout = conf.password_hasher_queue_timeout
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=self._pool_size,
+            thread_name_prefix="password-hasher",
+        )
+        self._running = 0
+        self._memory_used = 0
+        # Futures and memory of queued jobs.
+        self._waiters = collections.deque()
+
+        # Counters
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+
+    async def run(self, func, *args, memory_kib: Optional[int] = None):
+        """Run func in the hashing pool once admitted.
+
+        Args:
+          func: Blocking function to run in a pool thread.
+          args: Arguments of func.
+          memory_kib: Memory func takes, defaults to a hash of the
+            configured backend.
+        Raises:
+          AppException: If the job is rejected or waited too long.
+        """
+        if memory_kib is None:
+            memory_kib = self._memory_kib
+        with profiling.span("hash_scheduler.wait"):
+            await self._acquire(memory_kib)
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self._executor, func, *args)
+        # Release when the thread is done, even if our caller is cancelled.
+        fut.add_done_callback(lambda _: self._release(memory_kib))
+        with profiling.span("hash_scheduler.run"):
+            return await asyncio.shield(fut)
+
+    def _fits(self, memory_kib: int) -> bool:
+        """Whether a job of memory_kib can start now."""
+        if self._running >= self._pool_size:
+            return False
+        return self._running == 0 or\
+            self._memory_used + memory_kib <= self._memory_budget
+
+    def _take(self, memory_kib: int):
+        self._running += 1
+        self._memory_used += memory_kib
+
+    async def _acquire(self, memory_kib: int):
+        """Take a thread and memory_kib of the budget, waiting in the queue
+        if they are not free."""
+        if not self._waiters and self._fits(memory_kib):
+            self._take(memory_kib)
+            self._admitted += 1
+            return
+
+        if len(self._waiters) >= self._queue_size:
+            self._rejected += 1
+            _QUEUE_FULL.inc()
+            raise exception.AppException(
+                code=exception.ErrorCode.SERVER_BUSY,
+                message="Too many password hashing requests queued.",
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((waiter, memory_kib))
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self._queue_timeout)
+        except BaseException as exc:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over right as we gave up.
+                self._release(memory_kib)
+            else:
+                try:
+                    self._waiters.remove((waiter, memory_kib))
+                except ValueError:
+                    pass
+                # A large job leaving the head may let smaller ones start.
+                self._wake()
+
+            if isinstance(exc, asyncio.TimeoutError):
+                self._timed_out += 1
+                _QUEUE_TIMEOUT.inc()
+                raise exception.AppException(
+                    code=exception.ErrorCode.SERVER_BUSY,
+                    message="Timed out waiting for password hashing.",
+                ) from exc
+            raise
+        finally:
+            wait = time.monotonic() - start
+            self._wait_seconds_total += wait
+            self._wait_seconds_max = max(self._wait_seconds_max, wait)
+
+        self._admitted += 1
+
+    def _release(self, memory_kib: int):
+        """Free the thread and memory of a job, and start waiters."""
+        self._running -= 1
+        self._memory_used -= memory_kib
+        self._wake()
+
+    def _wake(self):
+        """Start waiters in order while they fit.
+
+        A waiter not fitting blocks the ones behind it, so large jobs are
+        not starved by small ones.
+        """
+        while self._waiters:
+            waiter, memory_kib = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(memory_kib):
+                return
+            self._waiters.popleft()
+            self._take(memory_kib)
+            waiter.set_result(None)
+
+    def stats(self) -> HashSchedulerStats:
+        """Returns a snapshot of the counters."""
+        return HashSchedulerStats(
+            limit=self._limit,
+            running=self._running,
+            memory_kib=self._memory_used,
+            queue_depth=len(self._waiters),
+            admitted=self._admitted,
+            rejected=self._rejected,
+            timed_out=self._timed_out,
+            wait_seconds_total=self._wait_seconds_total,
+            wait_seconds_max=self._wait_seconds_max,
+        )
+
+    def close(self):
+        """Stop the hashing pool, waiting for running jobs."""
+        self._executor.shutdown(wait=True)
 
 class PasswordHasher:
     """Define base password hasher."""
 
-    def hash(self, password: str) -> str:
+    async def hash(self, password: str) -> str:
         """Hash the password."""
         raise NotImplementedError
 
-    def verify(self, password: str, hash: str) -> bool:
+    async def verify(self, password: str, hash: str) -> bool:
         """Verify the password is matched."""
         raise NotImplementedError
 
-    def check_rehash(self) -> bool:
+    def check_rehash(self, hash: str) -> bool:
         """Check if the user password needs rehash."""
         raise NotImplementedError
 
-class Argon2PasswordHasher(PasswordHasher):
-    """Password hasher using Argon2."""
-    def __init__(self, conf: config.Config):
+    async def hash_many(self, passwords: List[str],
+        executor: futures.Executor) -> List[str]:
+        """Hash passwords in bulk on executor, bypassing the scheduler.
+
+        It is meant for offline jobs such as user imports, which bring
+        their own, typically process based, executor.
+        """
+        raise NotImplementedError
+
+def _hash_all(hash_func: Callable[[str], str],
+    passwords: List[str]) -> List[str]:
+    """Hash passwords in a worker process."""
+    return [hash_func(p) for p in passwords]
+
+_SECONDS = metrics.REGISTRY.histogram("password_hash_duration_seconds",
+    "Time spent hashing in the pool, without queueing.", ("operation",))
+
+def _timed(func, *args):
+    """Call func, returning its result and how long it took.
+
+    Runs in pool threads, the caller observes the time from the event loop.
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def _measure(func: Callable[[], Any], samples: int = 3) -> float:
+    """Returns the median seconds func takes."""
+    return statistics.median(_timed(func)[1] for _ in range(samples))
+
+def _halvings(seconds: float, target: float) -> int:
+    """Returns how many times work linear in time must halve to fit target."""
+    return max(math.ceil(math.log2(seconds / target)), 1)
+
+class _ScheduledPasswordHasher(PasswordHasher):
+    """Base of password hashers running in a HashScheduler.
+
+    Hashing is CPU and memory bound, so it never runs on the event loop.
+    Subclasses implement one scheme with blocking methods run in the pool.
+
+    Hashes of other schemes are verified by a hasher of their scheme, and
+    reported by check_rehash. So after switching backends, users keep
+    logging in and move to the new scheme at their next login.
+    """
+    # Hashes of the scheme start with one of these.
+    prefixes: Tuple[str, ...] = ()
+
+    def __init__(self, conf: config.Config, scheduler: HashScheduler):
+        self._conf = conf
+        self._scheduler = scheduler
+        # Calibrated hosts may pick different parameters, rehashing only
+        # weaker hashes keeps logins from flipping them between hosts.
+        self._weaker_only = conf.password_hasher_calibrate
+        self._verifiers: Dict[str, "_ScheduledPasswordHasher"] = {}
+
+    @classmethod
+    def identify(cls, hash: str) -> bool:
+        """Whether hash belongs to the scheme."""
+        return hash.startswith(cls.prefixes)
+
+    @staticmethod
+    def memory_kib(conf: config.Config) -> int:
+        """Returns the memory a hash takes with the parameters of conf."""
+        raise NotImplementedError
+
+    def _memory_kib_of(self, hash: str) -> int:
+        """Returns the memory verifying hash takes with its own parameters,
+        those of conf if it is malformed."""
+        return self.memory_kib(self._conf)
+
+    @staticmethod
+    def calibrate(conf: config.Config, target: float,
+        max_memory_kib: int) -> Dict[str, int]:
+        """Pick parameters on this host, see calibrate.
+
+        Args:
+          conf: Config object, for parameters not calibrated.
+          target: Seconds a verify should take at most.
+          max_memory_kib: Memory a hash may take at most.
+        Returns:
+          Config attributes and their values.
+        """
+        raise NotImplementedError
+
+    def _hash(self, password: str) -> str:
+        raise NotImplementedError
+
+    def _verify(self, password: str, hash: str) -> bool:
+        raise NotImplementedError
+
+    def _needs_rehash(self, hash: str) -> bool:
+        """Whether the parameters of hash differ from ours, or are weaker
+        with _weaker_only set."""
+        raise NotImplementedError
+
+    def _verifier(self, hash: str) -> Optional["_ScheduledPasswordHasher"]:
+        """Returns the hasher of the scheme of hash, None if unknown."""
+        if self.identify(hash):
+            return self
+        for name, backend in _BACKENDS.items():
+            if backend.identify(hash):
+                if name not in self._verifiers:
+                    self._verifiers[name] = backend(self._conf, self._scheduler)
+                return self._verifiers[name]
+        return None
+
+    @profiling.traced("password.hash")
+    async def hash(self, password: str) -> str:
+        result, seconds = await self._scheduler.run(
+            _timed, self._hash, password,
+            memory_kib=self.memory_kib(self._conf))
+        _SECONDS.labels("hash").observe(seconds)
+        return result
+
+    @profiling.traced("password.verify")
+    async def verify(self, password: str, hash: str) -> bool:
+        verifier = self._verifier(hash)
+        if verifier is None:
+            return False
+        result, seconds = await self._scheduler.run(
+            _timed, verifier._verify, password, hash,
+            memory_kib=verifier._memory_kib_of(hash))
+        _SECONDS.labels("verify").observe(seconds)
+        return result
+
+    def check_rehash(self, hash: str) -> bool:
+        return not self.identify(hash) or self._needs_rehash(hash)
+
+    async def hash_many(self, passwords: List[str],
+        executor: futures.Executor) -> List[str]:
+        loop = asyncio.get_running_loop()
+        # Chunks keep pickling overhead of process pools low, while still
+        # spreading the work over every worker.
+        size = 32
+        chunks = await asyncio.gather(*(
+            loop.run_in_executor(executor, _hash_all, self._hash,
+                passwords[i:i + size])
+            for i in range(0, len(passwords), size)))
+        return [h for chunk in chunks for h in chunk]
+
+class Argon2PasswordHasher(_ScheduledPasswordHasher):
+    """Password hasher using Argon2id.
+
+    argon2-cffi releases the GIL while hashing, which lets the scheduler's
+    thread pool hash in parallel on multiple cores.
+    """
+    prefixes = ("$argon2",)
+
+    def __init__(self, conf: config.Config, scheduler: HashScheduler):
+        super().__init__(conf, scheduler)
+        import argon2 # pylint: disable=import-outside-toplevel
         # We can also refer to:
         # https://cheatsheetseries.owasp.org/cheatsheets/Password_Storage_Cheat_Sheet.html#salting
         self._hasher = argon2.PasswordHasher(
-            memory_cost=conf.argon2_memory_cost,
-            time_cost=conf.argon2_time_cost,
-            parallelism=conf.argon2_parallelism,
-            hash_len=conf.argon2_hash_len,
+            memory_cost=int(conf.argon2_memory_cost),
+            time_cost=int(conf.argon2_time_cost),
+            parallelism=int(conf.argon2_parallelism),
+            hash_len=int(conf.argon2_hash_len),
             type=argon2.Type.ID,
         )
+        # A bound method of the argon2 hasher pickles for hash_many.
+        self._hash = self._hasher.hash
+        self._mismatch = (argon2.exceptions.VerificationError,
+            argon2.exceptions.InvalidHash)
+        self._extract = argon2.extract_parameters
 
-    def hash(self, password: str) -> str:
-        return self._hasher.hash(password)
+    @staticmethod
+    def memory_kib(conf: config.Config) -> int:
+        return int(conf.argon2_memory_cost)
 
-    def verify(self, password: str, hash: str) -> bool:
-        return self._hasher.verify(hash, password)
+    def _memory_kib_of(self, hash: str) -> int:
+        try:
+            return self._extract(hash).memory_cost
+        except self._mismatch:
+            return super()._memory_kib_of(hash)
 
-    def check_rehash(self, hash: str) -> bool:
-        return self._hasher.check_needs_rehash(hash)
+    @staticmethod
+    def calibrate(conf: config.Config, target: float,
+        max_memory_kib: int) -> Dict[str, int]:
+        """Use as much memory as fits, then as many passes as fit.
+
+        Memory is halved until a single pass fits the target. Parallelism
+        is kept as configured, the pool already hashes one password per
+        core.
+        """
+        import argon2 # pylint: disable=import-outside-toplevel
+        parallelism = int(conf.argon2_parallelism)
+
+        def measure(memory_cost: int, time_cost: int) -> float:
+            hasher = argon2.PasswordHasher(memory_cost=memory_cost,
+                time_cost=time_cost, parallelism=parallelism,
+                hash_len=int(conf.argon2_hash_len), type=argon2.Type.ID)
+            hash = hasher.hash("calibration")
+            return _measure(lambda: hasher.verify(hash, "calibration"))
+
+        # Argon2 needs 8 KiB per lane.
+        memory_cost = max_memory_kib
+        seconds = measure(memory_cost, 1)
+        while seconds > target and memory_cost // 2 >= 8 * parallelism:
+            # Time is linear in memory, jump close to the target.
+            memory_cost = max(memory_cost >> _halvings(seconds, target),
+                8 * parallelism)
+            seconds = measure(memory_cost, 1)
+
+        # Time grows linearly with passes.
+        time_cost = max(int(target // seconds), 1)
+        while time_cost > 1 and measure(memory_cost, time_cost) > target:
+            time_cost -= 1
+        return {
+            "argon2_memory_cost": memory_cost,
+            "argon2_time_cost": time_cost,
+            "argon2_parallelism": parallelism,
+        }
+
+    def _verify(self, password: str, hash: str) -> bool:
+        try:
+            return self._hasher.verify(hash, password)
+        except self._mismatch:
+            return False
+
+    def _needs_rehash(self, hash: str) -> bool:
+        if not self._weaker_only:
+            return self._hasher.check_needs_rehash(hash)
+        params = self._extract(hash)
+        return params.type != self._hasher.type or\
+            params.memory_cost < self._hasher.memory_cost or\
+            params.time_cost < self._hasher.time_cost or\
+            params.hash_len < self._hasher.hash_len
+
+def _scrypt_hash(ln: int, r: int, p: int, password: str,
+    salt: bytes = None) -> str:
+    """Returns password hashed by scrypt, with N = 2 ** ln.
+
+    The hash is in modular crypt format, "$scrypt$ln=,r=,p=$salt$key"
+    with unpadded base64 salt and key.
+    """
+    salt = salt or os.urandom(16)
+    n = 1 << ln
+    key = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=2 * 128 * r * (n + p), dklen=32)
+    encode = lambda b: base64.b64encode(b).decode().rstrip("=")
+    return "$scrypt$ln={},r={},p={}${}${}".format(
+        ln, r, p, encode(salt), encode(key))
+
+def _scrypt_parse(hash: str) -> Tuple[int, int, int, bytes, bytes]:
+    """Returns ln, r, p, salt and key of a scrypt hash.
+
+    Raises:
+      ValueError: If hash is malformed.
+    """
+    _, scheme, params, salt, key = hash.split("$")
+    if scheme != "scrypt":
+        raise ValueError("Not a scrypt hash.")
+    values = dict(kv.split("=") for kv in params.split(","))
+    decode = lambda s: base64.b64decode(s + "=" * (-len(s) % 4))
+    return (int(values["ln"]), int(values["r"]), int(values["p"]),
+        decode(salt), decode(key))
+
+class ScryptPasswordHasher(_ScheduledPasswordHasher):
+    """Password hasher using scrypt of hashlib, without a dependency.
+
+    OpenSSL releases the GIL while hashing.
+    """
+    prefixes = ("$scrypt$",)
+
+    def __init__(self, conf: config.Config, scheduler: HashScheduler):
+        super().__init__(conf, scheduler)
+        self._params = (int(conf.scrypt_ln), int(conf.scrypt_r),
+            int(conf.scrypt_p))
+        # A partial of a module function pickles for hash_many.
+        self._hash = functools.partial(_scrypt_hash, *self._params)
+
+    @staticmethod
+    def memory_kib(conf: config.Config) -> int:
+        return 128 * int(conf.scrypt_r) * (1 << int(conf.scrypt_ln)) // 1024
+
+    def _memory_kib_of(self, hash: str) -> int:
+        try:
+            ln, r, _, _, _ = _scrypt_parse(hash)
+        except (ValueError, KeyError):
+            return super()._memory_kib_of(hash)
+        return 128 * r * (1 << ln) // 1024
+
+    @staticmethod
+    def calibrate(conf: config.Config, target: float,
+        max_memory_kib: int) -> Dict[str, int]:
+        """Pick the largest N fitting both memory and time, r and p are
+        kept as configured."""
+        r, p = int(conf.scrypt_r), int(conf.scrypt_p)
+        ln = max((max_memory_kib * 1024 // (128 * r)).bit_length() - 1, 1)
+        while ln > 1:
+            seconds = _measure(functools.partial(
+                _scrypt_hash, ln, r, p, "calibration"))
+            if seconds <= target:
+                break
+            ln = max(ln - _halvings(seconds, target), 1)
+        return {"scrypt_ln": ln}
+
+    def _verify(self, password: str, hash: str) -> bool:
+        try:
+            ln, r, p, salt, _ = _scrypt_parse(hash)
+        except (ValueError, KeyError):
+            return False
+        return hmac.compare_digest(
+            _scrypt_hash(ln, r, p, password, salt), hash)
+
+    def _needs_rehash(self, hash: str) -> bool:
+        params = _scrypt_parse(hash)[:3]
+        if not self._weaker_only:
+            return params != self._params
+        return any(have < want for have, want in zip(params, self._params))
+
+def _bcrypt_hash(rounds: int, password: str) -> str:
+    import bcrypt # pylint: disable=import-outside-toplevel
+    return bcrypt.hashpw(password.encode()[:72],
+        bcrypt.gensalt(rounds)).decode()
+
+class BcryptPasswordHasher(_ScheduledPasswordHasher):
+    """Password hasher using bcrypt, needs the bcrypt package.
+
+    Cheaper in memory than the others, which lets more hashes run at once
+    within the memory budget. Passwords are truncated to 72 bytes.
+    """
+    prefixes = ("$2a$", "$2b$", "$2y$")
+
+    def __init__(self, conf: config.Config, scheduler: HashScheduler):
+        super().__init__(conf, scheduler)
+        import bcrypt # pylint: disable=import-outside-toplevel
+        self._bcrypt = bcrypt
+        self._rounds = int(conf.bcrypt_rounds)
+        self._hash = functools.partial(_bcrypt_hash, self._rounds)
+
+    @staticmethod
+    def memory_kib(conf: config.Config) -> int:
+        return 4
+
+    @staticmethod
+    def calibrate(conf: config.Config, target: float,
+        max_memory_kib: int) -> Dict[str, int]:
+        """Pick the largest rounds fitting the target, each doubles time."""
+        seconds = _measure(functools.partial(_bcrypt_hash, 8, "calibration"))
+        rounds = min(max(8 + int(math.log2(target / seconds)), 4), 31)
+        while rounds > 4 and _measure(functools.partial(
+            _bcrypt_hash, rounds, "calibration")) > target:
+            rounds -= 1
+        return {"bcrypt_rounds": rounds}
+
+    def _verify(self, password: str, hash: str) -> bool:
+        # Recent bcrypt refuses passwords over 72 bytes rather than
+        # truncating them.
+        try:
+            return self._bcrypt.checkpw(password.encode()[:72], hash.encode())
+        except ValueError:
+            return False
+
+    def _needs_rehash(self, hash: str) -> bool:
+        rounds = int(hash.split("$")[2])
+        if self._weaker_only:
+            return rounds < self._rounds
+        return rounds != self._rounds
+
+_BACKENDS = {
+    "argon2": Argon2PasswordHasher,
+    "scrypt": ScryptPasswordHasher,
+    "bcrypt": BcryptPasswordHasher,
+}
+
+def create_hasher(conf: config.Config,
+    scheduler: HashScheduler) -> PasswordHasher:
+    """Create the password hasher selected by PASSWORD_HASHER_BACKEND."""
+    return _BACKENDS[conf.password_hasher_backend](conf, scheduler)
+
+def calibrate(conf: config.Config, target_ms: float = None) -> Dict[str, int]:
+    """Pick parameters of the configured backend on this host.
+
+    A verify should take at most target_ms, PASSWORD_HASHER_TARGET_MS by
+    default, and a hash at most its share of the memory budget when the
+    pool is full.
+
+    Returns:
+      Config attributes and their values, see apply_calibration.
+    """
+    backend = _BACKENDS[conf.password_hasher_backend]
+    target = (target_ms or conf.password_hasher_target_ms) / 1000
+    max_memory_kib = conf.password_hasher_memory_budget //\
+        conf.password_hasher_pool_size
+    start = time.perf_counter()
+    params = backend.calibrate(conf, target, max_memory_kib)
+    logging.info("Calibrated %s for %.0f ms in %.1f s: %s.",
+        conf.password_hasher_backend, target * 1000,
+        time.perf_counter() - start, params)
+    return params
+
+def apply_calibration(conf: config.Config, params: Dict[str, int]):
+    """Set calibrated parameters on conf and in the environment.
+
+    Worker processes read their config from the environment, so they
+    get the parameters calibrated once by the parent.
+    """
+    for name, value in params.items():
+        setattr(conf, name, value)
+        os.environ[name.upper()] = str(value)
@@ -1,40 +1,280 @@
 """Provide SQLAlchemy engine for postgres"""
 from __future__ import annotations
 from typing import (
-    List,
     Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    TYPE_CHECKING,
 )
+import asyncio
+import contextlib
 import logging
+import dataclasses
+import math
+import re
+import time
 from enum import Enum
+import asyncpg
 import sqlalchemy as sa
-from sqlalchemy import orm
-from sqlalchemy.ext import asyncio
+from sqlalchemy import orm, pool
 from sqlalchemy.dialects import postgresql as pg
+from sqlalchemy.engine import Row
 
-from basic_app.lib import config
+from basic_app.lib import (
+    cache,
+    config,
+    metrics,
+    profiling,
+)
 from basic_app.models import base
 
+if TYPE_CHECKING:
+    from redis import asyncio as aioredis
+    from sqlalchemy.ext import asyncio as sa_asyncio
+
+# Errors of a server failing to connect: refused or timed out connections,
+# and errors of Postgres itself like a failed authentication, which asyncpg
+# raises as they are on connect.
+_CONNECT_ERRORS = (OSError, asyncio.TimeoutError, sa.exc.DBAPIError,
+    asyncpg.PostgresError, asyncpg.InterfaceError)
+
 class IsolationLevel(Enum):
     """Define transaction isolation level."""
-    READ_COMMITTED = "READ COMMITED"
+    READ_COMMITTED = "READ COMMITTED"
     REPEATABLE_READ = "REPEATABLE READ"
+    # Each statement commits on its own, without BEGIN and COMMIT round trips.
+    AUTOCOMMIT = "AUTOCOMMIT"
+
+@dataclasses.dataclass
+class PoolStats:
+    """Snapshot of connection pool usage.
+
+    Attributes:
+      size: Configured number of persistent connections.
+      checked_out: Connections in use.
+      idle: Connections in the pool ready to be checked out.
+      overflow: Connections opened beyond size.
+      waiters: Checkouts currently waiting for a connection.
+      checkouts: Total checkouts since the pool was created.
+      wait_seconds_total: Total time spent in checkouts.
+      wait_seconds_max: Longest single checkout.
+    """
+    size: int
+    checked_out: int
+    idle: int
+    overflow: int
+    waiters: int
+    checkouts: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+
+_POOL_WAIT_SECONDS = metrics.REGISTRY.histogram("postgres_pool_wait_seconds",
+    "Time checkouts waited for a Postgres connection, of all pools.")
+
+class _InstrumentedPool(pool.AsyncAdaptedQueuePool):
+    """Queue pool recording how long checkouts wait for a connection."""
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.waiters = 0
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        # Only checkouts of an exhausted pool wait, the others get an idle
+        # or a new connection.
+        waiting = self._max_overflow > -1 and\
+            self.checkedout() >= self.size() + self._max_overflow
+        self.waiters += waiting
+        try:
+            return super()._do_get()
+        finally:
+            self.waiters -= waiting
+            wait = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+            _POOL_WAIT_SECONDS.observe(wait)
+
+@dataclasses.dataclass
+class InsertOrConflictResult:
+    """Outcome of Session.insert_or_select_conflict.
+
+    Attributes:
+      inserted: Whether the record was inserted.
+      rows: The inserted record, or the existing records it conflicts with.
+    """
+    inserted: bool
+    rows: List[base.Base]
+
+@dataclasses.dataclass
+class InsertManyOrConflictResult:
+    """Outcome of Session.insert_many_or_select_conflict.
+
+    Attributes:
+      inserted: The inserted records.
+      conflicts: Existing records conflicting with the others.
+    """
+    inserted: List[base.Base]
+    conflicts: List[base.Base]
+
+# Statements built once per model, operation and options.
+_statements: Dict[tuple, sa.TextClause] = {}
+
+def _statement(model: type, operation: str,
+    build: Callable[..., sa.TextClause], *options) -> sa.TextClause:
+    """Returns the statement of operation on model, built on first use.
+
+    Statements are parameterized by column name, so Session methods bind
+    values instead of building a new statement per call.
+    """
+    key = (model, operation) + options
+    stmt = _statements.get(key)
+    if stmt is None:
+        stmt = _statements[key] = build(model, *options)
+    return stmt
+
+def _textual(table: sa.Table, stmt: Any, *columns: Any) -> sa.TextClause:
+    """Compile stmt into textual SQL binding every column of table.
+
+    SQLAlchemy 1.4 cannot cache the compiled form of ON CONFLICT clauses,
+    which would recompile them on every call, while it does cache textual
+    SQL. The SQL string is also the same on every call, so asyncpg reuses
+    its prepared statement on each connection.
+    """
+    sql = str(stmt.compile(dialect=pg.dialect(paramstyle="named")))
+    text = sa.text(sql).\
+        bindparams(*(sa.bindparam(c.name, type_=c.type) for c in table.c))
+    if columns:
+        text = text.columns(*columns)
+    return text
+
+def _column_params(table: sa.Table) -> Dict[str, sa.BindParameter]:
+    return {c.name: sa.bindparam(c.name) for c in table.c}
+
+def _insert_stmt(model: type) -> sa.TextClause:
+    table = model.__table__
+    return _textual(table, sa.insert(table).values(_column_params(table)))
+
+def _insert_on_conflict_do_nothing_stmt(model: type,
+    conflict_columns: Optional[tuple]) -> sa.TextClause:
+    table = model.__table__
+    return _textual(table, pg.insert(table).\
+        values(_column_params(table)).\
+        on_conflict_do_nothing(index_elements=conflict_columns))
+
+def _insert_or_select_conflict_stmt(model: type,
+    conflict_columns: tuple) -> sa.TextClause:
+    """Returns the statement used by Session.insert_or_select_conflict."""
+    table = model.__table__
+    inserted = pg.insert(table).\
+        values(_column_params(table)).\
+        on_conflict_do_nothing().\
+        returning(*table.c).\
+        cte("inserted")
+    union = sa.union_all(
+        sa.select(sa.true().label("inserted"), *inserted.c),
+        sa.select(sa.false(), *table.c).where(sa.or_(
+            *(table.c[name] == sa.bindparam(name) for name in conflict_columns))),
+    )
+    return _textual(table, union, sa.column("inserted", sa.Boolean), *table.c)
+
+def _insert_many_or_select_conflict_stmt(model: type,
+    conflict_columns: tuple) -> sa.TextClause:
+    """Returns the statement used by Session.insert_many_or_select_conflict.
+
+    Each column is bound as one array, unnested into rows, so the statement
+    is the same whatever the number of records.
+    """
+    table = model.__table__
+    dialect = pg.dialect()
+    # Without length, a cast would truncate values the column rejects.
+    arrays = {c.name: "CAST(:{} AS {}[])".format(
+        c.name, re.sub(r"\(\d+\)", "", c.type.compile(dialect=dialect)))
+        for c in table.c}
+    columns = ", ".join('"{}"'.format(c.name) for c in table.c)
+    sql = (
+        'WITH inserted AS ('
+        'INSERT INTO "{table}" ({columns}) '
+        'SELECT * FROM unnest({arrays}) '
+        'ON CONFLICT DO NOTHING RETURNING {columns}) '
+        'SELECT true AS inserted, {columns} FROM inserted '
+        'UNION ALL '
+        'SELECT false, {columns} FROM "{table}" WHERE {conflicts}'
+    ).format(
+        table=table.name,
+        columns=columns,
+        arrays=", ".join(arrays.values()),
+        conflicts=" OR ".join('"{}" = ANY({})'.format(name, arrays[name])
+            for name in conflict_columns),
+    )
+    return sa.text(sql).\
+        bindparams(*(sa.bindparam(c.name, type_=pg.ARRAY(c.type))
+            for c in table.c)).\
+        columns(sa.column("inserted", sa.Boolean), *table.c)
+
+def build_statements(model: type, conflict_columns: Sequence[str]):
+    """Build the statements of Session.insert_or_select_conflict and
+    insert_many_or_select_conflict on model, ahead of their first use."""
+    _statement(model, "insert_or_select_conflict",
+        _insert_or_select_conflict_stmt, tuple(conflict_columns))
+    _statement(model, "insert_many_or_select_conflict",
+        _insert_many_or_select_conflict_stmt, tuple(conflict_columns))
+
+_STATEMENT_SECONDS = metrics.REGISTRY.histogram("db_statement_duration_seconds",
+    "Latency of statements sent by Session, by Session method.", ("operation",))
 
 class Session:
     """Create own session."""
     def __init__(self, session: orm.Session,
-        isolation_level: IsolationLevel = None):
+        isolation_level: IsolationLevel = None,
+        fallback: Callable[[Exception], orm.Session] = None,
+        reroute: Callable[[], Awaitable[Optional[orm.Session]]] = None):
+        """
+        Args:
+          session: SQLAlchemy async session.
+          isolation_level: Isolation level of the transaction.
+          fallback: Returns a session to use instead when session cannot
+            connect, given the error.
+          reroute: Returns a session to use instead of session, or None,
+            awaited before beginning.
+        """
         self._session = session
         self._isolation_level = isolation_level
+        self._fallback = fallback
+        self._reroute = reroute
+
+    async def _begin(self):
+        await self._session.begin()
+        if self._isolation_level or self._fallback:
+            # Sent with BEGIN rather than as its own statement. It also
+            # connects now, so a fallback can take over before any statement.
+            await self._session.connection(execution_options={
+                "isolation_level": self._isolation_level.value,
+            } if self._isolation_level else None)
 
     async def __aenter__(self) -> Session:
         """Enter transaction."""
-        await self._session.begin()
-        if self._isolation_level:
-            await self._session.execute(
-                "SET TRANSACTION ISOLATION LEVEL {}".format(
-                    self._isolation_level.value,
-                )
-            )
+        # Includes the pool checkout.
+        with profiling.span("db.begin"):
+            if self._reroute:
+                session = await self._reroute()
+                if session is not None:
+                    await self._session.close()
+                    self._session, self._fallback = session, None
+            try:
+                await self._begin()
+            except _CONNECT_ERRORS as e:
+                if not self._fallback:
+                    raise
+                await self._session.close()
+                self._session, self._fallback = self._fallback(e), None
+                await self._begin()
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
@@ -43,9 +283,17 @@ class Session:
         we do a rollback.
         """
         if exc_type:
-            await self._session.rollback()
+            with profiling.span("db.rollback"):
+                await self._session.rollback()
         else:
-            await self._session.commit()
+            with profiling.span("db.commit"):
+                await self._session.commit()
+
+    async def _execute(self, operation: str, stmt: Any, params: dict = None):
+        """Execute stmt, observing its latency under operation."""
+        with _STATEMENT_SECONDS.labels(operation).time(),\
+            profiling.span("db." + operation):
+            return await self._session.execute(stmt, params)
 
     async def insert(self, value: base.Base):
         """Insert one record.
@@ -53,8 +301,8 @@ class Session:
         Args:
           values: A SQLAlchemy model instance.
         """
-        stmt = sa.insert(type(value)).values(**value.to_dict())
-        return await self._session.execute(stmt)
+        stmt = _statement(type(value), "insert", _insert_stmt)
+        return await self._execute("insert", stmt, value.to_dict())
 
     async def insert_on_conflict_do_nothing(self,
         value: base.Base, conflict_columns: List[str] = None):
@@ -64,11 +312,145 @@ class Session:
           values: A SQLAlchemy model instance.
           conflict_columns: Which columns to check for conflict.
         """
-        stmt = pg.insert(type(value)).values(**value.to_dict())
-        stmt = stmt.on_conflict_do_nothing(
-            index_elements=conflict_columns,
+        stmt = _statement(type(value), "insert_on_conflict_do_nothing",
+            _insert_on_conflict_do_nothing_stmt,
+            tuple(conflict_columns) if conflict_columns else None)
+        return await self._execute("insert_on_conflict_do_nothing",
+            stmt, value.to_dict())
+
+    async def insert_or_select_conflict(self,
+        value: base.Base, conflict_columns: List[str]) -> InsertOrConflictResult:
+        """Insert one record, or select the records it conflicts with.
+
+        Both are done in one statement. A data-modifying CTE runs
+        INSERT ... ON CONFLICT DO NOTHING RETURNING, and the outer query
+        selects the rows matching any of conflict_columns from the snapshot
+        taken before the insert.
+
+        Rows may be empty when the conflicting record was committed by a
+        concurrent transaction after the snapshot was taken.
+
+        Args:
+          value: A SQLAlchemy model instance.
+          conflict_columns: Which columns to look up the conflicting records.
+        Returns:
+          Whether the record was inserted, and the related records.
+        """
+        model = type(value)
+        stmt = _statement(model, "insert_or_select_conflict",
+            _insert_or_select_conflict_stmt, tuple(conflict_columns))
+        result = await self._execute("insert_or_select_conflict",
+            stmt, value.to_dict())
+
+        rows = result.fetchall()
+        columns = model.__table__.columns
+        return InsertOrConflictResult(
+            inserted=any(row[0] for row in rows),
+            rows=[model(**{c.name: row[c.name] for c in columns}) for row in rows],
         )
-        return await self._session.execute(stmt)
+
+    async def insert_many_or_select_conflict(self, model: type,
+        values: List[dict], conflict_columns: List[str],
+        ) -> InsertManyOrConflictResult:
+        """Insert many records, and select those they conflict with.
+
+        Like insert_or_select_conflict for many records in one statement.
+        Of records conflicting with each other in values, only the first is
+        inserted, and the conflict is with an inserted record rather than
+        one of the selected.
+
+        Args:
+          model: A SQLAlchemy model class.
+          values: Records as dicts with every column of the model.
+          conflict_columns: Which columns to look up the conflicting records.
+        Returns:
+          The inserted records, and the existing records they conflict with.
+        """
+        stmt = _statement(model, "insert_many_or_select_conflict",
+            _insert_many_or_select_conflict_stmt, tuple(conflict_columns))
+        columns = model.__table__.columns
+        result = await self._execute("insert_many_or_select_conflict", stmt,
+            {c.name: [v[c.name] for v in values] for c in columns})
+
+        inserted, conflicts = [], []
+        for row in result.fetchall():
+            (inserted if row[0] else conflicts).append(
+                model(**{c.name: row[c.name] for c in columns}))
+        return InsertManyOrConflictResult(inserted=inserted, conflicts=conflicts)
+
+    async def copy_insert_on_conflict_do_nothing(self,
+        model: type, values: List[dict]) -> List[Row]:
+        """Insert many records with COPY, do nothing for conflict.
+
+        Records are streamed with COPY into a temporary staging table, then
+        moved with one INSERT ... SELECT ... ON CONFLICT DO NOTHING. It costs
+        three round trips for the whole batch instead of one per record.
+        Of records conflicting with each other in values, only one is
+        inserted.
+
+        Args:
+          model: A SQLAlchemy model class.
+          values: Records as dicts with every column of the model.
+        Returns:
+          Primary keys of inserted records.
+        """
+        table = model.__table__
+        columns = [c.name for c in table.c]
+        staging = "staging_" + table.name
+        quoted = ", ".join('"{}"'.format(c) for c in columns)
+
+        # Executed by SQLAlchemy first, so the raw connection below is
+        # already in our transaction.
+        await self._execute("copy", sa.text(
+            'CREATE TEMPORARY TABLE IF NOT EXISTS "{}" '
+            '(LIKE "{}" INCLUDING DEFAULTS) ON COMMIT DROP'.format(
+                staging, table.name)))
+
+        conn = await self._session.connection()
+        raw = await conn.get_raw_connection()
+        with _STATEMENT_SECONDS.labels("copy").time(),\
+            profiling.span("db.copy_records"):
+            await raw.driver_connection.copy_records_to_table(
+                staging,
+                records=[tuple(v[c] for c in columns) for v in values],
+                columns=columns,
+            )
+
+        primary_key = ", ".join('"{}"'.format(c.name) for c in table.primary_key)
+        # Staging is emptied by the same statement, so it can be reused
+        # within the transaction.
+        result = await self._execute("copy", sa.text(
+            'WITH staged AS (DELETE FROM "{staging}" RETURNING *) '
+            'INSERT INTO "{table}" ({columns}) '
+            'SELECT {columns} FROM staged '
+            'ON CONFLICT DO NOTHING RETURNING {primary_key}'.format(
+                table=table.name,
+                columns=quoted,
+                staging=staging,
+                primary_key=primary_key)))
+        return result.fetchall()
+
+    async def update(self, stmt: Any) -> int:
+        """Do a SQL UPDATE.
+
+        Args:
+          stmt: The statement of UPDATE represented in SQLAlchemy.
+        Returns:
+          Number of updated rows.
+        """
+        result = await self._execute("update", stmt)
+        return result.rowcount
+
+    async def select_row(self, stmt: Any) -> Optional[Row]:
+        """Do a SQL SELECT of columns, expecting at most one row.
+
+        Args:
+          stmt: The statement of SELECT represented in SQLAlchemy.
+        Returns:
+          The first row, or None if nothing matched.
+        """
+        result = await self._execute("select_row", stmt)
+        return result.first()
 
     async def select(self, stmt: Any) -> List[base.Base]:
         """Do a SQL SELECT.
@@ -78,34 +460,359 @@ class Session:
         Returns:
           List of SQLAlchemy objects.
         """
-        result = await self._session.execute(stmt)
+        result = await self._execute("select", stmt)
         return result.scalars().all()
 
-class SessionMaker:
-    """Create own sessionmaker."""
+@dataclasses.dataclass
+class ReplicaStats:
+    """Health of a read replica, as of its last check.
+
+    Attributes:
+      name: Host and port of the replica.
+      healthy: Whether read-only sessions are sent to it.
+      lag_seconds: Replication lag, 0 when it has replayed everything.
+      reads: Read-only sessions sent to it.
+    """
+    name: str
+    healthy: bool
+    lag_seconds: float
+    reads: int
+
+# Seconds since the last replayed transaction, unless nothing is left to
+# replay. A primary always reports 0.
+_REPLICATION_LAG = sa.text(
+    "SELECT CASE WHEN pg_is_in_recovery() "
+    "AND pg_last_wal_receive_lsn() IS DISTINCT FROM pg_last_wal_replay_lsn() "
+    "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "ELSE 0 END")
+
+_READS = metrics.REGISTRY.counter("db_read_sessions_total",
+    "Read-only sessions by target: replica, primary for lack of a healthy "
+    "replica, or primary after a recent write of a key they read.",
+    ("target",))
+
+class _Replica:
+    """A read replica and its health."""
     def __init__(self, sessionmaker: orm.sessionmaker):
+        self.sessionmaker = sessionmaker
+        url = sessionmaker.kw["bind"].url
+        self.name = "{}:{}".format(url.host, url.port)
+        # Until the first check, a replica failing to connect is marked
+        # down by the fallback.
+        self.healthy = True
+        self.lag_seconds = 0.0
+        self.reads = 0
+
+    def mark_down(self, reason: Any):
+        if self.healthy:
+            logging.warning("Postgres replica %s marked down: %s",
+                self.name, reason)
+        self.healthy = False
+
+    async def check(self, timeout: float, max_lag: float):
+        """Update health from the replication lag, or a failure to get it."""
+        engine: sa_asyncio.AsyncEngine = self.sessionmaker.kw["bind"]
+        try:
+            async with engine.connect() as conn:
+                lag = await asyncio.wait_for(
+                    conn.scalar(_REPLICATION_LAG), timeout)
+        except _CONNECT_ERRORS as e:
+            self.mark_down(e)
+            return
+
+        self.lag_seconds = float(lag)
+        if self.lag_seconds > max_lag:
+            self.mark_down("lagging {:.1f}s".format(self.lag_seconds))
+        elif not self.healthy:
+            logging.info("Postgres replica %s is healthy again.", self.name)
+            self.healthy = True
+
+class SessionMaker:
+    """Create own sessionmaker.
+
+    Sessions go to the primary, except read-only ones, which are spread
+    round-robin over healthy replicas. Replicas are checked in the
+    background once reads start, and skipped while they are unreachable or
+    lag more than max_lag. Without a healthy replica, reads go to the
+    primary.
+
+    Reads of keys written within read_your_writes_window go to the primary
+    too, so a client reads back what it just wrote. Only keys written by
+    this process are known, unless they are shared with the other
+    processes through shared_written, which costs a Redis lookup when such
+    a read begins.
+    """
+    def __init__(self, sessionmaker: orm.sessionmaker,
+        replicas: Sequence[orm.sessionmaker] = (),
+        check_interval: float = 5.0, max_lag: float = 5.0,
+        read_your_writes_window: float = 10.0,
+        max_written_keys: int = 10000,
+        shared_written: cache.RedisCache = None):
+        """
+        Args:
+          sessionmaker: Sessions of the primary.
+          replicas: Sessions of each read replica.
+          check_interval: Seconds between health checks of replicas.
+          max_lag: Seconds of replication lag beyond which a replica is
+            skipped.
+          read_your_writes_window: Seconds reads of a written key go to
+            the primary.
+          max_written_keys: Maximum number of recently written keys kept.
+          shared_written: Where written keys are shared by processes, None
+            keeps them in this process.
+        """
         self._sessionmaker = sessionmaker
+        self._replicas = [_Replica(r) for r in replicas]
+        self._check_interval = check_interval
+        self._max_lag = max_lag
+        self._written = cache.LRUCache(max_written_keys, read_your_writes_window)
+        self._shared_written = shared_written
+        self._next = 0
+        self._checks: Optional[asyncio.Task] = None
+
+    def __call__(self, isolation_level: IsolationLevel = None,
+        read_only: bool = False, keys: Sequence[str] = ()) -> Session:
+        """Returns a session, not begun yet.
+
+        Args:
+          isolation_level: Isolation level of the transaction.
+          read_only: Whether the session only reads, it may then go to
+            a replica.
+          keys: Keys of the records a read-only session reads, like ids or
+            emails. See mark_written.
+        """
+        if not read_only or not self._replicas:
+            return Session(self._sessionmaker(), isolation_level)
+
+        replica = self._pick(keys)
+        if replica is None:
+            return Session(self._sessionmaker(), isolation_level)
+        reroute = None
+        if keys and self._shared_written:
+            reroute = lambda: self._reroute_if_written(replica, keys)
+        else:
+            self._count_read(replica)
+        return Session(replica.sessionmaker(), isolation_level,
+            fallback=lambda e: self._fall_back(replica, e), reroute=reroute)
 
-    def __call__(self, isolation_level: IsolationLevel = None) -> Session:
-        return Session(self._sessionmaker(), isolation_level)
+    def _pick(self, keys: Sequence[str]) -> Optional[_Replica]:
+        """Returns the next healthy replica, or None to read the primary."""
+        if self._checks is None:
+            self._checks = asyncio.get_running_loop().\
+                create_task(self._check_replicas())
 
+        if any(self._written.get(key) is not cache.MISSING for key in keys):
+            _READS.labels("primary_after_write").inc()
+            return None
+        for _ in range(len(self._replicas)):
+            replica = self._replicas[self._next % len(self._replicas)]
+            self._next += 1
+            if replica.healthy:
+                return replica
+        _READS.labels("primary").inc()
+        return None
 
-def create_sessionmaker(conf: config.Config) -> SessionMaker:
-    """Create async SQLAlchemy database engine"""
+    @staticmethod
+    def _count_read(replica: _Replica):
+        _READS.labels("replica").inc()
+        replica.reads += 1
+
+    async def _reroute_if_written(self, replica: _Replica,
+        keys: Sequence[str]) -> Optional[orm.Session]:
+        """Returns a session of the primary if another process wrote one
+        of keys lately, or None to read replica."""
+        try:
+            written = await asyncio.gather(*(self._shared_written.get(key)
+                for key in keys))
+        except Exception as e: # pylint: disable=broad-except
+            logging.warning("Failed to look up written keys, reading a "
+                "replica: %s", e)
+            written = ()
+        if any(value is not cache.MISSING for value in written):
+            _READS.labels("primary_after_write").inc()
+            return self._sessionmaker()
+        self._count_read(replica)
+        return None
+
+    def _fall_back(self, replica: _Replica, error: Exception) -> orm.Session:
+        replica.mark_down(error)
+        _READS.labels("primary").inc()
+        return self._sessionmaker()
+
+    async def _check_replicas(self):
+        while True:
+            await asyncio.sleep(self._check_interval)
+            results = await asyncio.gather(*(
+                r.check(self._check_interval, self._max_lag)
+                for r in self._replicas), return_exceptions=True)
+            # A replica whose health is unknown is not read, and the
+            # checks go on for the others.
+            for replica, result in zip(self._replicas, results):
+                if isinstance(result, Exception):
+                    logging.error("Failed to check Postgres replica %s.",
+                        replica.name, exc_info=result)
+                    replica.mark_down(result)
+
+    async def mark_written(self, *keys: str):
+        """Send reads of keys to the primary for a while.
+
+        Called after a write commits, with the keys later reads may use to
+        look up what was written.
+        """
+        if not self._replicas or not keys:
+            return
+        for key in keys:
+            self._written.set(key, True)
+        if self._shared_written:
+            try:
+                await asyncio.gather(*(self._shared_written.set(key, True)
+                    for key in keys))
+            except Exception as e: # pylint: disable=broad-except
+                # The write is done, only other processes may miss it.
+                logging.warning("Failed to share written keys: %s", e)
+
+    @property
+    def engine(self) -> sa_asyncio.AsyncEngine:
+        """The engine of the primary."""
+        return self._sessionmaker.kw["bind"]
+
+    def pool_stats(self) -> PoolStats:
+        """Returns a snapshot of the primary's connection pool usage."""
+        p: _InstrumentedPool = self.engine.sync_engine.pool
+        return PoolStats(
+            size=p.size(),
+            checked_out=p.checkedout(),
+            idle=p.checkedin(),
+            overflow=max(p.overflow(), 0),
+            waiters=p.waiters,
+            checkouts=p.checkouts,
+            wait_seconds_total=p.wait_seconds_total,
+            wait_seconds_max=p.wait_seconds_max,
+        )
+
+    def replica_stats(self) -> List[ReplicaStats]:
+        """Returns the health of each replica."""
+        return [ReplicaStats(
+            name=r.name,
+            healthy=r.healthy,
+            lag_seconds=r.lag_seconds,
+            reads=r.reads,
+        ) for r in self._replicas]
+
+    async def prewarm(self, connections: int):
+        """Open connections of the primary's pool, and of each replica's.
+
+        They are held until all are open, so each checkout opens a new
+        connection, and then returned to the pool idle. At most the pool
+        size are opened, overflow connections would be closed on return.
+        A replica failing to connect is marked down.
+
+        Raises:
+          OSError: If the primary cannot be connected.
+        """
+        async def open_all(engine: sa_asyncio.AsyncEngine):
+            async with contextlib.AsyncExitStack() as stack:
+                count = min(connections, engine.sync_engine.pool.size())
+                results = await asyncio.gather(*(
+                    stack.enter_async_context(engine.connect())
+                    for _ in range(count)), return_exceptions=True)
+            errors = [r for r in results if isinstance(r, BaseException)]
+            if errors:
+                raise errors[0]
+
+        results = await asyncio.gather(open_all(self.engine),
+            *(open_all(r.sessionmaker.kw["bind"]) for r in self._replicas),
+            return_exceptions=True)
+        for replica, result in zip(self._replicas, results[1:]):
+            if isinstance(result, BaseException):
+                replica.mark_down(result)
+        if isinstance(results[0], BaseException):
+            raise results[0]
+
+    async def ping(self):
+        """Run a statement on the primary, raises if it cannot."""
+        async with self.engine.connect() as conn:
+            await conn.execute(sa.text("SELECT 1"))
+
+    async def close(self):
+        """Stop health checks and close connections of every engine."""
+        if self._checks:
+            self._checks.cancel()
+            self._checks = None
+        for sessionmaker in [self._sessionmaker] + [r.sessionmaker
+            for r in self._replicas]:
+            await sessionmaker.kw["bind"].dispose()
+
+
+def _create_engine(conf: config.Config, host: str,
+    port: str) -> sa_asyncio.AsyncEngine:
+    # Imported here, it is only needed once the app is set up.
+    from sqlalchemy.ext import asyncio as sa_asyncio # pylint: disable=import-outside-toplevel
 
     url = "postgresql+asyncpg://{name}:{passwd}@{host}:{port}/{db}".format(
         name=conf.postgres_user,
         passwd=conf.postgres_passwd,
-        host=conf.postgres_host,
-        port=conf.postgres_port,
+        host=host,
+        port=port,
         db=conf.postgres_db,
     )
 
-    engine = asyncio.create_async_engine(url, echo=False)
-    logging.info("Postgres engine created.")
-    return SessionMaker(
-        orm.sessionmaker(
+    server_settings = {}
+    if conf.postgres_statement_timeout:
+        server_settings["statement_timeout"] = str(conf.postgres_statement_timeout)
+
+    return sa_asyncio.create_async_engine(
+        url,
+        echo=False,
+        poolclass=_InstrumentedPool,
+        pool_size=conf.postgres_pool_size,
+        max_overflow=conf.postgres_max_overflow,
+        pool_timeout=conf.postgres_pool_timeout,
+        pool_recycle=conf.postgres_pool_recycle,
+        pool_pre_ping=conf.postgres_pool_pre_ping,
+        connect_args={
+            "prepared_statement_cache_size": conf.postgres_statement_cache_size,
+            "server_settings": server_settings,
+        },
+    )
+
+def create_sessionmaker(conf: config.Config,
+    redis_client: "aioredis.Redis" = None) -> SessionMaker:
+    """Create async SQLAlchemy database engines of the primary and replicas.
+
+    Each replica gets a pool sized like the primary's.
+
+    Args:
+      conf: Config object.
+      redis_client: Redis client, where written keys are shared if
+        POSTGRES_READ_YOUR_WRITES_REDIS is set.
+    """
+    from sqlalchemy.ext import asyncio as sa_asyncio # pylint: disable=import-outside-toplevel
+
+    def bind(engine: sa_asyncio.AsyncEngine) -> orm.sessionmaker:
+        return orm.sessionmaker(
             bind=engine,
             expire_on_commit=False,
-            class_=asyncio.AsyncSession)
-        )
+            class_=sa_asyncio.AsyncSession)
+
+    primary = _create_engine(conf, conf.postgres_host, conf.postgres_port)
+    replicas = []
+    for replica in conf.postgres_replica_hosts:
+        host, _, port = replica.partition(":")
+        replicas.append(_create_engine(conf, host, port or conf.postgres_port))
+
+    logging.info("Postgres engine created with pool size %d, max overflow %d, "
+        "%d replicas.", conf.postgres_pool_size, conf.postgres_max_overflow,
+        len(replicas))
+    shared_written = None
+    if replicas and redis_client and conf.postgres_read_your_writes_redis:
+        shared_written = cache.RedisCache(redis_client,
+            math.ceil(conf.postgres_read_your_writes_window), prefix="written:")
+    return SessionMaker(
+        bind(primary),
+        [bind(engine) for engine in replicas],
+        check_interval=conf.postgres_replica_check_interval,
+        max_lag=conf.postgres_replica_max_lag,
+        read_your_writes_window=conf.postgres_read_your_writes_window,
+        shared_written=shared_written,
+    )
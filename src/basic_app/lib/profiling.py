@@ -0,0 +1,217 @@
+"""Record span trees of sampled requests and dump the slow ones.
+
+Code marks interesting sections with `span` or `traced`. Outside of a
+sampled request they return right after one context variable lookup, so
+they can stay in hot paths. Requests are sampled by PROFILING_SAMPLE_RATE,
+or when they carry PROFILING_HEADER with the value of PROFILING_TOKEN.
+"""
+import asyncio
+import contextvars
+import functools
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+)
+
+from basic_app.lib import config
+
+_current: contextvars.ContextVar = contextvars.ContextVar(
+    "profiling_span", default=None)
+
+_profiler = None
+
+class Span:
+    """A timed section of a request."""
+    __slots__ = ("name", "attrs", "start", "end", "children")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: List[Span] = []
+
+    def to_dict(self, origin: float) -> Dict[str, Any]:
+        """Returns the span tree with times in ms relative to origin."""
+        end = self.end if self.end is not None else time.perf_counter()
+        out = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+        }
+        if self.attrs:
+            out["attrs"] = self.attrs
+        if self.children:
+            out["children"] = [c.to_dict(origin) for c in self.children]
+        return out
+
+class _SpanContext:
+    __slots__ = ("_parent", "_name", "_attrs", "_span", "_token")
+
+    def __init__(self, parent: Span, name: str, attrs: Dict[str, Any]):
+        self._parent = parent
+        self._name = name
+        self._attrs = attrs
+
+    def __enter__(self) -> Span:
+        self._span = Span(self._name, self._attrs)
+        self._parent.children.append(self._span)
+        self._token = _current.set(self._span)
+        return self._span
+
+    def __exit__(self, *_):
+        self._span.end = time.perf_counter()
+        _current.reset(self._token)
+
+class _NoopContext:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *_):
+        pass
+
+_NOOP = _NoopContext()
+
+def span(name: str, **attrs):
+    """Returns a context manager recording a child span of the current one.
+
+    Args:
+      name: Name of the section.
+      attrs: Extra fields to record, keep them small and JSON serializable.
+    """
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return _SpanContext(parent, name, attrs)
+
+def traced(name: str):
+    """Decorate a coroutine function to record it as a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            parent = _current.get()
+            if parent is None:
+                return await func(*args, **kwargs)
+            with _SpanContext(parent, name, {}):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class Profiler:
+    """Decide which requests to record, and dump the slow ones."""
+    def __init__(self, sample_rate: float, header: str, token: Optional[str],
+        threshold_ms: float, directory: str, max_dumps: int):
+        """
+        Args:
+          sample_rate: Fraction of requests to record.
+          header: Name of the header triggering a recording.
+          token: Expected value of header, None to disable the trigger.
+          threshold_ms: Sampled requests at least this slow are dumped.
+          directory: Where to dump JSON files.
+          max_dumps: Stop dumping after this many files per process.
+        """
+        self._sample_rate = sample_rate
+        self._header = header.lower().encode()
+        self._token = token.encode() if token else None
+        self._threshold = threshold_ms / 1000
+        self._directory = directory
+        self._max_dumps = max_dumps
+        self._dumps = 0
+
+    def triggered(self, scope) -> bool:
+        """Whether the request asks to be recorded with the right token."""
+        if self._token is None:
+            return False
+        for name, value in scope["headers"]:
+            if name == self._header:
+                return hmac.compare_digest(value, self._token)
+        return False
+
+    def sampled(self) -> bool:
+        return self._sample_rate > 0 and random.random() < self._sample_rate
+
+    def record(self, root: Span, forced: bool):
+        """Dump root if it is slow enough, or forced by the header."""
+        duration = root.end - root.start
+        if not forced and duration < self._threshold:
+            return
+        if self._dumps >= self._max_dumps:
+            return
+        self._dumps += 1
+
+        tree = root.to_dict(root.start)
+        if root.children:
+            # Time before the first span covers routing, body parsing and
+            # pydantic validation.
+            tree["before_first_span_ms"] = tree["children"][0]["start_ms"]
+
+        path = os.path.join(self._directory, "{}-{}ms-{}-{}.json".format(
+            time.strftime("%Y%m%dT%H%M%S"),
+            int(duration * 1000),
+            re.sub(r"[^A-Za-z0-9]+", "_", root.attrs["path"]).strip("_"),
+            uuid.uuid4().hex[:8]))
+        asyncio.get_running_loop().run_in_executor(None, self._write, path, tree)
+
+    @staticmethod
+    def _write(path: str, tree: Dict[str, Any]):
+        try:
+            with open(path, "w") as f:
+                json.dump(tree, f, indent=2)
+        except OSError:
+            logging.exception("Failed to dump profile %s.", path)
+
+class Middleware:
+    """ASGI middleware recording the span tree of sampled requests."""
+    def __init__(self, app):
+        self._app = app
+
+    async def __call__(self, scope, receive, send):
+        profiler = _profiler
+        if profiler is None or scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+
+        forced = profiler.triggered(scope)
+        if not forced and not profiler.sampled():
+            await self._app(scope, receive, send)
+            return
+
+        root = Span("request", {"method": scope["method"], "path": scope["path"]})
+        token = _current.set(root)
+        try:
+            await self._app(scope, receive, send)
+        finally:
+            root.end = time.perf_counter()
+            _current.reset(token)
+            profiler.record(root, forced)
+
+def setup(conf: config.Config):
+    """Enable profiling if sampling or the header trigger is configured."""
+    global _profiler
+    if conf.profiling_sample_rate <= 0 and not conf.profiling_token:
+        _profiler = None
+        return
+
+    os.makedirs(conf.profiling_dir, exist_ok=True)
+    _profiler = Profiler(
+        sample_rate=conf.profiling_sample_rate,
+        header=conf.profiling_header,
+        token=conf.profiling_token,
+        threshold_ms=conf.profiling_threshold_ms,
+        directory=conf.profiling_dir,
+        max_dumps=conf.profiling_max_dumps,
+    )
+    logging.info("Profiling enabled, sample rate %s, dumps in %s.",
+        conf.profiling_sample_rate, conf.profiling_dir)
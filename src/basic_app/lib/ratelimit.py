@@ -0,0 +1,235 @@
+"""Limit the rate of requests per client IP and per email.
+
+Counts are kept in sliding windows, approximated from fixed windows: the
+count of the previous window is weighted by how much of it the sliding
+window still covers, and added to the count of the current one. It costs
+two counters per key, and is exact enough for abuse protection.
+
+Rejected requests are not counted, so a client over the limit gets
+through again at the limited rate.
+"""
+import dataclasses
+import logging
+import math
+import time
+from typing import (
+    Callable,
+    Collection,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+from basic_app.lib import (
+    cache,
+    config,
+    exception,
+    metrics,
+)
+
+if TYPE_CHECKING:
+    from redis import asyncio as aioredis
+
+_REJECTED = metrics.REGISTRY.counter("rate_limit_rejected_total",
+    "Requests rejected for exceeding a rate limit, by scope.", ("scope",))
+
+_BACKEND_ERRORS = metrics.REGISTRY.counter("rate_limit_backend_errors_total",
+    "Requests let through because the rate limit backend failed.")
+
+@dataclasses.dataclass
+class Limit:
+    """At most requests per window seconds."""
+    requests: int
+    window: float
+
+def _window(now: float, window: float) -> Tuple[int, float]:
+    """Returns the index of the current fixed window, and the weight of the
+    previous one in the sliding window."""
+    index = int(now // window)
+    return index, 1 - (now - index * window) / window
+
+def _retry_after(prev: int, curr: int, weight: float, limit: Limit) -> float:
+    """Returns seconds until a rejected request would be allowed."""
+    if curr + 1 <= limit.requests:
+        # Once the previous window has faded enough.
+        allowed = (limit.requests - curr - 1) / prev
+        return (weight - allowed) * limit.window
+    # Not before the next window, where the current count turns previous.
+    allowed = (limit.requests - 1) / curr
+    return (weight + 1 - allowed) * limit.window
+
+class RateLimiter:
+    """Define base rate limiter."""
+
+    async def acquire(self, key: str, limit: Limit) -> Optional[float]:
+        """Count a request of key, unless it exceeds limit.
+
+        Returns:
+          None if allowed, otherwise seconds after which to retry.
+        """
+        raise NotImplementedError
+
+class InMemoryRateLimiter(RateLimiter):
+    """Rate limiter counting in process memory, bounded in keys.
+
+    With several workers, each one allows the limit on its own.
+    """
+    def __init__(self, max_keys: int, clock: Callable[[], float] = time.time):
+        """
+        Args:
+          max_keys: Maximum number of keys counted, the least recently
+            seen are dropped first.
+          clock: Returns the current time in seconds.
+        """
+        self._counts = cache.LRUCache(max_keys, ttl=0)
+        self._clock = clock
+
+    async def acquire(self, key: str, limit: Limit) -> Optional[float]:
+        index, weight = _window(self._clock(), limit.window)
+        counts = self._counts.get(key)
+        if counts is cache.MISSING or counts[0] < index - 1:
+            prev, curr = 0, 0
+        elif counts[0] == index - 1:
+            prev, curr = counts[2], 0
+        else:
+            _, prev, curr = counts
+
+        if prev * weight + curr + 1 > limit.requests:
+            return _retry_after(prev, curr, weight, limit)
+        # Until the window after this one ends, it counts as previous.
+        self._counts.set(key, (index, prev, curr + 1), ttl=2 * limit.window)
+        return None
+
+# Counts in the current window, KEYS[1], unless the request would exceed
+# the limit, ARGV[2]. The previous window is KEYS[2], weighted by ARGV[1].
+# Returns whether it was counted, and both counts before it.
+_ACQUIRE = """
+local curr = tonumber(redis.call("GET", KEYS[1]) or "0")
+local prev = tonumber(redis.call("GET", KEYS[2]) or "0")
+if prev * tonumber(ARGV[1]) + curr + 1 > tonumber(ARGV[2]) then
+    return {0, prev, curr}
+end
+redis.call("INCR", KEYS[1])
+redis.call("PEXPIRE", KEYS[1], ARGV[3])
+return {1, prev, curr}
+"""
+
+class RedisRateLimiter(RateLimiter):
+    """Rate limiter counting on Redis, shared by processes.
+
+    A Lua script reads both windows and counts the request atomically, in
+    one round trip. Windows are indexed from the clock of app servers,
+    which only needs to be roughly in sync.
+
+    Requests are let through while Redis fails, rather than taking logins
+    down with it.
+    """
+    def __init__(self, client: "aioredis.Redis", prefix: str = "ratelimit:"):
+        """
+        Args:
+          client: Redis client.
+          prefix: Prefix of Redis keys.
+        """
+        from redis import exceptions # pylint: disable=import-outside-toplevel
+        self._script = client.register_script(_ACQUIRE)
+        self._prefix = prefix
+        self._errors = (exceptions.RedisError, OSError)
+        self._failing = False
+
+    async def acquire(self, key: str, limit: Limit) -> Optional[float]:
+        index, weight = _window(time.time(), limit.window)
+        # The hash tag keeps both windows of a key on one cluster node.
+        name = "{}{{{}}}:".format(self._prefix, key)
+        try:
+            counted, prev, curr = await self._script(
+                keys=[name + str(index), name + str(index - 1)],
+                args=[weight, limit.requests, int(limit.window * 2000)])
+        except self._errors as e:
+            _BACKEND_ERRORS.inc()
+            if not self._failing:
+                logging.warning("Rate limits are not enforced: %s", e)
+            self._failing = True
+            return None
+
+        self._failing = False
+        if counted:
+            return None
+        return _retry_after(int(prev), int(curr), weight, limit)
+
+class Rule:
+    """A limit applied per key of a scope, like per IP or per email."""
+    def __init__(self, limiter: RateLimiter, scope: str, limit: Limit):
+        """
+        Args:
+          limiter: Where requests are counted.
+          scope: What keys are, it prefixes them and labels rejections.
+          limit: Requests allowed per key.
+        """
+        self._limiter = limiter
+        self._scope = scope
+        self._limit = limit
+
+    async def check(self, key: str):
+        """Count a request of key.
+
+        Raises:
+          AppException: If key is over the limit.
+        """
+        retry_after = await self._limiter.acquire(
+            "{}:{}".format(self._scope, key), self._limit)
+        if retry_after is None:
+            return
+        _REJECTED.labels(self._scope).inc()
+        seconds = max(math.ceil(retry_after), 1)
+        raise exception.AppException(
+            code=exception.ErrorCode.TOO_MANY_REQUESTS,
+            message="Too many requests, retry after {} seconds.".format(seconds),
+            headers={"Retry-After": str(seconds)},
+        )
+
+def create_limiter(conf: config.Config,
+    client: "aioredis.Redis" = None) -> RateLimiter:
+    """Create the rate limiter selected by RATE_LIMIT_BACKEND.
+
+    Args:
+      conf: Config object.
+      client: Redis client, required by the redis backend.
+    """
+    if conf.rate_limit_backend == "memory":
+        return InMemoryRateLimiter(conf.rate_limit_cache_size)
+    return RedisRateLimiter(client)
+
+_ip_rule: Optional[Rule] = None
+_paths: Collection[str] = ()
+
+class Middleware:
+    """ASGI middleware limiting POST requests per client IP.
+
+    It runs before routing and reading the body, so a rejected request
+    costs a counter lookup and nothing else. Behind a proxy, the client
+    address is the proxy's unless uvicorn is told to trust its headers.
+    """
+    def __init__(self, app):
+        self._app = app
+
+    async def __call__(self, scope, receive, send):
+        rule = _ip_rule
+        if rule is None or scope["type"] != "http" or\
+            scope["method"] != "POST" or scope["path"] not in _paths:
+            await self._app(scope, receive, send)
+            return
+
+        client = scope.get("client")
+        try:
+            await rule.check(client[0] if client else "unknown")
+        except exception.AppException as e:
+            await exception.error_response(e)(scope, receive, send)
+            return
+        await self._app(scope, receive, send)
+
+def setup(ip_rule: Optional[Rule], paths: Collection[str]):
+    """Apply ip_rule to POST requests of paths in Middleware, None disables
+    it."""
+    global _ip_rule, _paths
+    _ip_rule = ip_rule
+    _paths = frozenset(paths)
@@ -0,0 +1,25 @@
+"""Provide Redis client"""
+import logging
+from typing import TYPE_CHECKING
+
+from basic_app.lib import config
+
+if TYPE_CHECKING:
+    from redis import asyncio as aioredis
+
+def create_client(conf: config.Config) -> "aioredis.Redis":
+    """Create async Redis client.
+
+    Connections are opened lazily and pooled by the client. redis is
+    imported here, so processes not using Redis don't pay for importing it.
+    """
+    from redis import asyncio as aioredis # pylint: disable=import-outside-toplevel
+    client = aioredis.Redis(
+        host=conf.redis_host,
+        port=int(conf.redis_port),
+        db=int(conf.redis_db),
+        password=conf.redis_passwd,
+        max_connections=conf.redis_max_connections,
+    )
+    logging.info("Redis client created.")
+    return client
@@ -0,0 +1,86 @@
+"""Provide the JSON response class of the app.
+
+orjson serializes several times faster than the standard json module,
+and handles UUID and datetime natively. It is used when installed,
+unless APP_JSON_RESPONSE says otherwise.
+"""
+import datetime as dt
+import json
+import logging
+import uuid
+from typing import (
+    Any,
+    Dict,
+)
+from fastapi import responses
+
+from basic_app.lib import config
+
+try:
+    import orjson
+except ImportError: # pragma: no cover
+    orjson = None
+
+def _default(value: Any) -> Any:
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, dt.datetime):
+        return value.isoformat()
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+class JSONResponse(responses.JSONResponse):
+    """JSON response rendered by the standard json module.
+
+    The content may carry UUID and datetime values, like ORJSONResponse.
+    """
+    def render(self, content: Any) -> bytes:
+        return json.dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+            default=_default,
+        ).encode("utf-8")
+
+class ORJSONResponse(responses.JSONResponse):
+    """JSON response rendered by orjson.
+
+    Content may carry UUID and datetime values, so handlers can skip
+    jsonable_encoder. orjson only handles the exact uuid.UUID type, the
+    subclass asyncpg returns goes through _default.
+    """
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default)
+
+_response_class = ORJSONResponse if orjson else JSONResponse
+
+def setup(conf: config.Config):
+    """Pick the JSON response class, "auto", "orjson" or "json".
+
+    Raises:
+      ValueError: APP_JSON_RESPONSE is none of them.
+      ImportError: It is "orjson", which is not installed.
+    """
+    global _response_class
+    if conf.json_response == "auto":
+        _response_class = ORJSONResponse if orjson else JSONResponse
+    elif conf.json_response == "orjson":
+        if orjson is None:
+            raise ImportError("APP_JSON_RESPONSE=orjson needs orjson installed.")
+        _response_class = ORJSONResponse
+    elif conf.json_response == "json":
+        _response_class = JSONResponse
+    else:
+        raise ValueError("APP_JSON_RESPONSE must be \"auto\", \"orjson\" or "
+            "\"json\", got \"{}\".".format(conf.json_response))
+    logging.info("Rendering JSON with %s.", _response_class.__name__)
+
+def response_class() -> type:
+    """Returns the JSON response class."""
+    return _response_class
+
+def json_response(content: Any, status_code: int = 200,
+    headers: Dict[str, str] = None) -> responses.JSONResponse:
+    """Returns a JSON response of content, which may contain UUID and
+    datetime values."""
+    return _response_class(content, status_code=status_code, headers=headers)
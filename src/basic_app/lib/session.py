@@ -0,0 +1,198 @@
+"""Server-side sessions for signed-in users."""
+import collections
+import dataclasses
+import json
+import secrets
+import time
+from typing import (
+    Dict,
+    Optional,
+    TYPE_CHECKING,
+    Tuple,
+)
+import fastapi
+
+from basic_app.lib import config
+
+if TYPE_CHECKING:
+    from redis import asyncio as aioredis
+
+@dataclasses.dataclass
+class SessionData:
+    """What we know about the user of a session.
+
+    Attributes:
+      user_id: Our user id, whichever way the user signed in.
+      email: Email of the user.
+      provider: How the user signed in, "password" or "google".
+      create_time: Seconds since epoch when the session was created.
+    """
+    user_id: str
+    email: str
+    provider: str
+    create_time: float = dataclasses.field(default_factory=time.time)
+
+@dataclasses.dataclass
+class Cookie:
+    """How session ids are carried in cookies."""
+    name: str
+    max_age: int
+    secure: bool
+
+    def set(self, response: fastapi.Response, session_id: str):
+        response.set_cookie(self.name, session_id,
+            max_age=self.max_age,
+            httponly=True,
+            secure=self.secure,
+            samesite="lax")
+
+    def delete(self, response: fastapi.Response):
+        response.delete_cookie(self.name)
+
+def _new_session_id() -> str:
+    return secrets.token_urlsafe(32)
+
+class SessionStore:
+    """Define base session store."""
+
+    async def create(self, data: SessionData) -> str:
+        """Create a session and return its id."""
+        raise NotImplementedError
+
+    async def get(self, session_id: str) -> Optional[SessionData]:
+        """Returns the session, or None if it is missing or expired."""
+        raise NotImplementedError
+
+    async def delete(self, session_id: str):
+        """Delete the session if it exists."""
+        raise NotImplementedError
+
+    async def delete_user_sessions(self, user_id: str):
+        """Delete all sessions of a user."""
+        raise NotImplementedError
+
+    async def close(self):
+        """Release resources held by the store."""
+
+class RedisSessionStore(SessionStore):
+    """Session store on Redis, sessions expire by Redis TTL.
+
+    A session is one JSON string key, so validating a request is one GET.
+    Each user also has a set of their session ids, written in the same
+    pipeline, to support signing out everywhere.
+    """
+    def __init__(self, client: "aioredis.Redis", ttl: int,
+        prefix: str = "session:"):
+        """
+        Args:
+          client: Redis client.
+          ttl: Seconds a session lives.
+          prefix: Prefix of Redis keys.
+        """
+        self._client = client
+        self._ttl = ttl
+        self._prefix = prefix
+
+    def _key(self, session_id: str) -> str:
+        return self._prefix + session_id
+
+    def _user_key(self, user_id: str) -> str:
+        return "{}user:{}".format(self._prefix, user_id)
+
+    async def create(self, data: SessionData) -> str:
+        session_id = _new_session_id()
+        user_key = self._user_key(data.user_id)
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.set(self._key(session_id),
+                json.dumps(dataclasses.asdict(data)), ex=self._ttl)
+            pipe.sadd(user_key, session_id)
+            pipe.expire(user_key, self._ttl)
+            await pipe.execute()
+        return session_id
+
+    async def get(self, session_id: str) -> Optional[SessionData]:
+        value = await self._client.get(self._key(session_id))
+        if value is None:
+            return None
+        return SessionData(**json.loads(value))
+
+    async def delete(self, session_id: str):
+        data = await self.get(session_id)
+        if data is None:
+            return
+        async with self._client.pipeline(transaction=False) as pipe:
+            pipe.delete(self._key(session_id))
+            pipe.srem(self._user_key(data.user_id), session_id)
+            await pipe.execute()
+
+    async def delete_user_sessions(self, user_id: str):
+        """Delete all sessions of a user."""
+        user_key = self._user_key(user_id)
+        session_ids = await self._client.smembers(user_key)
+        keys = [self._key(sid.decode()) for sid in session_ids]
+        await self._client.delete(user_key, *keys)
+
+    async def close(self):
+        await self._client.close()
+
+class InMemorySessionStore(SessionStore):
+    """Session store in a dict, for tests and single process development.
+
+    It holds at most max_size sessions, the least recently used ones are
+    dropped first.
+    """
+    def __init__(self, ttl: int, max_size: int = 10000):
+        """
+        Args:
+          ttl: Seconds a session lives.
+          max_size: Maximum number of sessions.
+        """
+        self._ttl = ttl
+        self._max_size = max_size
+        self._sessions: Dict[str, Tuple[float, SessionData]] =\
+            collections.OrderedDict()
+
+    async def create(self, data: SessionData) -> str:
+        session_id = _new_session_id()
+        self._sessions[session_id] = (time.monotonic() + self._ttl, data)
+        while len(self._sessions) > self._max_size:
+            self._sessions.popitem(last=False)
+        return session_id
+
+    async def get(self, session_id: str) -> Optional[SessionData]:
+        item = self._sessions.get(session_id)
+        if item is None:
+            return None
+        expire_at, data = item
+        if time.monotonic() >= expire_at:
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return data
+
+    async def delete(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+    async def delete_user_sessions(self, user_id: str):
+        for session_id in [sid for sid, (_, data) in self._sessions.items()
+            if data.user_id == user_id]:
+            del self._sessions[session_id]
+
+def create_cookie(conf: config.Config) -> Cookie:
+    """Create cookie settings from config."""
+    return Cookie(
+        name=conf.session_cookie_name,
+        max_age=conf.session_ttl,
+        secure=conf.session_cookie_secure,
+    )
+
+def create_store(conf: config.Config, client: "aioredis.Redis" = None) -> SessionStore:
+    """Create the session store selected by SESSION_BACKEND.
+
+    Args:
+      conf: Config object.
+      client: Redis client, required by the redis backend.
+    """
+    if conf.session_backend == "memory":
+        return InMemorySessionStore(conf.session_ttl, conf.session_memory_size)
+    return RedisSessionStore(client, conf.session_ttl)
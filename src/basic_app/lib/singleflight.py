@@ -0,0 +1,61 @@
+"""Coalesce concurrent calls for the same key onto one execution."""
+import asyncio
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Tuple,
+)
+
+class Group:
+    """In-process single-flight group.
+
+    While a call for a key is in flight, later calls for the key wait for
+    it and get its result or exception instead of running their own.
+    """
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable,
+        func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run func unless a call for key is in flight, then wait for it.
+
+        Args:
+          key: What makes calls duplicates of each other.
+          func: The call to run.
+        Returns:
+          The result, and whether it came from a call already in flight.
+        """
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                # The call in flight was cancelled, not this one, run again.
+                if future.cancelled():
+                    continue
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await func()
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved, there may be no call waiting.
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._calls[key]
+        future.set_result(result)
+        return result, False
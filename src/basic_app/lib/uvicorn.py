@@ -1,17 +1,36 @@
 """Wrapper for uvicorn"""
 import uvicorn
 
-def run(app_location: str, host: str, port: int):
+from basic_app.lib import config
+
+def run(app_factory: str, conf: config.Config):
     """Start running uvicore server.
 
+    The app is built by calling app_factory inside each worker process, so
+    every worker owns its engine, hashing pool and other resources.
+
     Args:
-      app_location: In "<module>:<func>" format
-      host: The server host to run
-      port: The port to listen on
+      app_factory: In "<module>:<func>" format, func returns the app.
+      conf: Config of host, port, workers and server tuning.
     """
+    kwargs = {}
+    # Needs uvicorn>=0.22, as pinned. Left unset, uvicorn waits for
+    # in-flight requests without a limit.
+    if conf.timeout_graceful_shutdown:
+        kwargs["timeout_graceful_shutdown"] = conf.timeout_graceful_shutdown
+
     # https://github.com/tiangolo/fastapi/issues/1508
+    # Without a log config, uvicorn loggers propagate to the root logger set
+    # up by lib/logging, and share its format and queue.
     uvicorn.run(
-        app_location,
-        host=host,
-        port=port,
-        log_config=None)
+        app_factory,
+        factory=True,
+        host=conf.host,
+        port=int(conf.port),
+        workers=conf.workers,
+        loop=conf.uvicorn_loop,
+        http=conf.uvicorn_http,
+        backlog=conf.backlog,
+        timeout_keep_alive=conf.timeout_keep_alive,
+        log_config=None,
+        **kwargs)
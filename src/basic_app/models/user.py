@@ -26,4 +26,9 @@ class User(base.Base):
         return '<User(id={},email={})>'.format(self.id, self.email)
 
     def to_dict(self):
-        return {c.name: getattr(self, c.name, None) for c in self.__table__.columns}
+        # Read the instance state directly rather than through the
+        # instrumented attributes, unset columns are None.
+        state = self.__dict__
+        return {name: state.get(name) for name in _COLUMNS}
+
+_COLUMNS = tuple(c.name for c in User.__table__.columns)
@@ -6,3 +6,6 @@ and pack them into protocol agnostic service layer.
 # To ease module import.
 from basic_app.routers.user import User
 from basic_app.routers.google_signin import GoogleSignin
+from basic_app.routers.status import Status
+from basic_app.routers.health import Health
+from basic_app.routers.session import Session
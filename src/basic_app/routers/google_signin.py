@@ -1,6 +1,10 @@
 """Try Google signin."""
 
 import logging
+import os
+import uuid
+from typing import Callable
+import pydantic
 from fastapi import (
     APIRouter,
     Cookie,
@@ -8,70 +12,168 @@ from fastapi import (
     Request,
     responses,
 )
-from fastapi.templating import Jinja2Templates
-from google.oauth2 import id_token
-from google.auth.transport import requests
 
-from basic_app.lib import exception
+from basic_app import services
+from basic_app.lib import (
+    exception,
+    google_id_token,
+    profiling,
+    response,
+    session,
+)
 
 router = APIRouter()
 
 _controller = None
 
-_templates = Jinja2Templates(directory="./src/basic_app/templates")
+# Constructs _controller on the first request, see GoogleSignin.lazy.
+_factory = None
+
+_TEMPLATES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+
+_templates = None
+
+def _get_templates():
+    """Returns the templates, loading jinja2 on first use."""
+    global _templates
+    if _templates is None:
+        # pylint: disable=import-outside-toplevel
+        from fastapi.templating import Jinja2Templates
+        _templates = Jinja2Templates(directory=_TEMPLATES_DIR)
+    return _templates
+
+def _get_controller() -> "GoogleSignin":
+    if _controller is None and _factory is not None:
+        _factory()
+    return _controller
+
+async def warm_up():
+    """Construct the controller and warm it up, rather than on the first
+    request."""
+    await _get_controller().warm_up()
+
+async def close():
+    """Close the controller, if it was constructed."""
+    if _controller is not None:
+        await _controller.close()
 
 @router.get("/google-signin", response_class=responses.HTMLResponse)
 async def signin_view(request: Request):
-    return await _controller.signin_view(request)
+    return await _get_controller().signin_view(request)
+
+class GoogleSigninResult(pydantic.BaseModel):
+    id: uuid.UUID
+    email: pydantic.EmailStr
+    username: str
 
-@router.post("/google-signin")
-async def google_signin(credential: str = Form(None),
+@router.post("/google-signin", response_model=GoogleSigninResult)
+async def google_signin(
+    credential: str = Form(None),
     csrf_token: str = Form(None),
     csrf_cookie: str = Cookie(None)):
-    return await _controller.google_signin(credential, csrf_token, csrf_cookie)
+    return await _get_controller().google_signin(
+        credential, csrf_token, csrf_cookie)
 
 class GoogleSignin:
     """Define router."""
 
-    def __init__(self, app_host: str, client_id: str):
+    def __init__(self, app_host: str, client_id: str,
+        verifier: google_id_token.GoogleIdTokenVerifier,
+        service: services.User,
+        sessions: session.SessionStore, cookie: session.Cookie):
         global _controller
         _controller = self
         self._app_host = app_host
         self._client_id = client_id
+        self._verifier = verifier
+        self._service = service
+        self._sessions = sessions
+        self._cookie = cookie
+
+    @staticmethod
+    def lazy(factory: Callable[[], "GoogleSignin"]):
+        """Construct the controller with factory on its first request.
+
+        Google sign-in is optional for most clients, so processes that
+        never serve it skip building the verifier and loading templates.
+        """
+        global _controller, _factory
+        _controller = None
+        _factory = factory
+
+    async def warm_up(self):
+        """Load jinja2 and compile the template, and fetch Google certs."""
+        _get_templates().get_template("google-signin.html")
+        await self._verifier.prefetch()
+
+    async def close(self):
+        """Stop the refresh of Google certs."""
+        await self._verifier.close()
 
     async def signin_view(self, request: Request):
         """The entrypoint of GET /google-signin request."""
-        return _templates.TemplateResponse('google-signin.html', {
+        return _get_templates().TemplateResponse('google-signin.html', {
             "request": request,
             "google_client_id": self._client_id,
             "app_host": self._app_host,
         })
 
+    @profiling.traced("routers.GoogleSignin.google_signin")
     async def google_signin(self, credential, csrf_token, csrf_cookie):
-        """The entrypoint of POST /google-signin request."""
+        """The entrypoint of POST /google-signin request.
+
+        The user is found by the email of the ID token, and created on its
+        first sign-in.
+        """
         if not csrf_cookie:
-            exception.AppException(
+            raise exception.AppException(
                 code=exception.ErrorCode.INVALID_INPUT,
                 message="No CSRF token in Cookie.",
             )
         if not csrf_token:
-            exception.AppException(
+            raise exception.AppException(
                 code=exception.ErrorCode.INVALID_INPUT,
                 message="No CSRF token in body.",
             )
         if csrf_cookie != csrf_token:
-            exception.AppException(
+            raise exception.AppException(
                 code=exception.ErrorCode.INVALID_INPUT,
                 message="Failed to verify double submit cookie.",
             )
 
         try:
-            # Specify the CLIENT_ID of the app that accesses the backend:
-            _ = id_token.verify_oauth2_token(credential, requests.Request(), self._client_id)
-            logging.info("Sign in succeeded.")
-            # TODO: Save user into database and create session.
+            # Verified against cached Google certs for our CLIENT_ID.
+            claims = await self._verifier.verify(credential)
         except ValueError:
             raise exception.AppException(
                 code=exception.ErrorCode.AUTHENTICATION_FAIL,
                 message="Failed to verify ID token.",
             )
+        # Anyone can put an unverified email on a Google account.
+        email = claims.get("email")
+        if not email or not claims.get("email_verified"):
+            raise exception.AppException(
+                code=exception.ErrorCode.AUTHENTICATION_FAIL,
+                message="No verified email in ID token.",
+            )
+
+        result = await self._service.signin_external(
+            services.ExternalSigninCommand(
+                email=email,
+                username=(claims.get("name") or email.split("@")[0])[:64],
+            ))
+        logging.info("Sign in succeeded.")
+
+        session_id = await self._sessions.create(session.SessionData(
+            user_id=str(result.id),
+            email=result.email,
+            provider="google",
+        ))
+        resp = response.json_response({
+            "id": result.id,
+            "email": result.email,
+            "username": result.username,
+        })
+        self._cookie.set(resp, session_id)
+        return resp
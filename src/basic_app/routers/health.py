@@ -0,0 +1,60 @@
+"""Health and readiness API handlers."""
+import dataclasses
+import fastapi
+
+from basic_app.lib import (
+    lifecycle,
+    postgres,
+    response,
+)
+
+router = fastapi.APIRouter()
+
+_controller = None
+
+@router.get("/healthz")
+async def healthz():
+    return await _controller.healthz()
+
+@router.get("/readyz")
+async def readyz():
+    return await _controller.readyz()
+
+class Health:
+    """Define router."""
+
+    def __init__(self, app_lifecycle: lifecycle.Lifecycle,
+        sessionmaker: postgres.SessionMaker):
+        self._lifecycle = app_lifecycle
+        self._sessionmaker = sessionmaker
+        global _controller
+        _controller = self
+
+    async def healthz(self):
+        """The entrypoint of GET /healthz request.
+
+        The process is alive as long as it answers, dependencies being down
+        is no reason to restart it.
+        """
+        return {
+            "status": "ok",
+            "warm": self._lifecycle.warm,
+            "warmup_seconds": self._lifecycle.warmup_seconds,
+            "postgres_pool": dataclasses.asdict(self._sessionmaker.pool_stats()),
+        }
+
+    async def readyz(self):
+        """The entrypoint of GET /readyz request.
+
+        Ready once warmed up, while every dependency check passes, it is
+        503 otherwise.
+        """
+        checks = await self._lifecycle.check()
+        ready = self._lifecycle.warm and\
+            all(result == "ok" for result in checks.values())
+        return response.json_response({
+            "ready": ready,
+            "warm": self._lifecycle.warm,
+            "checks": checks,
+            "postgres_pool": dataclasses.asdict(self._sessionmaker.pool_stats()),
+        }, status_code=200 if ready else 503)
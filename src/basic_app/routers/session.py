@@ -0,0 +1,76 @@
+"""Session API handlers."""
+import fastapi
+import pydantic
+
+from basic_app.lib import (
+    exception,
+    session,
+)
+
+router = fastapi.APIRouter()
+
+_controller = None
+
+async def current_session(request: fastapi.Request) -> session.SessionData:
+    """Dependency which authenticates the request by its session cookie.
+
+    Raises:
+      AppException: If there is no valid session.
+    """
+    return await _controller.authenticate(request)
+
+class SessionResult(pydantic.BaseModel):
+    user_id: str
+    email: str
+    provider: str
+
+@router.get("/session", response_model=SessionResult)
+async def get_session(data: session.SessionData = fastapi.Depends(current_session)):
+    return SessionResult(
+        user_id=data.user_id,
+        email=data.email,
+        provider=data.provider,
+    )
+
+@router.post("/logout")
+async def logout(request: fastapi.Request, response: fastapi.Response):
+    return await _controller.logout(request, response)
+
+@router.post("/logout-all")
+async def logout_all(response: fastapi.Response,
+    data: session.SessionData = fastapi.Depends(current_session)):
+    return await _controller.logout_all(data, response)
+
+class Session:
+    """Define router."""
+
+    def __init__(self, store: session.SessionStore, cookie: session.Cookie):
+        self._store = store
+        self._cookie = cookie
+        global _controller
+        _controller = self
+
+    async def authenticate(self, request: fastapi.Request) -> session.SessionData:
+        """Returns the session of request, one store lookup."""
+        session_id = request.cookies.get(self._cookie.name)
+        data = await self._store.get(session_id) if session_id else None
+        if data is None:
+            raise exception.AppException(
+                code=exception.ErrorCode.AUTHENTICATION_FAIL,
+                message="No valid session.",
+            )
+        return data
+
+    async def logout(self, request: fastapi.Request, response: fastapi.Response):
+        """The entrypoint of POST /logout request."""
+        session_id = request.cookies.get(self._cookie.name)
+        if session_id:
+            await self._store.delete(session_id)
+        self._cookie.delete(response)
+
+    async def logout_all(self, data: session.SessionData,
+        response: fastapi.Response):
+        """The entrypoint of POST /logout-all request, it signs the user
+        out of every session."""
+        await self._store.delete_user_sessions(data.user_id)
+        self._cookie.delete(response)
@@ -0,0 +1,110 @@
+"""Runtime status API handlers.
+
+They reveal the load and topology of the service, so they take the bearer
+token APP_STATUS_TOKEN when it is set. Without it, they must not be
+reachable from outside.
+"""
+import dataclasses
+import hmac
+from typing import Optional
+import fastapi
+from fastapi import responses
+
+from basic_app.lib import (
+    cache,
+    exception,
+    metrics,
+    password,
+    postgres,
+)
+
+router = fastapi.APIRouter()
+
+_controller = None
+
+@router.get("/status")
+async def status(authorization: Optional[str] = fastapi.Header(None)):
+    return await _controller.status(authorization)
+
+@router.get("/metrics")
+async def get_metrics(authorization: Optional[str] = fastapi.Header(None)):
+    return await _controller.metrics(authorization)
+
+class Status:
+    """Define router."""
+
+    def __init__(self, scheduler: password.HashScheduler,
+        sessionmaker: postgres.SessionMaker,
+        user_cache: cache.Cache = None, token: str = None):
+        """
+        Args:
+          scheduler: Password hashing scheduler.
+          sessionmaker: Postgres sessions.
+          user_cache: User cache, if enabled.
+          token: Bearer token requests must carry, None lets all in.
+        """
+        self._scheduler = scheduler
+        self._sessionmaker = sessionmaker
+        self._user_cache = user_cache
+        self._authorization = "Bearer {}".format(token) if token else None
+        global _controller
+        _controller = self
+
+        # Gauges are read from the stats only when scraped.
+        metrics.REGISTRY.gauge("password_hasher_jobs",
+            "Password hashing jobs running and queued.",
+            lambda: {
+                ("running",): self._scheduler.stats().running,
+                ("queued",): self._scheduler.stats().queue_depth,
+            }, ("state",))
+        metrics.REGISTRY.gauge("postgres_pool_connections",
+            "Postgres connections by state.",
+            lambda: {
+                ("checked_out",): self._sessionmaker.pool_stats().checked_out,
+                ("idle",): self._sessionmaker.pool_stats().idle,
+            }, ("state",))
+        metrics.REGISTRY.gauge("postgres_pool_waiters",
+            "Checkouts waiting for a Postgres connection.",
+            lambda: self._sessionmaker.pool_stats().waiters)
+        metrics.REGISTRY.gauge("postgres_replica_healthy",
+            "Whether read-only sessions are sent to a replica.",
+            lambda: {(r.name,): int(r.healthy)
+                for r in self._sessionmaker.replica_stats()}, ("replica",))
+        metrics.REGISTRY.gauge("postgres_replica_lag_seconds",
+            "Replication lag of replicas, as of their last check.",
+            lambda: {(r.name,): r.lag_seconds
+                for r in self._sessionmaker.replica_stats()}, ("replica",))
+        if user_cache:
+            metrics.REGISTRY.gauge("user_cache_hit_ratio",
+                "Ratio of user lookups answered by the cache.",
+                lambda: self._user_cache.stats().hit_ratio)
+
+    def _authorize(self, authorization: Optional[str]):
+        if self._authorization is None:
+            return
+        if authorization is None or not hmac.compare_digest(
+            authorization.encode(), self._authorization.encode()):
+            raise exception.AppException(
+                code=exception.ErrorCode.AUTHENTICATION_FAIL,
+                message="Missing or wrong status token.",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+    async def status(self, authorization: Optional[str] = None):
+        """The entrypoint of GET /status request."""
+        self._authorize(authorization)
+        status = {
+            "password_hasher": dataclasses.asdict(self._scheduler.stats()),
+            "postgres_pool": dataclasses.asdict(self._sessionmaker.pool_stats()),
+            "postgres_replicas": [dataclasses.asdict(r)
+                for r in self._sessionmaker.replica_stats()],
+        }
+        if self._user_cache:
+            status["user_cache"] = dataclasses.asdict(self._user_cache.stats())
+        return status
+
+    async def metrics(self, authorization: Optional[str] = None):
+        """The entrypoint of GET /metrics request."""
+        self._authorize(authorization)
+        return responses.Response(metrics.REGISTRY.render(),
+            media_type=metrics.CONTENT_TYPE)
@@ -1,10 +1,18 @@
 """User API handlers."""
 import uuid
 import datetime as dt
+from typing import Optional
 import fastapi
 import pydantic
 
 from basic_app import services
+from basic_app.lib import (
+    idempotency,
+    profiling,
+    ratelimit,
+    response,
+    session,
+)
 
 router = fastapi.APIRouter()
 
@@ -24,8 +32,9 @@ class SignupResult(pydantic.BaseModel):
     update_time: dt.datetime
 
 @router.post("/signup", response_model=SignupResult)
-async def signup(body: SignupRequestBody):
-    return await _controller.signup(body)
+async def signup(body: SignupRequestBody,
+    idempotency_key: Optional[str] = fastapi.Header(None)):
+    return await _controller.signup(body, idempotency_key)
 
 class LoginRequestBody(pydantic.BaseModel):
     email: pydantic.EmailStr
@@ -39,43 +48,89 @@ class LoginResult(pydantic.BaseModel):
     update_time: dt.datetime
 
 @router.post("/login", response_model=LoginResult)
-async def login(body: LoginRequestBody):
-    return await _controller.login(body)
+async def login(body: LoginRequestBody,
+    background_tasks: fastapi.BackgroundTasks):
+    return await _controller.login(body, background_tasks)
+
+async def warm_up():
+    """Validate a request body, email validation loads IDNA tables on its
+    first use."""
+    LoginRequestBody(email="warm-up@example.com", password="warm-up")
 
 class User:
     """Define router."""
 
-    def __init__(self, service: services.User):
+    def __init__(self, service: services.User,
+        sessions: session.SessionStore, cookie: session.Cookie,
+        idempotency: idempotency.Idempotency = None,
+        rate_limit: ratelimit.Rule = None):
         self._service = service
+        self._sessions = sessions
+        self._cookie = cookie
+        self._idempotency = idempotency
+        # Per email, checked before any hashing or database work.
+        self._rate_limit = rate_limit
         global _controller
         _controller = self
 
-    async def signup(self, body: SignupRequestBody):
+    @profiling.traced("routers.User.signup")
+    async def signup(self, body: SignupRequestBody,
+        idempotency_key: str = None):
         """The entrypoint of POST /signup request."""
+        await self._check_rate_limit(body.email)
+        if idempotency_key is None or self._idempotency is None:
+            return await self._signup(body)
+        # The password is left out, a digest of it would outlive the
+        # request in the store.
+        return await self._idempotency.run("signup", idempotency_key,
+            idempotency.fingerprint(body.id, body.email, body.username),
+            lambda: self._signup(body))
+
+    async def _check_rate_limit(self, email: str):
+        if self._rate_limit:
+            await self._rate_limit.check(email.lower())
+
+    async def _signup(self, body: SignupRequestBody):
         result = await self._service.signup(services.SignupCommand(
             id=body.id,
             email=body.email,
             username=body.username,
             password=body.password
         ))
-        return SignupResult(
-            id=result.id,
-            email=result.email,
-            username=result.username,
-            create_time=result.create_time,
-            update_time=result.update_time
-        )
+        # Rendered straight from the service result, SignupResult only
+        # documents the response.
+        return response.json_response({
+            "id": result.id,
+            "email": result.email,
+            "username": result.username,
+            "create_time": result.create_time,
+            "update_time": result.update_time,
+        })
 
-    async def login(self, body: LoginRequestBody):
+    @profiling.traced("routers.User.login")
+    async def login(self, body: LoginRequestBody,
+        background_tasks: fastapi.BackgroundTasks):
         """The entrypoint of POST /login request."""
+        await self._check_rate_limit(body.email)
         result = await self._service.login(services.LoginCommand(
             email=body.email,
             password=body.password
         ))
-        return LoginResult(
-            id=result.id,
+        if result.rehash:
+            background_tasks.add_task(self._service.rehash_password, result.rehash)
+
+        session_id = await self._sessions.create(session.SessionData(
+            user_id=str(result.id),
             email=result.email,
-            username=result.username,
-            create_time=result.create_time,
-            update_time=result.update_time
-        )
+            provider="password",
+        ))
+        resp = response.json_response({
+            "id": result.id,
+            "email": result.email,
+            "username": result.username,
+            "create_time": result.create_time,
+            "update_time": result.update_time,
+        })
+        # FastAPI runs background tasks after a returned response too.
+        self._cookie.set(resp, session_id)
+        return resp
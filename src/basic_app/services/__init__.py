@@ -3,6 +3,13 @@ from basic_app.services.user import (
     User,
     SignupCommand,
     SignupResult,
+    LoginCommand,
+    LoginResult,
+    RehashCommand,
+    ExternalSigninCommand,
+    ExternalSigninResult,
+    ImportUserCommand,
+    ImportResult,
 )
 
 
@@ -1,17 +1,28 @@
+import asyncio
 import datetime as dt
 import dataclasses
-from typing import Coroutine
-from sqlalchemy import (
-    select,
-    or_,
+import itertools
+import logging
+import secrets
+import uuid
+from concurrent import futures
+from typing import (
+    Coroutine,
+    Iterable,
+    List,
+    Optional,
 )
 
+import email_validator
+
 from basic_app.lib import (
     exception,
+    metrics,
     password,
-    postgres,
+    profiling,
+    singleflight,
 )
-from basic_app import models
+from basic_app import daos
 
 
 @dataclasses.dataclass
@@ -34,6 +45,12 @@ class LoginCommand:
     email: str
     password: str
 
+@dataclasses.dataclass
+class RehashCommand:
+    id: str
+    password: str
+    old_hash: str
+
 @dataclasses.dataclass
 class LoginResult:
     id: str
@@ -41,61 +58,341 @@ class LoginResult:
     username: str
     create_time: dt.datetime
     update_time: dt.datetime
+    # Set when the stored hash should be upgraded by rehash_password.
+    rehash: Optional[RehashCommand] = None
+
+@dataclasses.dataclass
+class ExternalSigninCommand:
+    # Verified by the identity provider.
+    email: str
+    username: str
+
+@dataclasses.dataclass
+class ExternalSigninResult:
+    id: str
+    email: str
+    username: str
+    # Whether the user signed in for the first time.
+    created: bool
+
+@dataclasses.dataclass
+class ImportUserCommand:
+    id: str
+    email: str
+    username: str
+    password: str
+
+@dataclasses.dataclass
+class ImportResult:
+    imported: int = 0
+    # Users skipped because their id or email is taken.
+    conflicts: List[ImportUserCommand] = dataclasses.field(default_factory=list)
+    # Users skipped because a field is missing, malformed or too long.
+    invalid: List[ImportUserCommand] = dataclasses.field(default_factory=list)
+
+_SECONDS = metrics.REGISTRY.histogram("service_duration_seconds",
+    "Latency of service methods.", ("method",))
+
+_COALESCED_SIGNUPS = metrics.REGISTRY.counter("signup_coalesced_total",
+    "Signups answered by a concurrent signup of the same email.")
+
+def _normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+# Limits of the signup request, and the email column width.
+_IMPORT_FIELD_LENGTHS = (("email", 128), ("username", 64), ("password", 256))
+
+def _validate_import(cmd: ImportUserCommand) -> Optional[str]:
+    """Returns why cmd cannot be imported, or None when it can."""
+    for field, max_length in _IMPORT_FIELD_LENGTHS:
+        value = getattr(cmd, field)
+        if not isinstance(value, str) or not value:
+            return f"{field} is missing"
+        if len(value) > max_length:
+            return f"{field} is longer than {max_length} characters"
+    try:
+        uuid.UUID(str(cmd.id))
+    except ValueError:
+        return "id is not a UUID"
+    try:
+        email_validator.validate_email(cmd.email, check_deliverability=False)
+    except email_validator.EmailNotValidError:
+        return "email is not valid"
+    return None
+
+@dataclasses.dataclass
+class _SignupOutcome:
+    """Outcome of a signup, shared with concurrent duplicates."""
+    cmd: SignupCommand
+    result: Optional[SignupResult] = None
+    error: Optional[exception.AppException] = None
+
+    def share(self, cmd: SignupCommand) -> Optional["_SignupOutcome"]:
+        """Returns the outcome cmd would have had, None if it may differ."""
+        if cmd.email != self.cmd.email:
+            # Only equal after normalization, the emails are distinct users.
+            return None
+        if self.error is None:
+            if cmd == self.cmd:
+                return self
+            return _SignupOutcome(cmd, error=exception.AppException(
+                code=exception.ErrorCode.EMAIL_ALEADY_EXISTS,
+            ))
+        if self.error.code == exception.ErrorCode.EMAIL_ALEADY_EXISTS:
+            return self
+        # Like an id conflict, which another id wouldn't hit.
+        return None
 
 class User:
 
-    def __init__(self, sessionmaker: postgres.SessionMaker,
+    def __init__(self, dao: daos.User,
         hasher: password.PasswordHasher):
-        self._sessionmaker = sessionmaker
+        self._dao = dao
         self._hasher = hasher
+        self._signups = singleflight.Group()
+        # Verified in place of missing hashes, see _dummy_hash.
+        self._dummy = None
 
+    @metrics.timed(_SECONDS, "User.signup")
+    @profiling.traced("services.User.signup")
     async def signup(self,
         cmd: SignupCommand
         ) -> Coroutine[None, None, SignupResult]:
+        """Create a user.
+
+        Concurrent signups of the same email, like double clicks and
+        retries, wait for the first one and share its outcome rather than
+        each hashing the password only to conflict.
+        """
+        key = _normalize_email(cmd.email)
+        while True:
+            outcome, shared = await self._signups.do(
+                key, lambda: self._signup_outcome(cmd))
+            if shared:
+                outcome = outcome.share(cmd)
+                if outcome is None:
+                    continue
+                _COALESCED_SIGNUPS.inc()
+            if outcome.error:
+                raise outcome.error
+            return outcome.result
 
-        hash_password = self._hasher.hash(cmd.password)
+    async def _signup_outcome(self, cmd: SignupCommand) -> _SignupOutcome:
+        try:
+            return _SignupOutcome(cmd, result=await self._signup(cmd))
+        except exception.AppException as e:
+            return _SignupOutcome(cmd, error=e)
+
+    async def _signup(self, cmd: SignupCommand) -> SignupResult:
+        hash_password = await self._hasher.hash(cmd.password)
         now = dt.datetime.now()
         # TODO: send a verification mail? 2FA?
 
-        async with self._sessionmaker(postgres.IsolationLevel.REPEATABLE_READ) as session:
+        result = await self._dao.create_user(daos.CreateUserCommand(
+            id=cmd.id,
+            email=cmd.email,
+            username=cmd.username,
+            password=hash_password,
+            create_time=now,
+            update_time=now,
+        ))
 
-            insert_result = await session.insert_on_conflict_do_nothing(models.User(
-                id=cmd.id,
+        if result.conflict:
+            if cmd.email == result.user.email:
+                raise exception.AppException(
+                    code=exception.ErrorCode.EMAIL_ALEADY_EXISTS,
+                )
+            # User ID bumped from another email.
+            raise exception.AppException(
+                code=exception.ErrorCode.RESOURCE_ID_ALREADY_EXISTS,
+            )
+
+        user = result.user
+        return SignupResult(
+            id=user.id,
+            email=user.email,
+            username=user.username,
+            create_time=user.create_time,
+            update_time=user.update_time,
+        )
+
+    @metrics.timed(_SECONDS, "User.login")
+    @profiling.traced("services.User.login")
+    async def login(self,
+        cmd: LoginCommand
+        ) -> Coroutine[None, None, LoginResult]:
+
+        credential = await self._dao.get_credential(cmd.email)
+        # Unknown email and wrong password are reported the same way, and
+        # take as long, so responses don't tell which emails are registered.
+        if credential is None or\
+            credential.password == password.UNUSABLE_PASSWORD:
+            await self._hasher.verify(cmd.password, await self._dummy_hash())
+            raise exception.AppException(
+                code=exception.ErrorCode.AUTHENTICATION_FAIL,
+            )
+        if not await self._hasher.verify(cmd.password, credential.password):
+            raise exception.AppException(
+                code=exception.ErrorCode.AUTHENTICATION_FAIL,
+            )
+
+        result = LoginResult(
+            id=credential.id,
+            email=cmd.email,
+            username=credential.username,
+            create_time=credential.create_time,
+            update_time=credential.update_time,
+        )
+        # Hash parameters have changed since the user's password was stored.
+        # The caller runs the rehash once the response is sent.
+        if self._hasher.check_rehash(credential.password):
+            result.rehash = RehashCommand(
+                id=credential.id,
+                password=cmd.password,
+                old_hash=credential.password,
+            )
+        return result
+
+    async def _dummy_hash(self) -> str:
+        """Returns a hash of a random password with the current
+        parameters, made on first use."""
+        if self._dummy is None:
+            self._dummy = await self._hasher.hash(secrets.token_urlsafe(16))
+        return self._dummy
+
+    @metrics.timed(_SECONDS, "User.signin_external")
+    @profiling.traced("services.User.signin_external")
+    async def signin_external(self,
+        cmd: ExternalSigninCommand
+        ) -> Coroutine[None, None, ExternalSigninResult]:
+        """Returns the user of an email verified by an identity provider,
+        creating it on its first sign-in.
+
+        Created users have no usable password, they keep signing in with
+        the provider.
+        """
+        user = await self._dao.get_user_by_email(cmd.email)
+        created = False
+        if user is None:
+            now = dt.datetime.now()
+            result = await self._dao.create_user(daos.CreateUserCommand(
+                id=uuid.uuid4(),
                 email=cmd.email,
                 username=cmd.username,
-                password=hash_password,
+                password=password.UNUSABLE_PASSWORD,
                 create_time=now,
                 update_time=now,
             ))
+            # A conflict is a concurrent sign-in or signup of the email.
+            user = result.user
+            created = not result.conflict
 
-            if insert_result.rowcount == 0:
-                conflict_users = await session.select(
-                    select(models.User).where(or_(
-                        models.User.id == cmd.id,
-                        models.User.email == cmd.email,
-                        )))
-
-                conflict_user = conflict_users[0]
-                if cmd.email == conflict_user.email:
-                    raise exception.AppException(
-                        code=exception.ErrorCode.EMAIL_ALEADY_EXISTS,
-                    )
-                # User ID bumped from another email.
-                elif cmd.user.id == conflict_user.id:
-                    raise exception.AppException(
-                        code=exception.ErrorCode.RESOURCE_ID_ALREADY_EXISTS,
-                    )
-
-        return SignupResult(
-            id=cmd.id,
-            email=cmd.email,
-            username=cmd.username,
-            create_time=now,
-            update_time=now,
+        return ExternalSigninResult(
+            id=user.id,
+            email=user.email,
+            username=user.username,
+            created=created,
         )
 
-    #async def login(self,
-    #    cmd: LoginCommand
-    #    ) -> Coroutine[None, None, LoginResult]:
+    @metrics.timed(_SECONDS, "User.rehash_password")
+    @profiling.traced("services.User.rehash_password")
+    async def rehash_password(self, cmd: RehashCommand):
+        """Upgrade a stored hash to the current hash parameters.
+
+        It is best effort, the next login retries if this one fails.
+        """
+        try:
+            new_hash = await self._hasher.hash(cmd.password)
+        except exception.AppException as e:
+            logging.info("Skip rehash of user %s: %s", cmd.id, e.code.status)
+            return
+
+        updated = await self._dao.update_password(
+            cmd.id, cmd.old_hash, new_hash, dt.datetime.now())
+        if not updated:
+            logging.info("Skip rehash of user %s: password has changed.", cmd.id)
+
+    @metrics.timed(_SECONDS, "User.import_users")
+    async def import_users(self,
+        cmds: Iterable[ImportUserCommand],
+        executor: futures.Executor,
+        batch_size: int = 1000,
+        ) -> Coroutine[None, None, ImportResult]:
+        """Create users in bulk, e.g. when migrating from other systems.
+
+        Passwords of a batch are hashed on executor while the previous
+        batch is being written, so hashing and loading overlap. Users
+        failing validation are reported rather than loaded, so one bad
+        row does not abort the import.
+
+        Args:
+          cmds: Users to import, consumed lazily.
+          executor: Where to hash passwords, a process pool for best speed.
+          batch_size: Number of users per transaction.
+        Returns:
+          Number of imported users, the conflicting and the invalid ones.
+        """
+        result = ImportResult()
+        writing = None
+        it = iter(cmds)
+        try:
+            while True:
+                batch = list(itertools.islice(it, batch_size))
+                if not batch:
+                    break
+                batch = self._validate_batch(batch, result)
+                if not batch:
+                    continue
+                hashes = await self._hasher.hash_many(
+                    [cmd.password for cmd in batch], executor)
+                if writing:
+                    await writing
+                writing = asyncio.ensure_future(
+                    self._import_batch(batch, hashes, result))
+            if writing:
+                await writing
+        finally:
+            if writing and not writing.done():
+                writing.cancel()
+        return result
 
+    @staticmethod
+    def _validate_batch(batch: List[ImportUserCommand],
+        result: ImportResult) -> List[ImportUserCommand]:
+        """Returns the valid users of batch, with ids in canonical form, and
+        adds the others to result."""
+        valid = []
+        for cmd in batch:
+            reason = _validate_import(cmd)
+            if reason:
+                logging.warning("Skipped invalid user %s: %s.", cmd.id, reason)
+                result.invalid.append(cmd)
+            else:
+                # Created ids are compared in canonical form.
+                valid.append(dataclasses.replace(cmd,
+                    id=str(uuid.UUID(str(cmd.id)))))
+        return valid
+
+    async def _import_batch(self, batch: List[ImportUserCommand],
+        hashes: List[str], result: ImportResult):
+        now = dt.datetime.now()
+        created = await self._dao.import_users([
+            daos.CreateUserCommand(
+                id=cmd.id,
+                email=cmd.email,
+                username=cmd.username,
+                password=hash_password,
+                create_time=now,
+                update_time=now,
+            ) for cmd, hash_password in zip(batch, hashes)])
 
+        created = {str(id) for id in created}
+        for cmd in batch:
+            if str(cmd.id) in created:
+                # Ids repeated in the batch are only created once.
+                created.discard(str(cmd.id))
+                result.imported += 1
+            else:
+                result.conflicts.append(cmd)
+        logging.info("Imported %d users, %d conflicts so far.",
+            result.imported, len(result.conflicts))
@@ -1,7 +1,76 @@
 """Define helper for test."""
 import datetime as dt
+import http.server
+import json
+import os
+import threading
+import time
+from typing import (
+    Any,
+    Dict,
+)
+from unittest import mock
 import httpx
+from cryptography import x509
+from cryptography.hazmat.primitives import (
+    hashes,
+    serialization,
+)
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import (
+    crypt,
+    jwt,
+)
 import basic_app
+from basic_app.lib import config
+
+# Variables Config requires, valued as in .env.
+REQUIRED_ENV = {
+    "POSTGRES_USER": "dev",
+    "POSTGRES_PASSWD": "password",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_DB": "postgres",
+    "APP_HOST": "localhost",
+    "APP_PORT": "8080",
+    "APP_GOOGLE_CLIENT_ID": "fake_client_id",
+}
+
+# Small pools and cheap password hashing, so tests stay fast.
+TEST_ENV = dict(REQUIRED_ENV,
+    POSTGRES_POOL_SIZE="3",
+    POSTGRES_MAX_OVERFLOW="2",
+    POSTGRES_POOL_TIMEOUT="1",
+    POSTGRES_REPLICA_CHECK_INTERVAL="60",
+    ARGON2_MEMORY_COST="1024",
+    ARGON2_TIME_COST="1",
+    ARGON2_HASH_LEN="16",
+    SCRYPT_LN="10",
+    BCRYPT_ROUNDS="4",
+    PASSWORD_HASHER_POOL_SIZE="2",
+    PASSWORD_HASHER_QUEUE_DEPTH="4",
+    PASSWORD_HASHER_MEMORY_BUDGET="65536",
+)
+
+def get_config(environ: Dict[str, str] = None, **overrides) -> config.Config:
+    """Get a Config read from environ, with overrides set on it.
+
+    Args:
+      environ: The only variables Config reads, TEST_ENV by default, so
+        tests don't depend on the environment they run in.
+      overrides: Config attributes to replace, they must exist.
+    Returns:
+      Config object.
+    """
+    with mock.patch.dict(os.environ, TEST_ENV if environ is None else environ,
+        clear=True):
+        conf = config.Config(envfile="")
+    for key, value in overrides.items():
+        if not hasattr(conf, key):
+            raise AttributeError("Config has no attribute \"{}\".".format(key))
+        setattr(conf, key, value)
+    return conf
 
 def get_http_client() -> httpx.AsyncClient:
     """Get an async http client for sending request.
@@ -17,3 +86,84 @@ def get_http_client() -> httpx.AsyncClient:
 
 def parse_datetime(time: str) -> dt.datetime:
     return dt.datetime.strptime(time, '%Y-%m-%dT%H:%M:%S.%f')
+
+class GoogleCertsServer:
+    """Serve Google-style signing certs on localhost.
+
+    It stands in for https://www.googleapis.com/oauth2/v1/certs, and signs
+    ID tokens with the matching private key.
+    """
+    def __init__(self, max_age: int = 3600, key_id: str = "test-key"):
+        """
+        Args:
+          max_age: max-age of Cache-Control in responses.
+          key_id: The kid of the served cert.
+        """
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "test")])
+        now = dt.datetime.utcnow()
+        cert = x509.CertificateBuilder().\
+            subject_name(name).\
+            issuer_name(name).\
+            public_key(key.public_key()).\
+            serial_number(x509.random_serial_number()).\
+            not_valid_before(now - dt.timedelta(days=1)).\
+            not_valid_after(now + dt.timedelta(days=1)).\
+            sign(key, hashes.SHA256())
+
+        self.key_id = key_id
+        self.requests = 0
+        self._signer = crypt.RSASigner.from_string(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ), key_id)
+        body = json.dumps({
+            key_id: cert.public_bytes(serialization.Encoding.PEM).decode(),
+        }).encode()
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self): # pylint: disable=invalid-name
+                server.requests += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control",
+                    "public, max-age={}".format(max_age))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+            daemon=True)
+
+    @property
+    def url(self) -> str:
+        return "http://127.0.0.1:{}/certs".format(self._server.server_port)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def sign(self, client_id: str, **claims) -> str:
+        """Returns an ID token for client_id, claims override defaults."""
+        now = int(time.time())
+        payload: Dict[str, Any] = {
+            "iss": "https://accounts.google.com",
+            "aud": client_id,
+            "sub": "1234567890",
+            "email": "user1@example.com",
+            "email_verified": True,
+            "iat": now,
+            "exp": now + 3600,
+        }
+        payload.update(claims)
+        return jwt.encode(self._signer, payload).decode()
@@ -0,0 +1,84 @@
+"""Test file for basic_app.lib.batch"""
+import asyncio
+import pytest
+from basic_app.lib import batch
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_batcher_gathers_concurrent_items():
+    # Given a batcher of at most 3 items, failing odd ones.
+    batches = []
+    async def handle(items):
+        batches.append(items)
+        return [ValueError(i) if i % 2 else i * 10 for i in items]
+    batcher = batch.Batcher("test", handle, window=0.01, max_size=3)
+
+    # When I submit 4 items concurrently
+    results = await asyncio.gather(*(batcher.submit(i) for i in range(4)),
+        return_exceptions=True)
+
+    # Then the first 3 should be handled together, and the last one alone
+    # once the window closes.
+    assert batches == [[0, 1, 2], [3]], f"Got unexpected batches {batches}"
+
+    # And each caller should get its own result.
+    assert results[0] == 0 and results[2] == 20,\
+        f"Got unexpected results {results}"
+    assert isinstance(results[1], ValueError) and\
+        isinstance(results[3], ValueError), f"Got unexpected results {results}"
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_batcher_failed_batch():
+    # Given a batcher whose handler fails.
+    async def handle(items):
+        raise RuntimeError("down")
+    batcher = batch.Batcher("test", handle, window=0.01, max_size=8)
+
+    # When I submit 2 items concurrently
+    results = await asyncio.gather(batcher.submit(1), batcher.submit(2),
+        return_exceptions=True)
+
+    # Then both callers should get the error.
+    assert all(isinstance(r, RuntimeError) for r in results),\
+        f"Got unexpected results {results}"
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_batcher_close_flushes():
+    # Given an item gathered in a long window.
+    batches = []
+    async def handle(items):
+        batches.append(items)
+        return items
+    batcher = batch.Batcher("test", handle, window=60, max_size=8)
+    submitted = asyncio.ensure_future(batcher.submit(1))
+    await asyncio.sleep(0)
+
+    # When I close the batcher
+    await asyncio.wait_for(batcher.close(), timeout=1)
+
+    # Then the item should be handled without waiting for the window.
+    assert batches == [[1]], f"Got unexpected batches {batches}"
+    assert submitted.result() == 1,\
+        f"Got unexpected result {submitted.result()}"
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_batcher_cancelled_batch():
+    # Given a batch being handled.
+    started = asyncio.Event()
+    async def handle(items):
+        started.set()
+        await asyncio.sleep(60)
+    batcher = batch.Batcher("test", handle, window=0, max_size=1)
+    submitted = asyncio.ensure_future(batcher.submit(1))
+    await started.wait()
+
+    # When the batch is cancelled
+    for task in list(batcher._running): # pylint: disable=protected-access
+        task.cancel()
+
+    # Then its caller should be cancelled rather than wait for ever.
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(submitted, timeout=1)
@@ -0,0 +1,91 @@
+"""Test cache."""
+import asyncio
+import pytest
+from basic_app.lib import cache
+
+@pytest.mark.small
+def test_lru_cache_evict():
+    # Given a cache of 2 entries.
+    lru = cache.LRUCache(max_size=2, ttl=60)
+    lru.set('a', 1)
+    lru.set('b', 2)
+
+    # When I use 'a' and add a third entry.
+    lru.get('a')
+    lru.set('c', 3)
+
+    # Then the least recently used 'b' should be evicted.
+    assert lru.get('b') is cache.MISSING, "'b' should be evicted."
+    assert lru.get('a') == 1, "'a' should be kept."
+    assert lru.evictions == 1, f"Got unexpected evictions {lru.evictions}"
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_cache_negative(monkeypatch):
+    # Given a cache keeping absent keys for 5 seconds.
+    now = 1000.0
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now)
+    c = cache.Cache(cache.LRUCache(max_size=10, ttl=60), negative_ttl=5)
+    loads = 0
+    async def load():
+        nonlocal loads
+        loads += 1
+        return None
+
+    # When I look up an absent key twice.
+    assert await c.get_or_load('a', load) is None
+    assert await c.get_or_load('a', load) is None
+
+    # Then it should be loaded once.
+    assert loads == 1, f"Got unexpected loads {loads}"
+    stats = c.stats()
+    assert stats.negative_hits == 1 and stats.hit_ratio == 0.5,\
+        f"Got unexpected stats {stats}"
+
+    # And loaded again once expired.
+    now += 5
+    await c.get_or_load('a', load)
+    assert loads == 2, "Absent key should expire after negative TTL."
+
+    # And loaded again once invalidated.
+    await c.delete('a')
+    await c.get_or_load('a', load)
+    assert loads == 3, "Absent key should be loaded after invalidation."
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_cache_skips_load_racing_delete():
+    # Given a load in flight.
+    c = cache.Cache(cache.LRUCache(max_size=10, ttl=60), negative_ttl=60)
+    release = asyncio.Event()
+    async def load():
+        await release.wait()
+        return None
+    loading = asyncio.ensure_future(c.get_or_load('a', load))
+    await asyncio.sleep(0)
+
+    # When the key is invalidated before the load returns
+    await c.delete('a')
+    release.set()
+    assert await loading is None
+
+    # Then the loaded value should not be cached.
+    assert await c.get('a') is cache.MISSING, "Raced load should not be cached."
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_cache_set_fenced_by_generation():
+    # Given I take the generation before loading a value.
+    c = cache.Cache(cache.LRUCache(max_size=10, ttl=60))
+    generation = c.generation
+
+    # When a key is invalidated meanwhile
+    await c.delete('b')
+    await c.set('a', 'value', generation)
+
+    # Then the value should not be cached.
+    assert await c.get('a') is cache.MISSING, "Fenced set should be skipped."
+
+    # And it should be with a current generation.
+    await c.set('a', 'value', c.generation)
+    assert await c.get('a') == 'value', "Current set should be cached."
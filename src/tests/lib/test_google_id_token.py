@@ -0,0 +1,103 @@
+"""Test file for basic_app.lib.google_id_token"""
+import pytest
+from basic_app.lib import (
+    exception,
+    google_id_token,
+)
+from tests import helper
+
+CLIENT_ID = "test-client-id"
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_verify_caches_certs():
+    with helper.GoogleCertsServer() as server:
+        # Given I have a verifier using the local certs endpoint
+        verifier = google_id_token.GoogleIdTokenVerifier(
+            CLIENT_ID, certs_url=server.url)
+
+        # When I verify tokens several times
+        for _ in range(3):
+            claims = await verifier.verify(server.sign(CLIENT_ID))
+
+        # Then I should get the claims
+        assert claims["sub"] == "1234567890",\
+            f"Got unexpected sub \"{claims['sub']}\""
+
+        # And certs should only be fetched once
+        assert server.requests == 1,\
+            f"Expect certs fetched once, but got {server.requests}"
+
+        # Cleanup
+        await verifier.close()
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_verify_wrong_audience():
+    with helper.GoogleCertsServer() as server:
+        # Given I have a verifier using the local certs endpoint
+        verifier = google_id_token.GoogleIdTokenVerifier(
+            CLIENT_ID, certs_url=server.url)
+
+        # When I verify a token issued to another client
+        # Then I should get an error
+        with pytest.raises(ValueError):
+            await verifier.verify(server.sign("another-client-id"))
+
+        # Cleanup
+        await verifier.close()
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_verify_refetch_after_max_age():
+    with helper.GoogleCertsServer(max_age=0) as server:
+        # Given certs expire right away
+        verifier = google_id_token.GoogleIdTokenVerifier(
+            CLIENT_ID, certs_url=server.url, min_refresh_interval=0)
+
+        # When I verify tokens twice
+        await verifier.verify(server.sign(CLIENT_ID))
+        await verifier.verify(server.sign(CLIENT_ID))
+
+        # Then certs should be fetched again
+        assert server.requests == 2,\
+            f"Expect certs fetched twice, but got {server.requests}"
+
+        # Cleanup
+        await verifier.close()
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_verify_certs_unavailable_on_cold_start():
+    with helper.GoogleCertsServer() as server:
+        certs_url = server.url
+    # Given the certs endpoint is down before any certs were fetched
+    verifier = google_id_token.GoogleIdTokenVerifier(
+        CLIENT_ID, certs_url=certs_url, fetch_timeout=1)
+
+    # When I verify a token
+    # Then I should get a server error rather than a raw HTTP error
+    with pytest.raises(exception.AppException) as info:
+        await verifier.verify("a.b.c")
+    assert info.value.code == exception.ErrorCode.UPSTREAM_UNAVAILABLE,\
+        f"Got unexpected error code \"{info.value.code}\""
+
+    # Cleanup
+    await verifier.close()
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_verify_malformed_token():
+    with helper.GoogleCertsServer() as server:
+        # Given I have a verifier using the local certs endpoint
+        verifier = google_id_token.GoogleIdTokenVerifier(
+            CLIENT_ID, certs_url=server.url)
+
+        # When I verify tokens which are not JWTs
+        # Then I should get a ValueError for each
+        for token in ("not-a-token", "a.b.c", "W10.e30.", "e30.W10."):
+            with pytest.raises(ValueError):
+                await verifier.verify(token)
+
+        # Cleanup
+        await verifier.close()
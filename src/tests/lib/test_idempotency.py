@@ -0,0 +1,146 @@
+"""Test idempotency keys."""
+import asyncio
+import pytest
+from fastapi import responses
+from basic_app.lib import (
+    exception,
+    idempotency,
+)
+from tests import helper
+
+def get_idempotency() -> idempotency.Idempotency:
+    return idempotency.Idempotency(
+        idempotency.InMemoryIdempotencyStore(ttl=60, max_size=10),
+        wait_timeout=1)
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_coalesce_and_replay():
+    # Given a handler that takes a while.
+    idem = get_idempotency()
+    calls = 0
+    async def execute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return responses.JSONResponse({'id': 'user1'})
+
+    # When 3 requests with the same key run concurrently, and one more after.
+    fp = idempotency.fingerprint('user1')
+    outs = await asyncio.gather(*(
+        idem.run('signup', 'key1', fp, execute) for _ in range(3)))
+    outs.append(await idem.run('signup', 'key1', fp, execute))
+
+    # Then the handler should run once.
+    assert calls == 1, f"Handler should run once, got {calls} calls."
+
+    # And every request should get its response, replays marked so.
+    for out in outs:
+        assert out.body == b'{"id":"user1"}',\
+            f"Got unexpected body {out.body}"
+    replayed = [out.headers.get(idempotency.REPLAYED_HEADER) for out in outs]
+    assert replayed == [None, 'true', 'true', 'true'],\
+        f"Got unexpected replayed headers {replayed}"
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_replay_error():
+    # Given a request with a key failed with a client error.
+    idem = get_idempotency()
+    calls = 0
+    async def execute():
+        nonlocal calls
+        calls += 1
+        raise exception.AppException(
+            code=exception.ErrorCode.EMAIL_ALEADY_EXISTS)
+    fp = idempotency.fingerprint('user1')
+    with pytest.raises(exception.AppException):
+        await idem.run('signup', 'key1', fp, execute)
+
+    # When it is retried
+    # Then it should get the same error without running again.
+    with pytest.raises(exception.AppException) as info:
+        await idem.run('signup', 'key1', fp, execute)
+    assert info.value.code == exception.ErrorCode.EMAIL_ALEADY_EXISTS,\
+        f"Got unexpected error code \"{info.value.code}\""
+    assert calls == 1, f"Handler should run once, got {calls} calls."
+
+    # When the key is reused for another request
+    # Then it should be rejected.
+    with pytest.raises(exception.AppException) as info:
+        await idem.run('signup', 'key1', idempotency.fingerprint('user2'),
+            execute)
+    assert info.value.code == exception.ErrorCode.IDEMPOTENCY_KEY_REUSED,\
+        f"Got unexpected error code \"{info.value.code}\""
+
+@pytest.mark.small
+def test_claim_ttl_outlives_slowest_request():
+    # Given a claim TTL shorter than a request may take
+    conf = helper.get_config(
+        idempotency_claim_ttl=5,
+        idempotency_wait_timeout=10.0,
+        password_hasher_queue_timeout=2.0,
+        password_hasher_target_ms=500.0,
+        postgres_statement_timeout=30000,
+    )
+
+    # When I get the claim TTL
+    # Then it should cover the waits, the hash and the statement timeout
+    ttl = idempotency.claim_ttl(conf)
+    assert ttl == 43, f"Expect claim TTL 43, but got {ttl}"
+
+    # And a longer configured TTL should be kept.
+    conf.idempotency_claim_ttl = 60
+    ttl = idempotency.claim_ttl(conf)
+    assert ttl == 60, f"Expect claim TTL 60, but got {ttl}"
+
+@pytest.mark.small
+def test_claim_ttl_required_without_statement_timeout():
+    # Given statements without a timeout and no claim TTL
+    conf = helper.get_config(
+        idempotency_claim_ttl=0,
+        idempotency_wait_timeout=10.0,
+        password_hasher_queue_timeout=2.0,
+        password_hasher_target_ms=500.0,
+        postgres_statement_timeout=0,
+    )
+
+    # When I get the claim TTL
+    # Then it should refuse, no TTL is known to outlive a request.
+    with pytest.raises(ValueError):
+        idempotency.claim_ttl(conf)
+
+class ReleasedClaimStore(idempotency.InMemoryIdempotencyStore):
+    """Key claimed by another process, which releases it without an
+    outcome after a few polls."""
+    def __init__(self, held_claims: int):
+        super().__init__(ttl=60, max_size=10)
+        self.held_claims = held_claims
+
+    async def claim(self, key: str) -> bool:
+        self.held_claims -= 1
+        return self.held_claims < 0
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_run_after_claim_released():
+    # Given a key claimed by another process, which gives up without an
+    # outcome
+    idem = idempotency.Idempotency(ReleasedClaimStore(held_claims=3),
+        wait_timeout=10, poll_interval=0.01)
+    calls = 0
+    async def execute():
+        nonlocal calls
+        calls += 1
+        return responses.JSONResponse({"id": "1"})
+
+    # When a duplicate waits for it
+    resp = await asyncio.wait_for(
+        idem.run('signup', 'key1', idempotency.fingerprint('user1'), execute),
+        timeout=1)
+
+    # Then it should run the handler once the claim is released, not wait
+    # out the timeout.
+    assert calls == 1, f"Handler should run once, got {calls} calls."
+    assert resp.status_code == 200,\
+        f"Got unexpected status code {resp.status_code}"
@@ -0,0 +1,59 @@
+"""Test file for basic_app.lib.lifecycle"""
+import asyncio
+import pytest
+from basic_app.lib import lifecycle
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_startup_and_shutdown():
+    # Given a lifecycle with a failing and a slow warm-up step.
+    calls = []
+    app_lifecycle = lifecycle.Lifecycle(warmup_timeout=0.05, check_timeout=1)
+    async def fail():
+        raise RuntimeError("down")
+    async def call(name):
+        calls.append(name)
+    app_lifecycle.on_startup("failing", fail)
+    app_lifecycle.on_startup("slow", lambda: asyncio.sleep(1))
+    app_lifecycle.on_startup("ok", lambda: call("warm-up"))
+    app_lifecycle.on_shutdown("first", lambda: call("first"))
+    app_lifecycle.on_shutdown("second", lambda: call("second"))
+
+    # When it starts up
+    await app_lifecycle.startup()
+
+    # Then it should be warm regardless of the failing and slow steps,
+    # which are timed too.
+    assert app_lifecycle.warm, "Should be warm after startup"
+    assert calls == ["warm-up"], f"Got unexpected calls {calls}"
+    seconds = app_lifecycle.warmup_seconds
+    assert set(seconds) == {"failing", "slow", "ok"} and seconds["slow"] < 1,\
+        f"Got unexpected warm-up seconds {seconds}"
+
+    # And shutdown hooks should run in reverse.
+    await app_lifecycle.shutdown()
+    assert calls == ["warm-up", "second", "first"], f"Got unexpected calls {calls}"
+    assert not app_lifecycle.warm, "Should not be warm once shutting down"
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_check():
+    # Given checks passing, failing and hanging.
+    app_lifecycle = lifecycle.Lifecycle(warmup_timeout=1, check_timeout=0.05)
+    async def ok():
+        pass
+    async def fail():
+        raise ConnectionError("refused")
+    app_lifecycle.add_check("ok", ok)
+    app_lifecycle.add_check("failing", fail)
+    app_lifecycle.add_check("hanging", lambda: asyncio.sleep(1))
+
+    # When I check them
+    results = await app_lifecycle.check()
+
+    # Then each should get its result.
+    assert results == {
+        "ok": "ok",
+        "failing": "ConnectionError: refused",
+        "hanging": "timed out",
+    }, f"Got unexpected results {results}"
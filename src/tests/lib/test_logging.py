@@ -1,5 +1,8 @@
 """Test file for basic_app.lib.logging"""
+import json
 import logging
+import queue
+import pytest
 import basic_app.lib.logging as lg
 
 def test_get_logging_level():
@@ -17,3 +20,30 @@ def test_get_logging_level_default_level():
 
     # Then
     assert level == logging.INFO, f"Got unexpected log level \"{level}\""
+
+@pytest.mark.small
+def test_queue_handler_drop():
+    # Given a queue handler on a queue of 1 record.
+    records = queue.Queue(1)
+    handler = lg.DroppingQueueHandler(records)
+    logger = logging.getLogger('test_queue_handler_drop')
+    logger.propagate = False
+    logger.addHandler(handler)
+    # pylint: disable=protected-access
+    dropped = lg._DROPPED.labels().value
+
+    # When I log 2 records without a listener.
+    logger.warning('hello %s', 'world', extra={'user_id': 'user1'})
+    logger.warning('dropped')
+
+    # Then the second one should be dropped and counted.
+    assert records.qsize() == 1, f"Got unexpected queue size {records.qsize()}"
+    assert lg._DROPPED.labels().value == dropped + 1,\
+        "Dropped record should be counted."
+
+    # And the queued one should be formatted to JSON by the listener.
+    out = json.loads(lg.JsonFormatter().format(records.get()))
+    assert out['message'] == 'hello world',\
+        f"Got unexpected message \"{out['message']}\""
+    assert out['user_id'] == 'user1',\
+        f"Got unexpected user_id \"{out.get('user_id')}\""
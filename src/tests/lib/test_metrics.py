@@ -0,0 +1,57 @@
+"""Test metrics."""
+import pytest
+from basic_app.lib import metrics
+
+@pytest.mark.small
+def test_histogram_render():
+    # Given a histogram with 2 buckets.
+    registry = metrics.Registry()
+    histogram = registry.histogram('latency_seconds', 'Latency.',
+        ('route',), buckets=(0.1, 1.0))
+
+    # When I observe 3 values.
+    for value in (0.05, 0.5, 5.0):
+        histogram.labels('/signup').observe(value)
+
+    # Then buckets should be rendered cumulatively.
+    out = registry.render()
+    for line in (
+        'latency_seconds_bucket{route="/signup",le="0.1"} 1',
+        'latency_seconds_bucket{route="/signup",le="1.0"} 2',
+        'latency_seconds_bucket{route="/signup",le="+Inf"} 3',
+        'latency_seconds_count{route="/signup"} 3',
+    ):
+        assert line in out, f"\"{line}\" should be rendered in:\n{out}"
+
+@pytest.mark.small
+def test_label_values_escaped():
+    # Given a counter labeled with a backslash, a quote and a newline.
+    registry = metrics.Registry()
+    counter = registry.counter('errors_total', 'Errors.', ('message',))
+
+    # When I render it.
+    counter.labels('a\\b"c\nd').inc()
+    out = registry.render()
+
+    # Then they should be escaped.
+    line = 'errors_total{message="a\\\\b\\"c\\nd"} 1'
+    assert line in out, f"\"{line}\" should be rendered in:\n{out}"
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_middleware_other_methods():
+    # Given an app observed by the middleware.
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 405})
+    middleware = metrics.Middleware(app)
+
+    # When I send a request with a made up method.
+    async def send(message):
+        pass
+    await middleware({'type': 'http', 'method': 'BREW'}, None, send)
+
+    # Then it should be labeled as other.
+    out = metrics.REGISTRY.render()
+    assert 'method="other",route="unmatched",status="405"' in out,\
+        f"Request should be labeled as other in:\n{out}"
+    assert 'BREW' not in out, f"Method should not be rendered in:\n{out}"
@@ -0,0 +1,225 @@
+"""Test file for basic_app.lib.password"""
+import asyncio
+import threading
+import pytest
+from basic_app.lib import (
+    exception,
+    password,
+)
+from tests import helper
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_argon2_hash_and_verify():
+    # Given I have an argon2 password hasher
+    scheduler = password.HashScheduler(helper.get_config())
+    hasher = password.Argon2PasswordHasher(helper.get_config(), scheduler)
+
+    # When I hash a password in the hashing pool
+    hashed = await hasher.hash("password1")
+
+    # Then I should be able to verify it
+    assert hashed != "password1", "Password should not be stored as is."
+    assert await hasher.verify("password1", hashed),\
+        "Hashed password should be verified."
+
+    # Cleanup
+    scheduler.close()
+
+@pytest.mark.small
+def test_scheduler_limit_by_memory_budget():
+    # Given the memory budget only fits 3 concurrent hashes
+    conf = helper.get_config(password_hasher_pool_size=8,
+        password_hasher_memory_budget=3 * 1024)
+
+    # When I create a scheduler
+    scheduler = password.HashScheduler(conf)
+
+    # Then concurrency should be capped by memory
+    limit = scheduler.stats().limit
+    assert limit == 3, f"Expect limit 3, but got {limit}"
+
+    # Cleanup
+    scheduler.close()
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_scheduler_reject_when_queue_full():
+    # Given a scheduler with one slot and one queue entry
+    scheduler = password.HashScheduler(helper.get_config(
+        password_hasher_pool_size=1, password_hasher_queue_depth=1))
+    event = threading.Event()
+
+    # When I submit more jobs than it can hold
+    running = asyncio.ensure_future(scheduler.run(event.wait))
+    queued = asyncio.ensure_future(scheduler.run(event.wait))
+    await asyncio.sleep(0)
+
+    # Then the extra job should be rejected right away
+    with pytest.raises(exception.AppException) as info:
+        await scheduler.run(event.wait)
+    assert info.value.code == exception.ErrorCode.SERVER_BUSY,\
+        f"Got unexpected error code \"{info.value.code}\""
+
+    stats = scheduler.stats()
+    assert stats.queue_depth == 1, f"Got unexpected queue depth {stats.queue_depth}"
+    assert stats.rejected == 1, f"Got unexpected rejected count {stats.rejected}"
+
+    # And queued jobs should still complete
+    event.set()
+    await asyncio.gather(running, queued)
+    stats = scheduler.stats()
+    assert stats.running == 0, f"Got unexpected running count {stats.running}"
+    assert stats.admitted == 2, f"Got unexpected admitted count {stats.admitted}"
+
+    # Cleanup
+    scheduler.close()
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_scheduler_reject_after_queue_timeout():
+    # Given a busy scheduler with a short queue timeout
+    scheduler = password.HashScheduler(helper.get_config(
+        password_hasher_pool_size=1, password_hasher_queue_timeout=0.01))
+    event = threading.Event()
+    running = asyncio.ensure_future(scheduler.run(event.wait))
+    await asyncio.sleep(0)
+
+    # When a queued job waits longer than the timeout
+    # Then it should be rejected
+    with pytest.raises(exception.AppException):
+        await scheduler.run(event.wait)
+
+    stats = scheduler.stats()
+    assert stats.timed_out == 1, f"Got unexpected timed out count {stats.timed_out}"
+    assert stats.queue_depth == 0, f"Got unexpected queue depth {stats.queue_depth}"
+
+    # Cleanup
+    event.set()
+    await running
+    scheduler.close()
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_scheduler_limit_by_memory_of_each_job():
+    # Given a bcrypt scheduler whose budget fits two 1 MiB hashes
+    scheduler = password.HashScheduler(helper.get_config(
+        password_hasher_backend="bcrypt", password_hasher_pool_size=4,
+        password_hasher_memory_budget=2048))
+    event = threading.Event()
+
+    # When I submit three 1 MiB jobs, and a bcrypt one behind them
+    jobs = [asyncio.ensure_future(scheduler.run(event.wait, memory_kib=1024))
+        for _ in range(3)]
+    jobs.append(asyncio.ensure_future(scheduler.run(event.wait)))
+    await asyncio.sleep(0)
+
+    # Then only two should run, the others should wait in order
+    stats = scheduler.stats()
+    assert stats.running == 2, f"Got unexpected running count {stats.running}"
+    assert stats.memory_kib == 2048, f"Got unexpected memory {stats.memory_kib}"
+    assert stats.queue_depth == 2, f"Got unexpected queue depth {stats.queue_depth}"
+
+    # And every job should complete
+    event.set()
+    await asyncio.gather(*jobs)
+    stats = scheduler.stats()
+    assert stats.memory_kib == 0, f"Got unexpected memory {stats.memory_kib}"
+    assert stats.admitted == 4, f"Got unexpected admitted count {stats.admitted}"
+
+    # Cleanup
+    scheduler.close()
+
+class RecordingScheduler(password.HashScheduler):
+    def __init__(self, conf):
+        super().__init__(conf)
+        self.memory = []
+
+    async def run(self, func, *args, memory_kib=None):
+        self.memory.append(memory_kib)
+        return await super().run(func, *args, memory_kib=memory_kib)
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_verify_weighs_scheme_of_hash():
+    # Given an argon2 hash, verified after switching to bcrypt
+    argon2_conf = helper.get_config(argon2_memory_cost=2048)
+    scheduler = RecordingScheduler(argon2_conf)
+    argon2_hash = await password.create_hasher(argon2_conf, scheduler).\
+        hash("password1")
+    hasher = password.create_hasher(
+        helper.get_config(password_hasher_backend="bcrypt"), scheduler)
+
+    # When I verify it, then hash a new one
+    assert await hasher.verify("password1", argon2_hash),\
+        "Argon2 hash should be verified."
+    await hasher.hash("password1")
+
+    # Then the verify should take the memory of the argon2 hash
+    assert scheduler.memory == [2048, 2048, 4],\
+        f"Got unexpected memory {scheduler.memory}"
+
+    # Cleanup
+    scheduler.close()
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_verify_hash_of_previous_backend():
+    # Given a password hashed by argon2, before switching to scrypt
+    scheduler = password.HashScheduler(helper.get_config())
+    argon2_hash = await password.create_hasher(helper.get_config(), scheduler).\
+        hash("password1")
+    hasher = password.create_hasher(
+        helper.get_config(password_hasher_backend="scrypt"), scheduler)
+
+    # When I verify it with the scrypt hasher
+    # Then it should be verified by argon2
+    assert await hasher.verify("password1", argon2_hash),\
+        "Argon2 hash should be verified after switching backends."
+    assert not await hasher.verify("password2", argon2_hash),\
+        "Wrong password should not be verified."
+
+    # And it should be rehashed into scrypt.
+    assert hasher.check_rehash(argon2_hash), "Argon2 hash should be rehashed."
+    scrypt_hash = await hasher.hash("password1")
+    assert scrypt_hash.startswith("$scrypt$"),\
+        f"Got unexpected hash {scrypt_hash}"
+    assert not hasher.check_rehash(scrypt_hash),\
+        "Hash of the current backend should not be rehashed."
+    assert await hasher.verify("password1", scrypt_hash),\
+        "Scrypt hash should be verified."
+
+    # Cleanup
+    scheduler.close()
+
+@pytest.mark.small
+def test_calibrate_within_memory_budget():
+    # Given each hash may take 1 MiB of the memory budget
+    conf = helper.get_config(password_hasher_backend="scrypt",
+        password_hasher_pool_size=4, password_hasher_memory_budget=4096)
+
+    # When I calibrate for a generous target
+    params = password.calibrate(conf, target_ms=1000)
+
+    # Then the largest N fitting the memory should be picked.
+    assert params == {"scrypt_ln": 10}, f"Got unexpected parameters {params}"
+
+@pytest.mark.small
+def test_scrypt_weaker_only_rehash_compares_p():
+    # Given a calibrated scrypt hasher with p=2
+    conf = helper.get_config(password_hasher_backend="scrypt",
+        password_hasher_calibrate=True, scrypt_p=2)
+    scheduler = password.HashScheduler(conf)
+    hasher = password.create_hasher(conf, scheduler)
+
+    # When I check hashes with a lower and a higher p
+    weaker = "$scrypt$ln=10,r=8,p=1$c2FsdA$a2V5"
+    stronger = "$scrypt$ln=10,r=8,p=4$c2FsdA$a2V5"
+
+    # Then only the lower p should be rehashed
+    assert hasher.check_rehash(weaker), "Lower p should be rehashed."
+    assert not hasher.check_rehash(stronger),\
+        "Higher p should not be rehashed."
+
+    # Cleanup
+    scheduler.close()
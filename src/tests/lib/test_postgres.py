@@ -0,0 +1,279 @@
+"""Test file for basic_app.lib.postgres"""
+import asyncio
+import asyncpg
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.util import greenlet_spawn
+from basic_app import models
+from basic_app.lib import postgres
+from tests import helper
+
+@pytest.mark.small
+def test_create_sessionmaker_pool_from_config():
+    # Given I configure the pool size
+    conf = helper.get_config(postgres_pool_size=7)
+
+    # When I create a sessionmaker
+    sessionmaker = postgres.create_sessionmaker(conf)
+
+    # Then the pool should be sized and idle
+    stats = sessionmaker.pool_stats()
+    assert stats.size == 7, f"Expect pool size 7, but got {stats.size}"
+    assert stats.checked_out == 0,\
+        f"Expect no checked out connection, but got {stats.checked_out}"
+    assert stats.waiters == 0, f"Expect no waiter, but got {stats.waiters}"
+
+class StubConnection:
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_pool_counts_waiters_of_exhausted_pool():
+    # Given a pool of one connection
+    waiters = []
+    def connect():
+        waiters.append(pool.waiters)
+        return StubConnection()
+    pool = postgres._InstrumentedPool(connect, pool_size=1, max_overflow=0,
+        timeout=5)
+
+    # When I check out the connection, and another one after it
+    first = await greenlet_spawn(pool.connect)
+    second = asyncio.ensure_future(greenlet_spawn(pool.connect))
+    await asyncio.sleep(0.01)
+
+    # Then only the checkout of the exhausted pool should wait
+    assert waiters == [0], f"Expect no waiter to connect, but got {waiters}"
+    assert pool.waiters == 1, f"Expect 1 waiter, but got {pool.waiters}"
+
+    # And it should stop waiting once the connection is returned
+    await greenlet_spawn(first.close)
+    await greenlet_spawn((await second).close)
+    assert pool.waiters == 0, f"Expect no waiter, but got {pool.waiters}"
+
+@pytest.mark.small
+def test_statement_cached_per_model_and_operation():
+    # Given I build the insert statement of users ignoring id conflicts.
+    stmt = postgres._statement(models.User, 'insert_on_conflict_do_nothing',
+        postgres._insert_on_conflict_do_nothing_stmt, ('id',))
+
+    # When I ask for it again
+    # Then I should get the same statement.
+    again = postgres._statement(models.User, 'insert_on_conflict_do_nothing',
+        postgres._insert_on_conflict_do_nothing_stmt, ('id',))
+    assert again is stmt, "Statement should be built once."
+
+    # And it should bind every column.
+    sql = str(stmt)
+    for column in models.User.__table__.columns:
+        assert f':{column.name}' in sql,\
+            f"Column {column.name} should be bound in:\n{sql}"
+    assert 'ON CONFLICT (id) DO NOTHING' in sql,\
+        f"Got unexpected statement:\n{sql}"
+
+def _target(session: postgres.Session) -> str:
+    url = session._session.bind.url
+    return f"{url.host}:{url.port}"
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_read_only_session_routing():
+    # Given a primary and two replicas, one of them down.
+    sessionmaker = postgres.create_sessionmaker(helper.get_config(
+        postgres_replica_hosts=["replica-a", "replica-b:5433"]))
+    sessionmaker._replicas[1].mark_down("test")
+
+    try:
+        # When I make read-only sessions
+        # Then they should go to the healthy replica.
+        targets = {_target(sessionmaker(read_only=True)) for _ in range(4)}
+        assert targets == {"replica-a:5432"}, f"Got unexpected targets {targets}"
+
+        # And other sessions should go to the primary.
+        target = _target(sessionmaker())
+        assert target == "localhost:5432", f"Got unexpected target {target}"
+
+        # When a key was just written
+        await sessionmaker.mark_written("user@example.com")
+
+        # Then reads of it should go to the primary.
+        target = _target(sessionmaker(read_only=True, keys=["user@example.com"]))
+        assert target == "localhost:5432", f"Got unexpected target {target}"
+        target = _target(sessionmaker(read_only=True, keys=["other@example.com"]))
+        assert target == "replica-a:5432", f"Got unexpected target {target}"
+
+        # When every replica is down
+        sessionmaker._replicas[0].mark_down("test")
+
+        # Then reads should go to the primary.
+        target = _target(sessionmaker(read_only=True))
+        assert target == "localhost:5432", f"Got unexpected target {target}"
+    finally:
+        await sessionmaker.close()
+
+class StubRedis:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_read_your_writes_across_processes():
+    # Given two processes sharing written keys on Redis, with a replica.
+    redis_client = StubRedis()
+    conf = helper.get_config(postgres_replica_hosts=["replica-a"],
+        postgres_read_your_writes_redis=True)
+    writer = postgres.create_sessionmaker(conf, redis_client)
+    reader = postgres.create_sessionmaker(conf, redis_client)
+
+    try:
+        # When one process writes a key
+        await writer.mark_written("user@example.com")
+
+        # Then the other should read it from the primary.
+        session = reader(read_only=True, keys=["user@example.com"])
+        rerouted = await session._reroute()
+        assert rerouted is not None and\
+            rerouted.bind.url.host == "localhost",\
+            f"Got unexpected session {rerouted}"
+
+        # And other keys from the replica.
+        session = reader(read_only=True, keys=["other@example.com"])
+        rerouted = await session._reroute()
+        assert rerouted is None, f"Got unexpected session {rerouted}"
+        assert _target(session) == "replica-a:5432",\
+            f"Got unexpected target {_target(session)}"
+    finally:
+        await writer.close()
+        await reader.close()
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_read_only_session_falls_back_to_primary():
+    # Given a replica refusing connections, and a primary refusing too, so
+    # the test sees where the session went.
+    sessionmaker = postgres.create_sessionmaker(helper.get_config(
+        postgres_host="127.0.0.1", postgres_port="1",
+        postgres_replica_hosts=["127.0.0.1:2"]))
+
+    try:
+        # When I begin a read-only session
+        with pytest.raises(OSError) as e:
+            async with sessionmaker(read_only=True) as session:
+                await session.select_row(sa.text("SELECT 1"))
+
+        # Then it should have tried the primary after the replica.
+        assert "'127.0.0.1', 1" in str(e.value), f"Got unexpected error {e.value}"
+
+        # And the replica should be marked down.
+        stats = sessionmaker.replica_stats()
+        assert not stats[0].healthy, f"Replica should be down: {stats}"
+    finally:
+        await sessionmaker.close()
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_prewarm_unreachable():
+    # Given a primary and a replica refusing connections.
+    sessionmaker = postgres.create_sessionmaker(helper.get_config(
+        postgres_host="127.0.0.1", postgres_port="1",
+        postgres_replica_hosts=["127.0.0.1:2"]))
+
+    try:
+        # When I prewarm the pools
+        with pytest.raises(OSError) as e:
+            await sessionmaker.prewarm(2)
+
+        # Then the error should be the primary's.
+        assert "'127.0.0.1', 1" in str(e.value), f"Got unexpected error {e.value}"
+
+        # And the replica should be marked down, and no connection left open.
+        stats = sessionmaker.replica_stats()
+        assert not stats[0].healthy, f"Replica should be down: {stats}"
+        pool = sessionmaker.pool_stats()
+        assert pool.checked_out == 0, f"Got unexpected pool stats {pool}"
+    finally:
+        await sessionmaker.close()
+
+class StubOrmSession:
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.begun = False
+
+    async def begin(self):
+        if self.error:
+            raise self.error
+        self.begun = True
+
+    async def connection(self, execution_options=None):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+    async def close(self):
+        pass
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_session_falls_back_on_postgres_error():
+    # Given a replica rejecting the connection, like a failed authentication
+    errors = []
+    primary = StubOrmSession()
+    def fallback(e):
+        errors.append(e)
+        return primary
+    session = postgres.Session(StubOrmSession(
+        asyncpg.InvalidPasswordError("password authentication failed")),
+        fallback=fallback)
+
+    # When I begin the session
+    async with session:
+        pass
+
+    # Then it should have fallen back to the primary.
+    assert primary.begun, "Session should begin on the primary."
+    assert len(errors) == 1 and\
+        isinstance(errors[0], asyncpg.InvalidPasswordError),\
+        f"Got unexpected errors {errors}"
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_replica_checks_survive_unexpected_error():
+    # Given a replica whose check fails unexpectedly, once
+    sessionmaker = postgres.create_sessionmaker(helper.get_config(
+        postgres_replica_hosts=["replica-a"]))
+    sessionmaker._check_interval = 0.01
+    replica = sessionmaker._replicas[0]
+    checks = []
+    async def check(timeout, max_lag):
+        checks.append(True)
+        if len(checks) == 1:
+            raise RuntimeError("unexpected")
+    replica.check = check
+
+    try:
+        # When reads start the checks, and the first one fails
+        sessionmaker(read_only=True)
+        await asyncio.sleep(0.1)
+
+        # Then the replica should be marked down
+        assert not replica.healthy, "Replica should be marked down."
+
+        # And the checks should go on.
+        assert not sessionmaker._checks.done(), "Checks should keep running."
+        assert len(checks) > 1, f"Expect checks to go on, but got {len(checks)}"
+    finally:
+        await sessionmaker.close()
@@ -0,0 +1,54 @@
+"""Test profiling."""
+import asyncio
+import json
+import fastapi
+import httpx
+import pytest
+from basic_app.lib import profiling
+from tests import helper
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_header_triggered_profile(tmp_path, monkeypatch):
+    # Given an app with a traced handler and profiling by header.
+    monkeypatch.setattr(profiling, '_profiler', None)
+    profiling.setup(helper.get_config(
+        profiling_token='secret',
+        profiling_threshold_ms=1000.0,
+        profiling_dir=str(tmp_path),
+        profiling_max_dumps=10,
+    ))
+    app = fastapi.FastAPI()
+    app.add_middleware(profiling.Middleware)
+
+    @profiling.traced('handler')
+    async def handle():
+        with profiling.span('db.select'):
+            pass
+
+    @app.get('/ping')
+    async def ping():
+        await handle()
+        return {}
+
+    async with httpx.AsyncClient(app=app, base_url='http://localhost') as ac:
+        # When I send a request without the token and one with it.
+        await ac.get('/ping', headers={'X-Profile': 'wrong'})
+        await ac.get('/ping', headers={'X-Profile': 'secret'})
+    # Dumps are written in the default executor.
+    for _ in range(100):
+        if list(tmp_path.iterdir()):
+            break
+        await asyncio.sleep(0.01)
+
+    # Then only the request with the token should be dumped.
+    files = list(tmp_path.iterdir())
+    assert len(files) == 1, f"Got unexpected dumps {files}"
+
+    # And it should have the span tree.
+    tree = json.loads(files[0].read_text())
+    handler = tree['children'][0]
+    assert handler['name'] == 'handler',\
+        f"Got unexpected span \"{handler['name']}\""
+    assert handler['children'][0]['name'] == 'db.select',\
+        f"Got unexpected span \"{handler['children'][0]['name']}\""
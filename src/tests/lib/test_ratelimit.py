@@ -0,0 +1,40 @@
+"""Test file for basic_app.lib.ratelimit"""
+import pytest
+from basic_app.lib import ratelimit
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_sliding_window():
+    # Given 4 requests per 10 seconds are allowed, starting a window.
+    clock = Clock(1000.0)
+    limiter = ratelimit.InMemoryRateLimiter(max_keys=10, clock=clock)
+    limit = ratelimit.Limit(requests=4, window=10)
+
+    # When I send 5 requests at once
+    results = [await limiter.acquire('ip:1', limit) for _ in range(5)]
+
+    # Then the 5th should be rejected until the next window has started
+    # and the previous one has faded enough.
+    assert results[:4] == [None] * 4, f"Got unexpected results {results}"
+    assert results[4] == pytest.approx(12.5),\
+        f"Got unexpected retry after {results[4]}"
+
+    # And other keys should not be limited.
+    assert await limiter.acquire('ip:2', limit) is None,\
+        "Another key should be allowed."
+
+    # When half of the next window has passed
+    clock.now = 1015.0
+
+    # Then half of the previous count should still count.
+    results = [await limiter.acquire('ip:1', limit) for _ in range(3)]
+    assert results[:2] == [None] * 2, f"Got unexpected results {results}"
+    assert results[2] == pytest.approx(2.5),\
+        f"Got unexpected retry after {results[2]}"
@@ -0,0 +1,46 @@
+"""Test JSON responses."""
+import datetime as dt
+import json
+import uuid
+import pytest
+from basic_app.lib import response
+from tests import helper
+
+class DriverUUID(uuid.UUID):
+    """Like the UUID subclass asyncpg returns for uuid columns."""
+
+@pytest.mark.small
+@pytest.mark.parametrize('response_class',
+    [response.JSONResponse, response.ORJSONResponse])
+def test_render_uuid_subclass(response_class):
+    # Given content with a UUID subclass and a datetime.
+    id = uuid.uuid4()
+    now = dt.datetime(2021, 7, 1, 12, 30, 15, 123456)
+    content = {'id': DriverUUID(str(id)), 'create_time': now}
+
+    # When I render it.
+    out = json.loads(response_class(content).body)
+
+    # Then both should be rendered as strings.
+    assert out['id'] == str(id),\
+        f"Got unexpected id \"{out['id']}\""
+    assert out['create_time'] == now.isoformat(),\
+        f"Got unexpected create_time \"{out['create_time']}\""
+
+@pytest.mark.small
+def test_setup_rejects_unknown_renderer():
+    # Given the renderer is misspelled
+    conf = helper.get_config(json_response='orjosn')
+
+    # When I set up responses
+    # Then it should refuse rather than fall back to a renderer.
+    with pytest.raises(ValueError):
+        response.setup(conf)
+
+    # And a known renderer should be picked as is.
+    response.setup(helper.get_config(json_response='json'))
+    try:
+        assert response.response_class() is response.JSONResponse,\
+            f"Got unexpected response class {response.response_class()}"
+    finally:
+        response.setup(helper.get_config(json_response='auto'))
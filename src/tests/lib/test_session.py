@@ -0,0 +1,68 @@
+"""Test session stores."""
+import pytest
+from basic_app.lib import session
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_in_memory_store_expire(monkeypatch):
+    # Given I create a session in a store with 60 seconds TTL.
+    now = 1000.0
+    monkeypatch.setattr(session.time, 'monotonic', lambda: now)
+    store = session.InMemorySessionStore(ttl=60)
+    data = session.SessionData(user_id='user1', email='user1@example.com',
+        provider='password')
+    session_id = await store.create(data)
+
+    # When I get it before the TTL
+    # Then I should get the session.
+    now += 59
+    assert await store.get(session_id) == data,\
+        "Session should be alive before TTL."
+
+    # When I get it after the TTL
+    # Then it should be gone.
+    now += 1
+    assert await store.get(session_id) is None,\
+        "Session should expire after TTL."
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_in_memory_store_bounded():
+    # Given a store of 2 sessions
+    store = session.InMemorySessionStore(ttl=60, max_size=2)
+    ids = []
+    for i in range(2):
+        ids.append(await store.create(session.SessionData(
+            user_id=f'user{i}', email=f'user{i}@example.com',
+            provider='password')))
+
+    # When I use the first session and create a third one
+    assert await store.get(ids[0]), "First session should be alive."
+    ids.append(await store.create(session.SessionData(
+        user_id='user2', email='user2@example.com', provider='password')))
+
+    # Then the least recently used session should be dropped.
+    assert await store.get(ids[1]) is None,\
+        "Least recently used session should be dropped."
+    assert await store.get(ids[0]) and await store.get(ids[2]),\
+        "Recently used sessions should be kept."
+
+@pytest.mark.small
+@pytest.mark.asyncio
+async def test_in_memory_store_delete_user_sessions():
+    # Given a user with two sessions, and another user
+    store = session.InMemorySessionStore(ttl=60)
+    def data(user_id):
+        return session.SessionData(user_id=user_id,
+            email=f'{user_id}@example.com', provider='password')
+    ids = [await store.create(data('user1')) for _ in range(2)]
+    other = await store.create(data('user2'))
+
+    # When I delete the sessions of the user
+    await store.delete_user_sessions('user1')
+
+    # Then only the sessions of the user should be gone.
+    for session_id in ids:
+        assert await store.get(session_id) is None,\
+            "Sessions of the user should be deleted."
+    assert await store.get(other), "Sessions of others should be kept."
@@ -0,0 +1,151 @@
+"""Test Google sign-in APIs."""
+import dataclasses
+import pytest
+import httpx
+from basic_app import (
+    routers,
+    services,
+)
+from basic_app.lib import (
+    google_id_token,
+    session,
+)
+from tests import helper
+
+CLIENT_ID = 'test-client-id'
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_signin_view_lazy_controller():
+    # Given the controller is constructed lazily.
+    built = []
+    def factory():
+        built.append(True)
+        return routers.GoogleSignin('localhost', 'test-client-id', None, None,
+            session.InMemorySessionStore(ttl=60),
+            session.Cookie(name='session_id', max_age=60, secure=False))
+    routers.GoogleSignin.lazy(factory)
+    assert not built, "Controller should not be constructed before a request."
+
+    # When I request the sign-in page twice.
+    async with helper.get_http_client() as ac:
+        for _ in range(2):
+            resp: httpx.Response = await ac.get(url='/google-signin')
+
+            # Then the page should be rendered with the client id.
+            assert resp.status_code == 200,\
+                f"Got unexpect status code {resp.status_code}"
+            assert 'test-client-id' in resp.text,\
+                "Client id should be rendered in the page."
+
+    # And the controller should be constructed once.
+    assert len(built) == 1, f"Controller constructed {len(built)} times."
+
+@dataclasses.dataclass
+class StubUserService:
+    signin_cmd: services.ExternalSigninCommand = None
+
+    async def signin_external(self, cmd: services.ExternalSigninCommand,
+        ) -> services.ExternalSigninResult:
+        self.signin_cmd = cmd
+        return services.ExternalSigninResult(
+            id='40c0813a-6805-40e7-9f49-3ee69d6e0c98',
+            email=cmd.email,
+            username=cmd.username,
+            created=True,
+        )
+
+def setup_routers(certs_url: str, service) -> google_id_token.GoogleIdTokenVerifier:
+    """Setup Google sign-in and session endpoints sharing a store."""
+    verifier = google_id_token.GoogleIdTokenVerifier(
+        CLIENT_ID, certs_url=certs_url)
+    store = session.InMemorySessionStore(ttl=60)
+    cookie = session.Cookie(name='session_id', max_age=60, secure=False)
+    routers.GoogleSignin('localhost', CLIENT_ID, verifier, service,
+        store, cookie)
+    routers.Session(store, cookie)
+    return verifier
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_google_signin_session_of_local_user():
+    with helper.GoogleCertsServer() as server:
+        # Given I setup Google sign-in endpoints.
+        service = StubUserService()
+        verifier = setup_routers(server.url, service)
+
+        async with helper.get_http_client() as ac:
+            # When I sign in with an ID token.
+            resp: httpx.Response = await ac.post(url='/google-signin',
+                data={'credential': server.sign(CLIENT_ID, name='User One'),
+                    'csrf_token': 'token'},
+                cookies={'csrf_cookie': 'token'})
+
+            # Then I should get our user.
+            assert resp.status_code == 200,\
+                f"Got unexpect status code {resp.status_code}"
+            out = resp.json()
+            assert out['id'] == '40c0813a-6805-40e7-9f49-3ee69d6e0c98',\
+                f"Got unexpect id \"{out['id']}\" in response."
+            assert service.signin_cmd.username == 'User One',\
+                f"Got unexpect username \"{service.signin_cmd.username}\""
+
+            # And the session should be of our user id, not Google's.
+            resp = await ac.get(url='/session')
+            out = resp.json()
+            assert out['user_id'] == '40c0813a-6805-40e7-9f49-3ee69d6e0c98',\
+                f"Got unexpect user_id \"{out['user_id']}\" in session."
+            assert out['provider'] == 'google',\
+                f"Got unexpect provider \"{out['provider']}\" in session."
+
+        # Cleanup
+        await verifier.close()
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_google_signin_unverified_email():
+    with helper.GoogleCertsServer() as server:
+        # Given I setup Google sign-in endpoints.
+        service = StubUserService()
+        verifier = setup_routers(server.url, service)
+
+        # When I sign in with an unverified email.
+        async with helper.get_http_client() as ac:
+            resp: httpx.Response = await ac.post(url='/google-signin',
+                data={'credential': server.sign(CLIENT_ID,
+                    email_verified=False), 'csrf_token': 'token'},
+                cookies={'csrf_cookie': 'token'})
+
+        # Then it should be rejected without a user.
+        assert resp.status_code == 401,\
+            f"Got unexpect status code {resp.status_code}"
+        assert service.signin_cmd is None, "No user should be signed in."
+
+        # Cleanup
+        await verifier.close()
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_google_signin_csrf():
+    with helper.GoogleCertsServer() as server:
+        # Given I setup Google sign-in endpoints.
+        service = StubUserService()
+        verifier = setup_routers(server.url, service)
+        credential = server.sign(CLIENT_ID)
+
+        async with helper.get_http_client() as ac:
+            # When I post without the CSRF cookie, or with another token.
+            for cookies in ({}, {'csrf_cookie': 'other'}):
+                resp: httpx.Response = await ac.post(url='/google-signin',
+                    data={'credential': credential, 'csrf_token': 'token'},
+                    cookies=cookies)
+
+                # Then it should be rejected.
+                assert resp.status_code == 400,\
+                    f"Got unexpect status code {resp.status_code}"
+
+        # And no user should be signed in.
+        assert service.signin_cmd is None, "No user should be signed in."
+
+        # Cleanup
+        await verifier.close()
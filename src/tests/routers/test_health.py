@@ -0,0 +1,52 @@
+"""Test health APIs."""
+import pytest
+import httpx
+from basic_app import routers
+from basic_app.lib import lifecycle
+from tests import helper
+from tests.routers.test_status import StubSessionMaker
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_readyz_request():
+    # Given I setup health endpoints, with a dependency check I can fail.
+    down = False
+    async def check():
+        if down:
+            raise ConnectionError("refused")
+    app_lifecycle = lifecycle.Lifecycle(warmup_timeout=1, check_timeout=1)
+    app_lifecycle.add_check("postgres", check)
+    routers.Health(app_lifecycle, StubSessionMaker())
+
+    async with helper.get_http_client() as ac:
+        # When I send a readiness request before warm-up
+        resp: httpx.Response = await ac.get(url="/readyz")
+
+        # Then it should not be ready, while alive.
+        assert resp.status_code == 503,\
+            f"Got unexpect status code {resp.status_code}"
+        resp = await ac.get(url="/healthz")
+        assert resp.status_code == 200 and resp.json()["warm"] is False,\
+            f"Got unexpected response {resp.status_code} {resp.text}"
+
+        # When it is warmed up
+        await app_lifecycle.startup()
+        resp = await ac.get(url="/readyz")
+
+        # Then it should be ready, with the pool status.
+        assert resp.status_code == 200,\
+            f"Got unexpect status code {resp.status_code}"
+        body = resp.json()
+        assert body["checks"] == {"postgres": "ok"} and\
+            body["postgres_pool"]["idle"] == 4, f"Got unexpected body {body}"
+
+        # When the dependency goes down
+        down = True
+        resp = await ac.get(url="/readyz")
+
+        # Then it should not be ready anymore.
+        assert resp.status_code == 503,\
+            f"Got unexpect status code {resp.status_code}"
+        checks = resp.json()["checks"]
+        assert checks == {"postgres": "ConnectionError: refused"},\
+            f"Got unexpected checks {checks}"
@@ -0,0 +1,75 @@
+"""Test status APIs."""
+import pytest
+import httpx
+from basic_app import routers
+from basic_app.lib import (
+    password,
+    postgres,
+)
+from tests import helper
+
+class StubScheduler:
+    def stats(self) -> password.HashSchedulerStats:
+        return password.HashSchedulerStats(
+            limit=1, running=0, memory_kib=0, queue_depth=0, admitted=0,
+            rejected=0, timed_out=0, wait_seconds_total=0.0,
+            wait_seconds_max=0.0)
+
+class StubSessionMaker:
+    def pool_stats(self) -> postgres.PoolStats:
+        return postgres.PoolStats(
+            size=5, checked_out=1, idle=4, overflow=0, waiters=0,
+            checkouts=1, wait_seconds_total=0.0, wait_seconds_max=0.0)
+
+    def replica_stats(self):
+        return [postgres.ReplicaStats(
+            name="replica:5432", healthy=True, lag_seconds=0.5, reads=3)]
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_metrics_request():
+    # Given I setup a status endpoint.
+    routers.Status(StubScheduler(), StubSessionMaker())
+
+    async with helper.get_http_client() as ac:
+        # When I send a status request and then a metrics request.
+        await ac.get(url='/status')
+        resp: httpx.Response = await ac.get(url='/metrics')
+
+    # Then the earlier request should be counted under its route template.
+    assert resp.status_code == 200,\
+        f"Got unexpect status code {resp.status_code}"
+    line = 'http_request_duration_seconds_count{method="GET",route="/status",status="200"}'
+    assert line in resp.text, f"\"{line}\" should be in metrics."
+
+    # And gauges should be read from the stats.
+    line = 'postgres_pool_connections{state="checked_out"} 1.0'
+    assert line in resp.text, f"\"{line}\" should be in metrics."
+    line = 'postgres_replica_healthy{replica="replica:5432"} 1.0'
+    assert line in resp.text, f"\"{line}\" should be in metrics."
+
+    # And hashing rejections and pool waits should be exported.
+    for line in ('password_hasher_rejected_total{reason="queue_full"}',
+        'postgres_pool_wait_seconds_count'):
+        assert line in resp.text, f"\"{line}\" should be in metrics."
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_status_token_required():
+    # Given I setup a status endpoint behind a token.
+    routers.Status(StubScheduler(), StubSessionMaker(), token='secret')
+
+    async with helper.get_http_client() as ac:
+        # When I send requests without and with the token.
+        anonymous = [await ac.get(url=url) for url in ('/status', '/metrics')]
+        wrong: httpx.Response = await ac.get(url='/metrics',
+            headers={'Authorization': 'Bearer guess'})
+        authorized: httpx.Response = await ac.get(url='/metrics',
+            headers={'Authorization': 'Bearer secret'})
+
+    # Then only the request with the token should be answered.
+    for resp in (*anonymous, wrong):
+        assert resp.status_code == 401,\
+            f"Got unexpect status code {resp.status_code}"
+    assert authorized.status_code == 200,\
+        f"Got unexpect status code {authorized.status_code}"
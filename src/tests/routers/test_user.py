@@ -9,8 +9,23 @@ from basic_app import (
     routers,
     services,
 )
+from basic_app.lib import (
+    idempotency,
+    ratelimit,
+    session,
+)
 from tests import helper
 
+def setup_routers(service,
+    idem: idempotency.Idempotency = None,
+    rate_limit: ratelimit.Rule = None) -> session.SessionStore:
+    """Setup user and session endpoints sharing an in-memory store."""
+    store = session.InMemorySessionStore(ttl=60)
+    cookie = session.Cookie(name='session_id', max_age=60, secure=False)
+    routers.User(service, store, cookie, idem, rate_limit)
+    routers.Session(store, cookie)
+    return store
+
 def get_signup_request_body():
     return {
         'id':'40c0813a-6805-40e7-9f49-3ee69d6e0c98',
@@ -34,6 +49,9 @@ class StubUserService:
     signup_cmd:services.SignupCommand = None
     signup_result: services.SignupResult = None
     signup_raise: Type[Exception] = None
+    login_cmd: services.LoginCommand = None
+    login_result: services.LoginResult = None
+    rehash_cmd: services.RehashCommand = None
 
     async def signup(self, cmd: services.SignupCommand) -> services.SignupResult:
         self.signup_cmd = cmd
@@ -41,13 +59,20 @@ class StubUserService:
             raise self.signup_raise
         return self.signup_result
 
+    async def login(self, cmd: services.LoginCommand) -> services.LoginResult:
+        self.login_cmd = cmd
+        return self.login_result
+
+    async def rehash_password(self, cmd: services.RehashCommand):
+        self.rehash_cmd = cmd
+
 @pytest.mark.medium
 @pytest.mark.asyncio
 async def test_signup_request():
     # Given I setup an user endpoint.
     signup_result = get_signup_result()
     stub_service = StubUserService(signup_result=signup_result)
-    routers.User(stub_service)
+    setup_routers(stub_service)
 
     # When I send a signup request.
     body = get_signup_request_body()
@@ -82,24 +107,216 @@ async def test_signup_request():
     assert helper.parse_datetime(out['update_time']) == signup_result.update_time,\
         f"Got unexpect update_time \"{out['update_time']}\" in signup response."
 
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_signup_request_idempotency_key():
+    # Given I setup an user endpoint with idempotency keys.
+    signup_result = get_signup_result()
+    stub_service = StubUserService(signup_result=signup_result)
+    setup_routers(stub_service, idempotency.Idempotency(
+        idempotency.InMemoryIdempotencyStore(ttl=60, max_size=10),
+        wait_timeout=1))
+
+    body = get_signup_request_body()
+    headers = {'Idempotency-Key': 'key1'}
+    async with helper.get_http_client() as ac:
+        # When I send a signup request with a key.
+        first: httpx.Response = await ac.post(
+            url='/signup', json=body, headers=headers)
+        stub_service.signup_cmd = None
+
+        # And I retry it.
+        retry: httpx.Response = await ac.post(
+            url='/signup', json=body, headers=headers)
+
+    # Then the retry should get the stored response without signing up.
+    assert stub_service.signup_cmd is None,\
+        "signup service should not be called by the retry."
+    assert retry.status_code == first.status_code,\
+        f"Got unexpect status code {retry.status_code} of retry."
+    assert retry.json() == first.json(),\
+        f"Got unexpect response {retry.json()} of retry."
+    assert retry.headers.get('Idempotent-Replayed') == 'true',\
+        "Retry should be marked as replayed."
+
 def get_login_request_body():
     return {
         'email': 'user1@example.com',
         'password': 'password1'
     }
 
+def get_login_result():
+    now = dt.datetime.now()
+    return services.LoginResult(
+        id='40c0813a-6805-40e7-9f49-3ee69d6e0c98',
+        email='user1@example.com',
+        username='user1',
+        create_time=now,
+        update_time=now,
+    )
+
 @pytest.mark.medium
 @pytest.mark.asyncio
 async def test_login_request():
     # Given I setup an user endpoint.
     login_result = get_login_result()
-    stub_service = StubUserService(signup_result=signup_result)
-    routers.User(stub_service)
+    stub_service = StubUserService(login_result=login_result)
+    setup_routers(stub_service)
 
-    # When I send a signup request.
-    body = get_signup_request_body()
+    # When I send a login request.
+    body = get_login_request_body()
     async with helper.get_http_client() as ac:
         resp: httpx.Response = await ac.post(
-            url='/signup',
+            url='/login',
             json=body)
 
+    # Then I should get expected LoginCommand
+    cmd = stub_service.login_cmd
+    assert cmd, "login service should be called."
+
+    assert cmd.email == body['email'],\
+        f"Got unexpect email \"{cmd.email}\" in login command."
+    assert cmd.password == body['password'],\
+        f"Got unexpect password \"{cmd.password}\" in login command."
+
+    # And I should get expected LoginResponse
+    out = resp.json()
+    assert out['id'] == login_result.id,\
+        f"Got unexpect id \"{out['id']}\" in login response."
+    assert out['email'] == login_result.email,\
+        f"Got unexpect email \"{out['email']}\" in login response."
+    assert out['username'] == login_result.username,\
+        f"Got unexpect username \"{out['username']}\" in login response."
+    create_time = helper.parse_datetime(out['create_time'])
+    assert create_time == login_result.create_time,\
+        f"Got unexpect create_time \"{create_time}\" in login response."
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_login_request_creates_session():
+    # Given I setup user and session endpoints.
+    login_result = get_login_result()
+    setup_routers(StubUserService(login_result=login_result))
+
+    async with helper.get_http_client() as ac:
+        # When I login.
+        resp: httpx.Response = await ac.post(
+            url='/login',
+            json=get_login_request_body())
+
+        # Then I should get a session cookie.
+        assert resp.cookies.get('session_id'), "Login should set session cookie."
+
+        # And the cookie should authenticate later requests.
+        resp = await ac.get(url='/session')
+        assert resp.status_code == 200,\
+            f"Got unexpect status code {resp.status_code}"
+        out = resp.json()
+        assert out['user_id'] == login_result.id,\
+            f"Got unexpect user_id \"{out['user_id']}\" in session."
+
+        # And the session should be gone after logout.
+        await ac.post(url='/logout')
+        ac.cookies.clear()
+        resp = await ac.get(url='/session')
+        assert resp.status_code == 401,\
+            f"Got unexpect status code {resp.status_code} after logout."
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_logout_all_request():
+    # Given I login twice, as from two devices.
+    setup_routers(StubUserService(login_result=get_login_result()))
+    async with helper.get_http_client() as ac, helper.get_http_client() as other:
+        for client in (ac, other):
+            await client.post(url='/login', json=get_login_request_body())
+
+        # When I logout everywhere from one of them.
+        resp: httpx.Response = await ac.post(url='/logout-all')
+        assert resp.status_code == 200,\
+            f"Got unexpect status code {resp.status_code}"
+
+        # Then the other session should be gone too.
+        resp = await other.get(url='/session')
+        assert resp.status_code == 401,\
+            f"Got unexpect status code {resp.status_code} after logout-all."
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_login_request_rehash_after_response():
+    # Given the login service asks for a rehash.
+    login_result = get_login_result()
+    login_result.rehash = services.RehashCommand(
+        id=login_result.id,
+        password='password1',
+        old_hash='this is an outdated hash',
+    )
+    stub_service = StubUserService(login_result=login_result)
+    setup_routers(stub_service)
+
+    # When I send a login request.
+    async with helper.get_http_client() as ac:
+        resp: httpx.Response = await ac.post(
+            url='/login',
+            json=get_login_request_body())
+
+    # Then the rehash should run as a background task.
+    assert resp.status_code == 200,\
+        f"Got unexpect status code {resp.status_code}"
+    assert stub_service.rehash_cmd == login_result.rehash,\
+        "rehash_password should be called after response."
+    assert 'rehash' not in resp.json(), "Rehash should not be in response."
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_login_request_rate_limited_by_email():
+    # Given one login per email is allowed per minute.
+    stub_service = StubUserService(login_result=get_login_result())
+    setup_routers(stub_service, rate_limit=ratelimit.Rule(
+        ratelimit.InMemoryRateLimiter(max_keys=10), 'email',
+        ratelimit.Limit(requests=1, window=60)))
+
+    async with helper.get_http_client() as ac:
+        # When I login twice with the same email in different cases.
+        await ac.post(url='/login', json=get_login_request_body())
+        body = get_login_request_body()
+        body['email'] = body['email'].upper()
+        stub_service.login_cmd = None
+        resp: httpx.Response = await ac.post(url='/login', json=body)
+
+    # Then the second login should be rejected before the service.
+    assert resp.status_code == 429,\
+        f"Got unexpect status code {resp.status_code}"
+    assert resp.json()['error']['status'] == 'TOO_MANY_REQUESTS',\
+        f"Got unexpect error {resp.json()}"
+    assert 0 < int(resp.headers['Retry-After']) <= 120,\
+        f"Got unexpect Retry-After {resp.headers.get('Retry-After')}"
+    assert stub_service.login_cmd is None, "login service should not be called."
+
+@pytest.mark.medium
+@pytest.mark.asyncio
+async def test_signup_request_rate_limited_by_ip():
+    # Given two POST requests per client IP are allowed per minute.
+    stub_service = StubUserService(signup_result=get_signup_result())
+    setup_routers(stub_service)
+    ratelimit.setup(ratelimit.Rule(
+        ratelimit.InMemoryRateLimiter(max_keys=10), 'ip',
+        ratelimit.Limit(requests=2, window=60)), paths=['/signup'])
+
+    try:
+        async with helper.get_http_client() as ac:
+            # When I send three signup requests.
+            statuses = [(await ac.post(url='/signup',
+                json=get_signup_request_body())).status_code
+                for _ in range(3)]
+
+            # Then the third should be rejected.
+            assert statuses == [200, 200, 429],\
+                f"Got unexpect status codes {statuses}"
+
+            # And other paths should not be limited.
+            resp = await ac.get(url='/session')
+            assert resp.status_code == 401,\
+                f"Got unexpect status code {resp.status_code}"
+    finally:
+        ratelimit.setup(None, paths=())
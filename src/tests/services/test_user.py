@@ -1,9 +1,15 @@
 """Test user API."""
 from typing import Type
+import asyncio
 import datetime as dt
 import dataclasses
 import pytest
-from basic_app.lib import password
+from basic_app.lib import (
+    cache,
+    exception,
+    password,
+    postgres,
+)
 from basic_app import (
     services,
     daos,
@@ -37,29 +43,63 @@ class StubUserDao:
     signup_cmd:daos.CreateUserCommand = None
     signup_result: daos.CreateUserResult = None
     signup_raise: Type[Exception] = None
+    credential: daos.Credential = None
+    user: models.User = None
+    updated_password: str = None
+    imported: list = dataclasses.field(default_factory=list)
+    signup_calls: int = 0
+    signup_delay: float = 0
 
     async def create_user(self,
         cmd: daos.CreateUserCommand) -> daos.CreateUserResult:
         self.signup_cmd = cmd
+        self.signup_calls += 1
+        if self.signup_delay:
+            await asyncio.sleep(self.signup_delay)
         if self.signup_raise:
             raise self.signup_raise
         return self.signup_result
 
+    async def import_users(self, cmds):
+        # Created unless the email was imported before.
+        emails = {cmd.email for cmd in self.imported}
+        created = {cmd.id for cmd in cmds if cmd.email not in emails}
+        self.imported.extend(cmd for cmd in cmds if cmd.id in created)
+        return created
+
+    async def get_user_by_email(self, email: str) -> models.User:
+        return self.user
+
+    async def get_credential(self, email: str) -> daos.Credential:
+        return self.credential
+
+    async def update_password(self, id, old_password, new_password,
+        update_time) -> bool:
+        if old_password != self.credential.password:
+            return False
+        self.updated_password = new_password
+        return True
+
 @dataclasses.dataclass
 class StubPasswordHasher(password.PasswordHasher):
     hashed_password: str = 'this is a hashed password'
     verifiy_result: bool = False
     need_rehash_result: bool = False
+    verified_hashes: list = dataclasses.field(default_factory=list)
 
-    def hash(self, password):
+    async def hash(self, password):
         return self.hashed_password
 
-    def verify(self, password: str, hash: str) -> bool:
+    async def verify(self, password: str, hash: str) -> bool:
+        self.verified_hashes.append(hash)
         return self.verifiy_result
 
-    def need_rehash_result(self, hash: str) -> bool:
+    def check_rehash(self, hash: str) -> bool:
         return self.need_rehash_result
 
+    async def hash_many(self, passwords, executor):
+        return [self.hashed_password for _ in passwords]
+
 @pytest.mark.asyncio
 async def test_signup():
     # Given I prepare signup command and user service.
@@ -97,3 +137,439 @@ async def test_signup():
         f"Got unexpect create_time \"{out.create_time}\" in signup response."
     assert out.update_time == expect.update_time,\
         f"Got unexpect update_time \"{out.update_time}\" in signup response."
+
+@pytest.mark.asyncio
+async def test_signup_email_conflict():
+    # Given the dao reports an existing user with the same email.
+    service_cmd = get_signup_command()
+    dao_signup_result = get_dao_signup_result()
+    dao_signup_result.conflict = True
+    dao_signup_result.user.id = 'a1b8f2b0-8f7c-4a6e-9a53-3a1b9f0c1d2e'
+    stub_dao = StubUserDao(signup_result=dao_signup_result)
+    service = services.User(dao=stub_dao, hasher=StubPasswordHasher())
+
+    # When I start doing signup
+    # Then I should get an email conflict error.
+    with pytest.raises(exception.AppException) as info:
+        await service.signup(service_cmd)
+    assert info.value.code == exception.ErrorCode.EMAIL_ALEADY_EXISTS,\
+        f"Got unexpected error code \"{info.value.code}\""
+
+@pytest.mark.asyncio
+async def test_signup_coalesce_duplicates():
+    # Given a slow dao, so signups overlap.
+    stub_dao = StubUserDao(signup_result=get_dao_signup_result(),
+        signup_delay=0.01)
+    service = services.User(dao=stub_dao, hasher=StubPasswordHasher())
+
+    # When the same signup is sent 3 times at once, along with another
+    # user id for the same email.
+    other = get_signup_command()
+    other.id = 'a1b8f2b0-8f7c-4a6e-9a53-3a1b9f0c1d2e'
+    outs = await asyncio.gather(
+        *(service.signup(get_signup_command()) for _ in range(3)),
+        service.signup(other),
+        return_exceptions=True)
+
+    # Then the dao should be called once.
+    assert stub_dao.signup_calls == 1,\
+        f"Got unexpected {stub_dao.signup_calls} dao calls."
+
+    # And the duplicates should share the result.
+    for out in outs[:3]:
+        assert isinstance(out, services.SignupResult),\
+            f"Got unexpected signup outcome {out!r}"
+        assert out.id == stub_dao.signup_result.user.id,\
+            f"Got unexpect id \"{out.id}\" in signup response."
+
+    # And the other user id should get an email conflict.
+    assert isinstance(outs[3], exception.AppException) and\
+        outs[3].code == exception.ErrorCode.EMAIL_ALEADY_EXISTS,\
+        f"Got unexpected signup outcome {outs[3]!r}"
+
+@pytest.mark.asyncio
+async def test_signin_external_creates_user():
+    # Given the email has no user yet.
+    stub_dao = StubUserDao(signup_result=get_dao_signup_result())
+    service = services.User(dao=stub_dao, hasher=StubPasswordHasher())
+
+    # When the user signs in with Google for the first time
+    out = await service.signin_external(services.ExternalSigninCommand(
+        email='user1@example.com', username='user1'))
+
+    # Then a user without a usable password should be created.
+    cmd = stub_dao.signup_cmd
+    assert cmd, "User should be created."
+    assert cmd.email == 'user1@example.com',\
+        f"Got unexpect email \"{cmd.email}\" in create command."
+    assert cmd.password == password.UNUSABLE_PASSWORD,\
+        f"Got unexpect password \"{cmd.password}\" in create command."
+
+    # And I should get our user id.
+    assert out.id == stub_dao.signup_result.user.id,\
+        f"Got unexpect id \"{out.id}\""
+    assert out.created, "User should be reported as created."
+
+@pytest.mark.asyncio
+async def test_signin_external_existing_user():
+    # Given the email signed up with a password.
+    user = get_dao_signup_result().user
+    stub_dao = StubUserDao(user=user)
+    service = services.User(dao=stub_dao, hasher=StubPasswordHasher())
+
+    # When the user signs in with Google
+    out = await service.signin_external(services.ExternalSigninCommand(
+        email='user1@example.com', username='someone'))
+
+    # Then I should get the existing user.
+    assert stub_dao.signup_calls == 0, "No user should be created."
+    assert out.id == user.id, f"Got unexpect id \"{out.id}\""
+    assert out.username == user.username,\
+        f"Got unexpect username \"{out.username}\""
+    assert not out.created, "User should not be reported as created."
+
+def get_login_command() -> services.LoginCommand:
+    return services.LoginCommand(
+        email='user1@example.com',
+        password='password1',
+    )
+
+def get_credential() -> daos.Credential:
+    return daos.Credential(
+        id='40c0813a-6805-40e7-9f49-3ee69d6e0c98',
+        password='this is a stored hash',
+        username='user1',
+        create_time=dt.datetime(2021, 7, 1, 12, 0),
+        update_time=dt.datetime(2021, 7, 1, 12, 0),
+    )
+
+@pytest.mark.asyncio
+async def test_login():
+    # Given the user exists and the password matches.
+    stub_dao = StubUserDao(credential=get_credential())
+    hasher = StubPasswordHasher(verifiy_result=True)
+    service = services.User(dao=stub_dao, hasher=hasher)
+
+    # When I start doing login
+    out: services.LoginResult = await service.login(get_login_command())
+
+    # Then I should get the user.
+    assert out.id == stub_dao.credential.id,\
+        f"Got unexpect id \"{out.id}\" in login response."
+    assert out.username == stub_dao.credential.username,\
+        f"Got unexpect username \"{out.username}\" in login response."
+
+    # And the password should not be rehashed.
+    assert out.rehash is None, "Password should not be rehashed."
+
+@pytest.mark.asyncio
+async def test_login_wrong_password():
+    # Given the password does not match.
+    stub_dao = StubUserDao(credential=get_credential())
+    hasher = StubPasswordHasher(verifiy_result=False)
+    service = services.User(dao=stub_dao, hasher=hasher)
+
+    # When I start doing login
+    # Then I should get an authentication error.
+    with pytest.raises(exception.AppException) as info:
+        await service.login(get_login_command())
+    assert info.value.code == exception.ErrorCode.AUTHENTICATION_FAIL,\
+        f"Got unexpected error code \"{info.value.code}\""
+
+@pytest.mark.asyncio
+async def test_login_unknown_email():
+    # Given the email is not registered, or has no password.
+    for credential in (None, dataclasses.replace(get_credential(),
+        password=password.UNUSABLE_PASSWORD)):
+        stub_dao = StubUserDao(credential=credential)
+        hasher = StubPasswordHasher(verifiy_result=True)
+        service = services.User(dao=stub_dao, hasher=hasher)
+
+        # When I start doing login
+        # Then I should get an authentication error.
+        with pytest.raises(exception.AppException) as info:
+            await service.login(get_login_command())
+        assert info.value.code == exception.ErrorCode.AUTHENTICATION_FAIL,\
+            f"Got unexpected error code \"{info.value.code}\""
+
+        # And a hash of the current parameters should be verified anyway.
+        assert hasher.verified_hashes == [hasher.hashed_password],\
+            f"Got unexpected verified hashes {hasher.verified_hashes}"
+
+@pytest.mark.asyncio
+async def test_login_rehash():
+    # Given the stored hash uses outdated parameters.
+    stub_dao = StubUserDao(credential=get_credential())
+    hasher = StubPasswordHasher(verifiy_result=True, need_rehash_result=True)
+    service = services.User(dao=stub_dao, hasher=hasher)
+
+    # When I start doing login
+    out: services.LoginResult = await service.login(get_login_command())
+
+    # Then login should ask for a rehash, without writing yet.
+    assert out.rehash, "Login should ask for a rehash."
+    assert stub_dao.updated_password is None,\
+        "Password should not be written during login."
+
+    # And rehashing should write the new hash over the old one.
+    await service.rehash_password(out.rehash)
+    assert stub_dao.updated_password == hasher.hashed_password,\
+        f"Got unexpected rehashed password \"{stub_dao.updated_password}\""
+
+@pytest.mark.asyncio
+async def test_import_users():
+    # Given 3 users to import, one of them already exists.
+    stub_dao = StubUserDao()
+    hasher = StubPasswordHasher()
+    service = services.User(dao=stub_dao, hasher=hasher)
+    await service.import_users([services.ImportUserCommand(
+        id='a1b8f2b0-8f7c-4a6e-9a53-3a1b9f0c1d2e',
+        email='user2@example.com',
+        username='user2',
+        password='password2',
+    )], executor=None)
+    cmds = [services.ImportUserCommand(
+        id=f'40c0813a-6805-40e7-9f49-3ee69d6e0c9{i}',
+        email=f'user{i}@example.com',
+        username=f'user{i}',
+        password=f'password{i}',
+    ) for i in range(1, 4)]
+
+    # When I import them in batches of 2.
+    out: services.ImportResult = await service.import_users(
+        cmds, executor=None, batch_size=2)
+
+    # Then the new users should be imported with hashed passwords.
+    assert out.imported == 2,\
+        f"Got unexpected number of imported users {out.imported}"
+    assert all(cmd.password == hasher.hashed_password
+        for cmd in stub_dao.imported),\
+        "Password should be encrypted in import command."
+
+    # And the existing one should be reported as conflict.
+    assert out.conflicts == [cmds[1]],\
+        f"Got unexpected conflicts {out.conflicts}"
+
+@pytest.mark.asyncio
+async def test_cached_dao_login_reads_current_credential():
+    # Given the dao reads through a cache, and the user logged in once.
+    stub_dao = StubUserDao(credential=get_credential())
+    dao = daos.CachedUser(stub_dao, cache.Cache(cache.LRUCache(10, 60)))
+    service = services.User(dao=dao, hasher=StubPasswordHasher(verifiy_result=True))
+    await service.login(get_login_command())
+
+    # When the password hash changes behind the cache
+    stub_dao.credential = dataclasses.replace(stub_dao.credential,
+        password='a new hash')
+    out = await dao.get_credential('user1@example.com')
+
+    # Then the new hash should be read.
+    assert out.password == 'a new hash', f"Got unexpected credential {out}"
+
+class RacingUserDao:
+    """Lookups read the table, then wait for release before returning."""
+    def __init__(self):
+        self.users = {}
+        self.release = asyncio.Event()
+
+    async def create_user(self, cmd: daos.CreateUserCommand):
+        user = models.User(id=cmd.id, email=cmd.email, username=cmd.username,
+            password=cmd.password, create_time=cmd.create_time,
+            update_time=cmd.update_time)
+        self.users[cmd.email] = user
+        return daos.CreateUserResult(conflict=False, user=user)
+
+    async def get_user_by_email(self, email: str):
+        user = self.users.get(email)
+        await self.release.wait()
+        return user
+
+    async def get_credential(self, email: str):
+        user = await self.get_user_by_email(email)
+        return user and daos.Credential(
+            id=user.id,
+            password=user.password,
+            username=user.username,
+            create_time=user.create_time,
+            update_time=user.update_time,
+        )
+
+@pytest.mark.asyncio
+async def test_cached_dao_login_miss_during_signup():
+    # Given the dao reads through a cache keeping absent users for a minute.
+    racing_dao = RacingUserDao()
+    dao = daos.CachedUser(racing_dao,
+        cache.Cache(cache.LRUCache(10, 60), negative_ttl=60))
+    service = services.User(dao=dao, hasher=StubPasswordHasher(verifiy_result=True))
+    email = get_signup_command().email
+
+    # When a login and a lookup miss, and the user signs up meanwhile
+    login = asyncio.ensure_future(service.login(get_login_command()))
+    lookup = asyncio.ensure_future(dao.get_user_by_email(email))
+    await asyncio.sleep(0)
+    await service.signup(get_signup_command())
+    racing_dao.release.set()
+    with pytest.raises(exception.AppException):
+        await login
+    assert await lookup is None, "Lookup started before signup should miss."
+
+    # Then the user should not read as missing afterwards.
+    user = await dao.get_user_by_email(email)
+    assert user and user.email == email, f"Got unexpected user {user}"
+    out = await service.login(get_login_command())
+    assert str(out.id) == get_signup_command().id,\
+        f"Got unexpected login result {out}"
+
+@pytest.mark.asyncio
+async def test_cached_dao_cross_fill_racing_delete():
+    # Given a lookup by email in flight, through the cache.
+    racing_dao = RacingUserDao()
+    user_cache = cache.Cache(cache.LRUCache(10, 60))
+    dao = daos.CachedUser(racing_dao, user_cache)
+    cmd = get_signup_command()
+    await racing_dao.create_user(daos.CreateUserCommand(
+        **dataclasses.asdict(cmd), create_time=dt.datetime.now(),
+        update_time=dt.datetime.now()))
+    lookup = asyncio.ensure_future(dao.get_user_by_email(cmd.email))
+    await asyncio.sleep(0)
+
+    # When the user is invalidated by id before the lookup returns
+    await user_cache.delete(f'user:id:{cmd.id}')
+    racing_dao.release.set()
+    await lookup
+
+    # Then neither key should be cached with what it loaded.
+    for key in (f'user:id:{cmd.id}', f'user:email:{cmd.email}'):
+        assert await user_cache.get(key) is cache.MISSING,\
+            f"Raced lookup should not be cached under {key}"
+
+@dataclasses.dataclass
+class CountingUserDao(StubUserDao):
+    credential_calls: int = 0
+
+    async def get_credential(self, email: str) -> daos.Credential:
+        self.credential_calls += 1
+        return self.credential
+
+@pytest.mark.asyncio
+async def test_cached_dao_login_unknown_email_cached():
+    # Given the dao reads through a cache, and the email is not registered.
+    stub_dao = CountingUserDao()
+    dao = daos.CachedUser(stub_dao,
+        cache.Cache(cache.LRUCache(10, 60), negative_ttl=60))
+    hasher = StubPasswordHasher(verifiy_result=True)
+    service = services.User(dao=dao, hasher=hasher)
+
+    # When I login twice
+    for _ in range(2):
+        with pytest.raises(exception.AppException):
+            await service.login(get_login_command())
+
+    # Then the database should be read once.
+    assert stub_dao.credential_calls == 1,\
+        f"Expect one credential query, but got {stub_dao.credential_calls}"
+
+    # And the dummy hash should still be verified each time.
+    assert len(hasher.verified_hashes) == 2,\
+        f"Got unexpected verified hashes {hasher.verified_hashes}"
+
+class VanishingConflictSession:
+    """Conflicts on insert, but finds no conflicting row."""
+    def __init__(self, maker):
+        self._maker = maker
+
+    async def __aenter__(self):
+        self._maker.statements += 1
+        return self
+
+    async def __aexit__(self, *_):
+        pass
+
+    async def insert_or_select_conflict(self, value, conflict_columns):
+        return postgres.InsertOrConflictResult(inserted=False, rows=[])
+
+    async def insert_many_or_select_conflict(self, model, values,
+        conflict_columns):
+        return postgres.InsertManyOrConflictResult(inserted=[], conflicts=[])
+
+    async def select(self, stmt):
+        return []
+
+class VanishingConflictSessionMaker:
+    def __init__(self):
+        self.statements = 0
+
+    def __call__(self, *args, **kwargs):
+        return VanishingConflictSession(self)
+
+    async def mark_written(self, *keys):
+        pass
+
+@pytest.mark.asyncio
+async def test_dao_signup_conflict_vanished():
+    # Given the row a signup conflicts with is deleted before it is read.
+    sessionmaker = VanishingConflictSessionMaker()
+    dao = daos.User(sessionmaker)
+    cmd = daos.CreateUserCommand(**dataclasses.asdict(get_signup_command()),
+        create_time=dt.datetime.now(), update_time=dt.datetime.now())
+
+    # When I create the user
+    # Then it should be retried once, then fail as retryable.
+    with pytest.raises(exception.AppException) as info:
+        await dao.create_user(cmd)
+    assert info.value.code == exception.ErrorCode.SERVER_BUSY,\
+        f"Got unexpected error code \"{info.value.code}\""
+    assert sessionmaker.statements == 2,\
+        f"Expect 2 attempts, but got {sessionmaker.statements}"
+
+@pytest.mark.asyncio
+async def test_dao_batched_signup_conflict_vanished():
+    # Given batched signups, whose conflicting rows are deleted meanwhile.
+    sessionmaker = VanishingConflictSessionMaker()
+    dao = daos.User(sessionmaker, batch_window=0.01)
+    now = dt.datetime.now()
+    cmds = [daos.CreateUserCommand(id=f'id{i}', email=f'user{i}@example.com',
+        username='user', password='hash', create_time=now, update_time=now)
+        for i in range(2)]
+
+    # When I create the users
+    outs = await asyncio.gather(*(dao.create_user(cmd) for cmd in cmds),
+        return_exceptions=True)
+
+    # Then each should fail as retryable rather than with an IndexError.
+    for out in outs:
+        assert isinstance(out, exception.AppException) and\
+            out.code == exception.ErrorCode.SERVER_BUSY,\
+            f"Got unexpected outcome {out!r}"
+
+@pytest.mark.asyncio
+async def test_import_users_reports_invalid():
+    # Given users to import, some of them malformed.
+    stub_dao = StubUserDao()
+    service = services.User(dao=stub_dao, hasher=StubPasswordHasher())
+    valid = services.ImportUserCommand(
+        id='40C0813A-6805-40E7-9F49-3EE69D6E0C91',
+        email='user1@example.com',
+        username='user1',
+        password='password1',
+    )
+    invalid = [
+        dataclasses.replace(valid, id='not-a-uuid'),
+        dataclasses.replace(valid, email='not an email'),
+        dataclasses.replace(valid, username=None),
+        dataclasses.replace(valid, password='p' * 257),
+    ]
+
+    # When I import them.
+    out: services.ImportResult = await service.import_users(
+        [*invalid, valid], executor=None, batch_size=2)
+
+    # Then only the valid user should be imported, with a canonical id.
+    assert out.imported == 1,\
+        f"Got unexpected number of imported users {out.imported}"
+    assert [cmd.id for cmd in stub_dao.imported] == [valid.id.lower()],\
+        f"Got unexpected imported users {stub_dao.imported}"
+
+    # And the others should be reported as invalid, not as conflicts.
+    assert out.invalid == invalid, f"Got unexpected invalid users {out.invalid}"
+    assert not out.conflicts, f"Got unexpected conflicts {out.conflicts}"